@@ -22,12 +22,15 @@ import csv
 import itertools
 import traceback
 
+import numpy as npy
+
 import arcinfo  # Import arcinfo license. Needed before arcpy import.
 import arcpy
 
 from cc_config import cc_env
 import cc_util
 import lm_master
+import lm_near
 from lm_config import tool_env as lm_env
 import lm_util
 
@@ -379,6 +382,29 @@ def pairs_from_list(pairings):
     return core_pairs, frm_cores
 
 
+def prune_core_pairs(corefc, core_pairs):
+    """Drop core pairs with bounding boxes farther apart than max distance.
+
+    Core areas are at least as far apart as their bounding boxes, so these
+    pairs would not be found by the near table.
+
+    """
+    boxes = lm_util.get_core_boxes(corefc, cc_env.core_fld)
+    core_pairs = [x for x in core_pairs
+                  if int(float(x[0])) in boxes and int(float(x[1])) in boxes]
+    if not core_pairs:
+        return core_pairs
+    box_dists = lm_near.box_distances(
+        [boxes[int(float(x[0]))] for x in core_pairs],
+        [boxes[int(float(x[1]))] for x in core_pairs])
+    kept_pairs = [core_pairs[x] for x in
+                  npy.where(box_dists <= cc_env.max_euc_dist)[0]]
+    lm_util.gprint("Skipped " + str(len(core_pairs) - len(kept_pairs)) +
+                   " core pairs with bounding boxes farther apart than the "
+                   "maximum Euclidean distance")
+    return kept_pairs
+
+
 def create_lnk_tbl(corefc, core_pairs, frm_cores):
     """Create link table file and limit based on near table results."""
     # Temporary query layers
@@ -407,6 +433,12 @@ def create_lnk_tbl(corefc, core_pairs, frm_cores):
         coreid_fld = arcpy.AddFieldDelimiters(corefc, cc_env.core_fld)
         oid_fld = arcpy.Describe(corefc).oidFieldName
 
+        if cc_env.max_euc_dist > 0:
+            core_pairs = prune_core_pairs(corefc, core_pairs)
+            kept_frm_cores = set(x[0] for x in core_pairs)
+            frm_cores = [x for x in frm_cores if x in kept_frm_cores]
+            no_cores = str(len(frm_cores))
+
         for core_no, frm_core in enumerate(frm_cores):
             # From cores
             expression = coreid_fld + " = " + frm_core
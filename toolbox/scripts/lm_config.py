@@ -72,6 +72,8 @@ def config_global(config, arg):
     config.ADJACENCYDIR = path.join(config.DATAPASSDIR, "adj")
     config.ADJACENCYDIR_OLD = path.join(proj_dir, "adj")
     config.CWDBASEDIR = path.join(config.DATAPASSDIR, "cwd")
+    config.COREINDEXDIR = path.join(config.DATAPASSDIR, "core_index")
+    config.CWDSTOREDIR = path.join(config.CWDBASEDIR, "store")
     config.CWDBASEDIR_OLD = path.join(proj_dir, "cwd")
     config.CWDSUBDIR_NM = "cw"
     config.LCCBASEDIR = path.join(config.DATAPASSDIR, "nlcc")
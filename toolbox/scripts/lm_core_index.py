@@ -0,0 +1,203 @@
+"""Index of core area raster cells.
+
+For each core area, stores the flat offsets of its cells in the core area
+raster in compressed sparse row (CSR) form, plus the window of the raster
+holding the core area.  The index is saved as .npy files that are memory
+mapped when loaded, so core area masks and lookups take time proportional
+to the number of core area cells rather than a pass over the raster.
+
+"""
+
+import os
+
+import numpy as npy
+
+import lm_cwd
+
+_FILE_NAMES = ('core_ids', 'ptrs', 'cells', 'windows', 'grid')
+
+
+def build_core_index(core_array):
+    """Return CSR index of cells in a core area array.
+
+    Cells with values of zero or less are not in a core area.  Returns
+    core IDs in ascending order, pointers into the cell offset array for
+    each core ID, cell offsets (ascending within each core area) and core
+    area windows as (first row, last row + 1, first column, last column
+    + 1) rows.
+
+    """
+    ncols = core_array.shape[1]
+    flat = core_array.ravel()
+    cells = npy.where(flat > 0)[0]
+    if len(cells) == 0:
+        return (npy.zeros(0, dtype='int32'), npy.zeros(1, dtype='int64'),
+                npy.zeros(0, dtype='int64'), npy.zeros((0, 4), dtype='int32'))
+    labels = flat[cells]
+    # Stable sort keeps cells in ascending order within each core area
+    order = npy.argsort(labels, kind='mergesort')
+    cells = cells[order].astype('int64')
+    labels = labels[order]
+    starts = npy.concatenate(([0], npy.where(labels[1:] != labels[:-1])[0]
+                              + 1))
+    core_ids = labels[starts].astype('int32')
+    ptrs = npy.concatenate((starts, [len(cells)])).astype('int64')
+
+    rows = cells // ncols
+    cols = cells % ncols
+    windows = npy.zeros((len(core_ids), 4), dtype='int32')
+    windows[:, 0] = npy.minimum.reduceat(rows, starts)
+    windows[:, 1] = npy.maximum.reduceat(rows, starts) + 1
+    windows[:, 2] = npy.minimum.reduceat(cols, starts)
+    windows[:, 3] = npy.maximum.reduceat(cols, starts) + 1
+    return core_ids, ptrs, cells, windows
+
+
+def save_core_index(index_dir, core_array, grid):
+    """Build index of a core area array and save it to index_dir."""
+    if not os.path.exists(index_dir):
+        os.makedirs(index_dir)
+    core_ids, ptrs, cells, windows = build_core_index(core_array)
+    grid_params = npy.array([grid.xmin, grid.ymax, grid.cell_size,
+                             grid.nrows, grid.ncols], dtype='float64')
+    for name, arr in zip(_FILE_NAMES,
+                         (core_ids, ptrs, cells, windows, grid_params)):
+        npy.save(os.path.join(index_dir, name + '.npy'), arr)
+
+
+def index_exists(index_dir):
+    """Return True if a saved core area index is found in index_dir."""
+    for name in _FILE_NAMES:
+        if not os.path.exists(os.path.join(index_dir, name + '.npy')):
+            return False
+    return True
+
+
+class CoreIndex(object):
+    """Core area cell index saved by save_core_index."""
+
+    def __init__(self, index_dir, mmap_mode='r'):
+        """Load (memory map) index files."""
+        self.index_dir = index_dir
+        arrays = []
+        for name in _FILE_NAMES:
+            arrays.append(npy.load(os.path.join(index_dir, name + '.npy'),
+                                   mmap_mode=mmap_mode))
+        self.core_ids, self.ptrs, self._cells, self.windows = arrays[:4]
+        grid_params = npy.asarray(arrays[4])
+        self.grid = lm_cwd.RasterGrid(grid_params[0], grid_params[1],
+                                      grid_params[2], grid_params[3],
+                                      grid_params[4])
+        self._cell_ids = None
+        self._cell_order = None
+
+    def _get_cell_ids(self):
+        """Return core ID of each cell in the cell offset array."""
+        if self._cell_ids is None:
+            self._cell_ids = npy.repeat(npy.asarray(self.core_ids),
+                                        npy.diff(self.ptrs))
+        return self._cell_ids
+
+    def _position(self, core):
+        """Return position of a core ID in the index, or None."""
+        pos = int(npy.searchsorted(self.core_ids, core))
+        if pos < len(self.core_ids) and self.core_ids[pos] == core:
+            return pos
+        return None
+
+    def cells(self, core):
+        """Return flat offsets of the cells in a core area."""
+        pos = self._position(core)
+        if pos is None:
+            return npy.zeros(0, dtype='int64')
+        return npy.asarray(self._cells[self.ptrs[pos]:self.ptrs[pos + 1]])
+
+    def window(self, core):
+        """Return window holding a core area, or None if not indexed."""
+        pos = self._position(core)
+        if pos is None:
+            return None
+        return tuple(int(val) for val in self.windows[pos])
+
+    def _window_cells(self, cells, window):
+        """Return positions within a window of cells inside the window."""
+        r0, r1, c0, c1 = window
+        rows = cells // self.grid.ncols
+        cols = cells % self.grid.ncols
+        inside = npy.where((rows >= r0) & (rows < r1) &
+                           (cols >= c0) & (cols < c1))[0]
+        return inside, rows[inside] - r0, cols[inside] - c0
+
+    def search_window(self, cores, reach):
+        """Return window holding cells within reach cells of core areas.
+
+        reach -- number of cells, e.g. from lm_cwd.max_reach
+        Returns None if none of the core areas are indexed.
+
+        """
+        if len(self.core_ids) == 0:
+            return None
+        cores = npy.atleast_1d(cores)
+        pos = npy.minimum(npy.searchsorted(self.core_ids, cores),
+                          len(self.core_ids) - 1)
+        pos = pos[npy.asarray(self.core_ids)[pos] == cores]
+        if len(pos) == 0:
+            return None
+        windows = npy.asarray(self.windows)[pos]
+        window = (int(windows[:, 0].min()), int(windows[:, 1].max()),
+                  int(windows[:, 2].min()), int(windows[:, 3].max()))
+        return self.grid.buffer_window(window, reach)
+
+    def window_cells(self, core, window):
+        """Return window rows and columns of core area cells in a window.
+
+        Windows may extend past the edges of the indexed grid.
+
+        """
+        inside, rows, cols = self._window_cells(self.cells(core), window)
+        return rows, cols
+
+    def mask(self, cores, window):
+        """Return mask of cells in a window belonging to any of cores."""
+        r0, r1, c0, c1 = window
+        mask = npy.zeros((r1 - r0, c1 - c0), dtype=bool)
+        for core in npy.atleast_1d(cores):
+            rows, cols = self.window_cells(core, window)
+            mask[rows, cols] = True
+        return mask
+
+    def labels_at(self, cells):
+        """Return core IDs at flat cell offsets, 0 where not in a core."""
+        cells = npy.asarray(cells, dtype='int64')
+        labels = npy.zeros(len(cells), dtype='int32')
+        if len(self._cells) == 0:
+            return labels
+        if self._cell_order is None:
+            self._cell_order = npy.argsort(self._cells, kind='mergesort')
+        order = self._cell_order
+        pos = npy.searchsorted(self._cells, cells, sorter=order)
+        pos = order[npy.minimum(pos, len(order) - 1)]
+        found = self._cells[pos] == cells
+        labels[found] = self._get_cell_ids()[pos[found]]
+        return labels
+
+    def zonal_min(self, values, window):
+        """Return core IDs and minimum value within each core area.
+
+        values -- array covering window, NaN for NoData
+        Core areas with no values in the window are left out.
+
+        """
+        inside, rows, cols = self._window_cells(npy.asarray(self._cells),
+                                                window)
+        cell_vals = values[rows, cols]
+        has_data = ~npy.isnan(cell_vals)
+        inside = inside[has_data]
+        cell_vals = cell_vals[has_data]
+        if len(inside) == 0:
+            return npy.zeros(0, dtype='int32'), cell_vals
+        # Cells are grouped by core area, so no sort is needed
+        cell_ids = self._get_cell_ids()[inside]
+        starts = npy.concatenate(([0], npy.where(cell_ids[1:] !=
+                                                 cell_ids[:-1])[0] + 1))
+        return cell_ids[starts], npy.minimum.reduceat(cell_vals, starts)
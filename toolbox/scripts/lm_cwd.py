@@ -0,0 +1,556 @@
+"""Cost-weighted distance engine.
+
+Pure Python/NumPy version of the 8-neighbour accumulative cost distance
+calculated by the Spatial Analyst CostDistance tool.  Returns a cost-weighted
+distance (CWD) array and an ArcGIS-compatible back direction array, so
+cost distance calculations can run without ArcGIS or a Spatial Analyst
+license.
+
+Resistance arrays use NaN for NoData cells.  NoData cells are barriers.
+
+"""
+
+import heapq
+import math
+
+import numpy as npy
+
+SQRT2 = math.sqrt(2)
+
+# Peak memory used by cost_distance and cost_allocation per cell of input
+# arrays, including the inputs.  Measured with tracemalloc on 500 x 500 grids:
+# about 80 bytes with a single source cell, rising to about 250 when every
+# cell is a source with its own starting cwd (as in reruns of tiles in
+# lm_cwd_tiles), where the heap starts with an entry for every cell.
+BYTES_PER_CELL = 300
+
+BACK_NODATA = -1  # Cell not reached
+BACK_SOURCE = 0  # Source cell
+
+# Back direction codes used by ArcGIS.  Each code gives the (row, column)
+# step from a cell to the next cell on its least-cost path back to a source.
+BACK_DIRECTIONS = {1: (0, 1),  # East
+                   2: (1, 1),  # South-east
+                   3: (1, 0),  # South
+                   4: (1, -1),  # South-west
+                   5: (0, -1),  # West
+                   6: (-1, -1),  # North-west
+                   7: (-1, 0),  # North
+                   8: (-1, 1)}  # North-east
+
+
+class RasterGrid(object):
+    """Geometry of a raster: upper-left corner, cell size and dimensions.
+
+    Windows into the grid are (first row, last row + 1, first column,
+    last column + 1) tuples, with row 0 at the top of the raster.
+
+    """
+
+    def __init__(self, xmin, ymax, cell_size, nrows, ncols,
+                 spatial_ref=None):
+        """Init grid."""
+        self.xmin = float(xmin)
+        self.ymax = float(ymax)
+        self.cell_size = float(cell_size)
+        self.nrows = int(nrows)
+        self.ncols = int(ncols)
+        self.spatial_ref = spatial_ref
+
+    def full_window(self):
+        """Return window covering the whole grid."""
+        return 0, self.nrows, 0, self.ncols
+
+    def window_lower_left(self, window):
+        """Return map coordinates of the lower left corner of a window."""
+        return (self.xmin + window[2] * self.cell_size,
+                self.ymax - window[1] * self.cell_size)
+
+    def cell_centers(self, rows, cols):
+        """Return map x and y coordinates of cell centers."""
+        x_coords = self.xmin + (npy.asarray(cols) + 0.5) * self.cell_size
+        y_coords = self.ymax - (npy.asarray(rows) + 0.5) * self.cell_size
+        return x_coords, y_coords
+
+    def is_aligned(self, other):
+        """Return True if another grid has the same cells as this grid."""
+        tol = 0.001 * self.cell_size
+        if abs(other.cell_size - self.cell_size) > tol:
+            return False
+        for offset in (other.xmin - self.xmin, other.ymax - self.ymax):
+            cells = offset / self.cell_size
+            if abs(cells - round(cells)) * self.cell_size > tol:
+                return False
+        return True
+
+    def subgrid_window(self, other):
+        """Return window of this grid covered by another aligned grid.
+
+        The window may extend past the edges of this grid.
+
+        """
+        r0 = int(round((self.ymax - other.ymax) / self.cell_size))
+        c0 = int(round((other.xmin - self.xmin) / self.cell_size))
+        return r0, r0 + other.nrows, c0, c0 + other.ncols
+
+    def buffer_window(self, window, cells):
+        """Return window grown by a number of cells, clipped to the grid."""
+        return (max(window[0] - cells, 0), min(window[1] + cells, self.nrows),
+                max(window[2] - cells, 0), min(window[3] + cells, self.ncols))
+
+    def circle_window(self, circles):
+        """Return window containing a set of circles, clipped to the grid.
+
+        circles -- sequence of (center x, center y, radius) rows
+
+        """
+        circles = npy.asarray(circles, dtype='float64').reshape((-1, 3))
+        return self.bounds_window((circles[:, 0] - circles[:, 2]).min(),
+                                  (circles[:, 1] - circles[:, 2]).min(),
+                                  (circles[:, 0] + circles[:, 2]).max(),
+                                  (circles[:, 1] + circles[:, 2]).max())
+
+    def bounds_window(self, left, bottom, right, top):
+        """Return window containing a rectangle, clipped to the grid."""
+        size = self.cell_size
+        r0 = max(int(math.floor((self.ymax - top) / size)), 0)
+        r1 = min(int(math.ceil((self.ymax - bottom) / size)), self.nrows)
+        c0 = max(int(math.floor((left - self.xmin) / size)), 0)
+        c1 = min(int(math.ceil((right - self.xmin) / size)), self.ncols)
+        return r0, max(r1, r0), c0, max(c1, c0)
+
+    def circle_mask(self, window, circles):
+        """Return mask of window cells with centers inside any circle."""
+        circles = npy.asarray(circles, dtype='float64').reshape((-1, 3))
+        r0, r1, c0, c1 = window
+        x_coords, y_coords = self.cell_centers(npy.arange(r0, r1),
+                                               npy.arange(c0, c1))
+        mask = npy.zeros((r1 - r0, c1 - c0), dtype=bool)
+        for cent_x, cent_y, radius in circles:
+            dist_sq = ((x_coords[npy.newaxis, :] - cent_x) ** 2 +
+                       (y_coords[:, npy.newaxis] - cent_y) ** 2)
+            mask |= dist_sq <= radius * radius
+        return mask
+
+
+def max_reach(max_dist, min_res, cell_size):
+    """Return number of cells a path can cross within a cost distance.
+
+    Each move to a neighbouring cell (one row and/or column) costs at least
+    min_res times the cell size, so cells further than the returned number
+    of rows or columns from a source cannot be within max_dist.  Returns
+    None if there is no limit (no max_dist, or min_res of zero).
+
+    """
+    if max_dist is None or min_res is None or min_res <= 0:
+        return None
+    return int(math.floor(float(max_dist) / (min_res * cell_size))) + 1
+
+
+def _check_inputs(source, resistance):
+    """Check source and resistance arrays are usable."""
+    if source.shape != resistance.shape:
+        raise ValueError('Source and resistance arrays differ in shape.')
+    valid = resistance[~npy.isnan(resistance)]
+    if valid.size > 0 and valid.min() < 0:
+        raise ValueError('Resistance values cannot be negative.')
+
+
+def _pad(resistance):
+    """Return flat list of resistances with a one cell NoData border.
+
+    The border removes the need for edge checks when visiting neighbours.
+
+    """
+    nrows, ncols = resistance.shape
+    padded = npy.empty((nrows + 2, ncols + 2), dtype='float64')
+    padded.fill(npy.nan)
+    padded[1:-1, 1:-1] = resistance
+    return padded.ravel().tolist()
+
+
+def _neighbours(width, cell_size):
+    """Return (flat offset, half step cost factor, back code) of neighbours.
+
+    The back code of a neighbour reached from a cell points back at the
+    cell, i.e. it is the opposite of the direction moved.
+
+    """
+    neighbours = []
+    for code in sorted(BACK_DIRECTIONS):
+        drow, dcol = BACK_DIRECTIONS[code]
+        if drow == 0 or dcol == 0:
+            step = 0.5 * cell_size
+        else:
+            step = 0.5 * SQRT2 * cell_size
+        neighbours.append((-(drow * width + dcol), step, code))
+    return neighbours
+
+
+def _heap_kernel(res, seeds, neighbours, max_dist, targets=None,
+                 margin=0, seed_dists=None):
+    """Run 8-neighbour Dijkstra from seed cells using a binary heap.
+
+    If targets (a list of padded flat indices) is given, stops once all
+    target cells are settled and the frontier has passed the largest target
+    distance plus margin.  Seeds start at a distance of zero, or at
+    seed_dists (a list of distances, one per seed) if given.
+
+    Returns lists of accumulated costs and back codes, and a bytearray
+    flagging settled cells.  All lists are indexed by padded flat index.
+
+    """
+    ncells = len(res)
+    inf = float('inf')
+    dist = [inf] * ncells
+    back = bytearray(ncells)
+    done = bytearray(ncells)
+    is_target = bytearray(ncells)
+    remaining = 0
+    if targets:
+        for cell in targets:
+            is_target[cell] = 1
+        remaining = sum(is_target)
+    stop_dist = max_dist
+    if seed_dists is None:
+        seed_dists = [0.0] * len(seeds)
+    heap = []
+    for cell, sdist in zip(seeds, seed_dists):
+        dist[cell] = sdist
+        heap.append((sdist, cell))
+    heapq.heapify(heap)
+
+    heappop = heapq.heappop
+    heappush = heapq.heappush
+    while heap:
+        cdist, cell = heappop(heap)
+        if done[cell]:
+            continue
+        if stop_dist is not None and cdist > stop_dist:
+            break
+        done[cell] = 1
+        if remaining and is_target[cell]:
+            remaining -= 1
+            if remaining == 0:
+                # Last target settled.  Cells are settled in order of
+                # distance, so this is the largest target distance.
+                if stop_dist is None or cdist + margin < stop_dist:
+                    stop_dist = cdist + margin
+        cres = res[cell]
+        for offset, step, code in neighbours:
+            nbr = cell + offset
+            nres = res[nbr]
+            if done[nbr] or nres != nres:  # Settled or NoData (NaN)
+                continue
+            ndist = cdist + (cres + nres) * step
+            if ndist < dist[nbr]:
+                dist[nbr] = ndist
+                back[nbr] = code
+                heappush(heap, (ndist, nbr))
+    return dist, back, done
+
+
+def _unpad(values, shape, dtype):
+    """Return array without the NoData border added by _pad."""
+    nrows, ncols = shape
+    arr = npy.asarray(values, dtype=dtype).reshape((nrows + 2, ncols + 2))
+    return arr[1:-1, 1:-1]
+
+
+def cost_distance(source, resistance, cell_size=1.0, max_dist=None,
+                  targets=None, margin=None):
+    """Return cost-weighted distance and back direction arrays.
+
+    source -- boolean array, True for source cells
+    resistance -- float array of costs per unit distance, NaN for NoData
+    cell_size -- cell size in map units
+    max_dist -- maximum cost-weighted distance, or None for no maximum.
+        Cells beyond this distance are set to NoData (cfg.TMAXCWDIST).
+    targets -- optional boolean array, True for target cells.  Used with
+        margin to stop calculations early.
+    margin -- if given with targets, calculations stop once all reachable
+        target cells have a cwd and the frontier passes the largest target
+        cwd plus margin.  Cells beyond this distance are set to NoData.
+
+    Moving between adjacent cells costs the mean of their resistances times
+    the distance between cell centers, as in the CostDistance tool.
+
+    Returns a float32 CWD array with NaN for NoData and an int8 back
+    direction array with codes 1-8 as in ArcGIS, 0 for source cells and
+    BACK_NODATA for cells that were not reached.
+
+    """
+    source = npy.asarray(source, dtype=bool)
+    resistance = npy.asarray(resistance, dtype='float64')
+    _check_inputs(source, resistance)
+    shape = resistance.shape
+    width = shape[1] + 2
+
+    rows, cols = npy.where(source & ~npy.isnan(resistance))
+    seeds = ((rows + 1) * width + cols + 1).tolist()
+
+    targ_cells = None
+    if targets is not None and margin is not None:
+        targets = npy.asarray(targets, dtype=bool)
+        rows, cols = npy.where(targets & ~npy.isnan(resistance))
+        targ_cells = ((rows + 1) * width + cols + 1).tolist()
+        margin = float(margin)
+
+    res = _pad(resistance)
+    dist, back, done = _heap_kernel(res, seeds,
+                                    _neighbours(width, cell_size), max_dist,
+                                    targ_cells, margin)
+
+    settled = _unpad(done, shape, 'uint8').astype(bool)
+    cwd = _unpad(dist, shape, 'float64').astype('float32')
+    cwd[~settled] = npy.nan
+    back_dir = _unpad(back, shape, 'uint8').astype('int8')
+    back_dir[~settled] = BACK_NODATA
+    return cwd, back_dir
+
+
+def cost_allocation(zones, resistance, cell_size=1.0, max_dist=None,
+                    seed_dists=None):
+    """Return cost-weighted distance and allocation arrays.
+
+    zones -- integer array giving the zone of each source cell, negative
+        for other cells
+    resistance -- float array of costs per unit distance, NaN for NoData
+    cell_size -- cell size in map units
+    max_dist -- maximum cost-weighted distance, or None for no maximum
+    seed_dists -- optional float array of cwds that source cells start at
+        (zero by default).  Lets a calculation carry on from cwds found
+        elsewhere, e.g. in neighbouring tiles of a larger grid.
+
+    Runs a single Dijkstra from all source cells, allocating each cell to
+    the zone of the source at the end of its least-cost path, as in the
+    CostAllocation tool.
+
+    Returns a float64 CWD array with NaN for NoData, so cwds can be fed
+    back in as seed_dists without rounding, and an allocation array of
+    zones (same type as zones) with -1 for cells that were not reached.
+
+    """
+    zones = npy.asarray(zones)
+    resistance = npy.asarray(resistance, dtype='float64')
+    source = zones >= 0
+    _check_inputs(source, resistance)
+    shape = resistance.shape
+    width = shape[1] + 2
+
+    rows, cols = npy.where(source & ~npy.isnan(resistance))
+    seeds = ((rows + 1) * width + cols + 1).tolist()
+    if seed_dists is not None:
+        seed_dists = npy.asarray(seed_dists, dtype='float64')[rows,
+                                                              cols].tolist()
+    dist, back, done = _heap_kernel(_pad(resistance), seeds,
+                                    _neighbours(width, cell_size), max_dist,
+                                    seed_dists=seed_dists)
+
+    settled = _unpad(done, shape, 'uint8').astype(bool)
+    cwd = _unpad(dist, shape, 'float64').copy()
+    cwd[~settled] = npy.nan
+    back_dir = _unpad(back, shape, 'uint8').astype('int8')
+
+    # Point each cell at the next cell on its least-cost path, then follow
+    # the pointers to the source cells by repeatedly doubling them
+    ncols = shape[1]
+    cells = npy.arange(back_dir.size).reshape(shape)
+    parent = cells.copy()
+    for code in BACK_DIRECTIONS:
+        drow, dcol = BACK_DIRECTIONS[code]
+        step = (back_dir == code) & settled
+        parent[step] = cells[step] + drow * ncols + dcol
+    parent = parent.ravel()
+    while True:
+        next_parent = parent[parent]
+        if npy.array_equal(next_parent, parent):
+            break
+        parent = next_parent
+    alloc = zones.ravel()[parent].reshape(shape)
+    alloc[~settled] = -1
+    return cwd, alloc
+
+
+def cost_path(back_dir, start):
+    """Return flat indices of cells on the least-cost path from a cell.
+
+    Follows back directions from the start (row, col) cell to a source
+    cell.  The first index is the start cell and the last is the source.
+
+    """
+    nrows, ncols = back_dir.shape
+    row, col = int(start[0]), int(start[1])
+    path = []
+    for _ in range(back_dir.size):
+        path.append(row * ncols + col)
+        code = int(back_dir[row, col])
+        if code == BACK_SOURCE:
+            return npy.array(path, dtype='int64')
+        if code not in BACK_DIRECTIONS:
+            raise ValueError('Least-cost path reached a cell with no back '
+                             'direction at row ' + str(row) + ', column ' +
+                             str(col) + '.')
+        drow, dcol = BACK_DIRECTIONS[code]
+        row = row + drow
+        col = col + dcol
+        if not (0 <= row < nrows and 0 <= col < ncols):
+            raise ValueError('Least-cost path left the back direction '
+                             'array.')
+    raise ValueError('Back direction array contains a loop.')
+
+
+def path_length(path, ncols, cell_size):
+    """Return length of a path of flat cell indices through cell centers.
+
+    Straight steps are one cell size long and diagonal steps are sqrt(2)
+    cell sizes long.
+
+    """
+    path = npy.asarray(path)
+    rows = path // ncols
+    cols = path % ncols
+    diagonal = (npy.diff(rows) != 0) & (npy.diff(cols) != 0)
+    steps = len(diagonal) + (SQRT2 - 1) * npy.count_nonzero(diagonal)
+    return float(steps) * cell_size
+
+
+def trace_lcp(back_dir, start, grid, window=None):
+    """Trace least-cost path from a cell back to a source.
+
+    back_dir -- back direction array covering window of grid
+    start -- (row, col) of first cell in back_dir
+    grid -- RasterGrid the window is taken from
+    window -- window of grid covered by back_dir, or None for the full grid
+
+    Returns flat indices into back_dir of the cells on the path, the map
+    coordinates of their centers as a list of (x, y) vertices, and the path
+    length in map units.
+
+    """
+    if window is None:
+        window = grid.full_window()
+    path = cost_path(back_dir, start)
+    ncols = back_dir.shape[1]
+    x_coords, y_coords = grid.cell_centers(path // ncols + window[0],
+                                           path % ncols + window[2])
+    vertices = list(zip(x_coords.tolist(), y_coords.tolist()))
+    return path, vertices, path_length(path, ncols, grid.cell_size)
+
+
+def _neighbour_views(shape):
+    """Yield slices of the cells of an array and of their neighbours.
+
+    Yields (row step, column step, cell slices, neighbour slices) for each
+    of the east, south, south-east and south-west neighbours.  Comparing
+    cells with these neighbours covers each pair of 8-neighbours once.
+
+    """
+    nrows, ncols = shape
+    for drow, dcol in ((0, 1), (1, 0), (1, 1), (1, -1)):
+        cells = (slice(0, nrows - drow),
+                 slice(max(-dcol, 0), ncols - max(dcol, 0)))
+        nbrs = (slice(drow, nrows),
+                slice(max(dcol, 0), ncols - max(-dcol, 0)))
+        yield drow, dcol, cells, nbrs
+
+
+def pair_keys(zones1, zones2):
+    """Return int64 keys for unordered pairs of zones.
+
+    Each key packs the lower zone into the high 32 bits and the higher zone
+    into the low 32 bits, so sorting keys sorts pairs by lower then higher
+    zone.  Zones must be from 0 to 2**31 - 1.
+
+    """
+    zones1 = npy.asarray(zones1, dtype='int64')
+    zones2 = npy.asarray(zones2, dtype='int64')
+    return (npy.minimum(zones1, zones2) << 32) | npy.maximum(zones1, zones2)
+
+
+def key_pairs(keys):
+    """Return int64 array of (lower zone, higher zone) rows for pair keys."""
+    keys = npy.asarray(keys, dtype='int64')
+    pairs = npy.empty((len(keys), 2), dtype='int64')
+    pairs[:, 0] = keys >> 32
+    pairs[:, 1] = keys & 0xffffffff
+    return pairs
+
+
+def adjacent_zones(alloc):
+    """Return sorted keys of pairs of adjacent allocation zones.
+
+    alloc -- integer array of allocation zones, negative for NoData
+
+    Zones are adjacent if any of their cells are 8-neighbours.  Large
+    arrays can be processed in blocks of rows, as long as each block
+    includes the last row of the block before it.
+
+    """
+    alloc = npy.asarray(alloc)
+    keys = [npy.zeros(0, dtype='int64')]
+    for _, _, cells, nbrs in _neighbour_views(alloc.shape):
+        zones1 = alloc[cells]
+        zones2 = alloc[nbrs]
+        boundary = (zones1 != zones2) & (zones1 >= 0) & (zones2 >= 0)
+        keys.append(npy.unique(pair_keys(zones1[boundary],
+                                         zones2[boundary])))
+    return npy.unique(npy.concatenate(keys))
+
+
+def min_key_dists(keys, dists):
+    """Return sorted unique pair keys and the least distance for each."""
+    keys = npy.asarray(keys, dtype='int64')
+    dists = npy.asarray(dists, dtype='float64')
+    order = npy.lexsort((dists, keys))
+    keys = keys[order]
+    first = npy.ones(len(keys), dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    return keys[first], dists[order][first]
+
+
+def allocation_distances(alloc, cwd, resistance, cell_size=1.0):
+    """Return adjacent allocation zones and least-cost distances between
+    them.
+
+    alloc -- integer array of allocation zones (source of the least-cost
+        path to each cell, as from the CostAllocation tool), negative for
+        NoData
+    cwd -- cost-weighted distance of each cell to its zone's source, NaN
+        for NoData
+    resistance -- resistance array used to calculate cwd, NaN for NoData
+
+    Zones are adjacent if any of their cells are 8-neighbours.  Where cell
+    u in zone a neighbours cell v in zone b, cwd(u) plus the cost of the
+    move from u to v plus cwd(v) is the cost of a path between the sources
+    of a and b.  The least of these over all such cells is the least-cost
+    distance between the two sources, as long as the least-cost path
+    between them does not cross a third zone (in which case it is an upper
+    bound).  Distances that can't be calculated are infinite.
+
+    Returns sorted pair keys of adjacent zones (see pair_keys) and a
+    float64 array of their distances.  Large arrays can be processed in
+    blocks of rows, as for adjacent_zones, combining the results of the
+    blocks with min_key_dists.
+
+    """
+    alloc = npy.asarray(alloc)
+    cwd = npy.asarray(cwd, dtype='float64')
+    resistance = npy.asarray(resistance, dtype='float64')
+    keys = [npy.zeros(0, dtype='int64')]
+    dists = [npy.zeros(0, dtype='float64')]
+    for drow, dcol, cells, nbrs in _neighbour_views(alloc.shape):
+        if drow == 0 or dcol == 0:
+            step = 0.5 * cell_size
+        else:
+            step = 0.5 * SQRT2 * cell_size
+        zones1 = alloc[cells]
+        zones2 = alloc[nbrs]
+        boundary = (zones1 != zones2) & (zones1 >= 0) & (zones2 >= 0)
+        dist = (cwd[cells][boundary] + cwd[nbrs][boundary] +
+                (resistance[cells][boundary] +
+                 resistance[nbrs][boundary]) * step)
+        dist[npy.isnan(dist)] = npy.inf
+        keys.append(pair_keys(zones1[boundary], zones2[boundary]))
+        dists.append(dist)
+    return min_key_dists(npy.concatenate(keys), npy.concatenate(dists))
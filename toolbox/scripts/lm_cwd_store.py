@@ -0,0 +1,325 @@
+"""Store of cost-weighted distance arrays.
+
+Keeps the cost-weighted distance (CWD) surface of each core area as square
+tiles (chunks) of float32 values, each compressed with zlib.  Only the
+window holding CWD values (the valid window) is kept, and chunks with no
+CWD values are not stored at all.  Chunks are read from a memory-mapped
+file, so reading a window of a surface only touches and decompresses the
+chunks overlapping the window.
+
+For each core area the store holds two files:
+    cwd_<core>.dat -- compressed chunks, one after another
+    cwd_<core>_idx.npy -- valid window (first row, last row + 1, first
+        column, last column + 1), chunk size and offsets of the chunks in
+        the data file (row by row).  Chunks with no data have zero length.
+
+Windows are in rows and columns of the grid the CWD arrays were calculated
+on (i.e. the core area index grid).
+
+Steps that build a corridor for each link read the CWD arrays of both its
+core areas.  Links are visited core area by core area (see link_order) and
+read through a CwdCache, which keeps recently decoded arrays in memory, so
+a core area with many links is only decoded once or a few times.
+
+"""
+
+import collections
+import os
+import zlib
+
+import numpy as npy
+
+CHUNK_SIZE = 256  # Rows and columns in a chunk
+COMPRESS_LEVEL = 1  # zlib compression level, favouring speed
+
+_HEADER_LEN = 5  # Window (4 values) and chunk size at start of index
+
+
+def intersect_windows(window1, window2):
+    """Return window covered by both windows, or None if they don't meet."""
+    r0 = max(window1[0], window2[0])
+    r1 = min(window1[1], window2[1])
+    c0 = max(window1[2], window2[2])
+    c1 = min(window1[3], window2[3])
+    if r0 >= r1 or c0 >= c1:
+        return None
+    return r0, r1, c0, c1
+
+
+class CwdStore(object):
+    """Chunked, compressed CWD arrays for a set of core areas."""
+
+    def __init__(self, store_dir, chunk_size=CHUNK_SIZE):
+        """Init store.  The directory is created when an array is saved."""
+        self.store_dir = store_dir
+        self.chunk_size = chunk_size
+
+    def _files(self, core):
+        """Return data and index file paths for a core area."""
+        base = os.path.join(self.store_dir, 'cwd_' + str(int(core)))
+        return base + '.dat', base + '_idx.npy'
+
+    def exists(self, core):
+        """Return True if a CWD array is stored for a core area."""
+        return os.path.exists(self._files(core)[1])
+
+    def save(self, core, cwd, window, max_dist=None):
+        """Save the CWD array of a core area.
+
+        cwd -- array of CWDs covering window, NaN for NoData
+        max_dist -- if given, CWDs beyond this distance are saved as NoData
+
+        """
+        if not os.path.exists(self.store_dir):
+            os.makedirs(self.store_dir)
+        data_file, index_file = self._files(core)
+        cwd = npy.asarray(cwd, dtype='float32')
+        has_data = ~npy.isnan(cwd)
+        if max_dist is not None:
+            has_data &= cwd <= max_dist
+        rows = npy.where(has_data.any(axis=1))[0]
+        cols = npy.where(has_data.any(axis=0))[0]
+        if len(rows) == 0:
+            valid_window = (window[0], window[0], window[2], window[2])
+            cwd = cwd[0:0, 0:0]
+        else:
+            valid_window = (window[0] + rows[0], window[0] + rows[-1] + 1,
+                            window[2] + cols[0], window[2] + cols[-1] + 1)
+            cwd = npy.where(has_data, cwd, npy.nan)[rows[0]:rows[-1] + 1,
+                                                    cols[0]:cols[-1] + 1]
+
+        size = self.chunk_size
+        offsets = [0]
+        dfile = open(data_file, 'wb')
+        try:
+            for row in range(0, cwd.shape[0], size):
+                for col in range(0, cwd.shape[1], size):
+                    chunk = cwd[row:row + size, col:col + size]
+                    if npy.isnan(chunk).all():
+                        offsets.append(offsets[-1])
+                        continue
+                    data = zlib.compress(npy.ascontiguousarray(chunk),
+                                         COMPRESS_LEVEL)
+                    dfile.write(data)
+                    offsets.append(offsets[-1] + len(data))
+        finally:
+            dfile.close()
+        # Index is written last, so a core area is only in the store once
+        # all its chunks are written
+        index = npy.array(list(valid_window) + [size] + offsets,
+                          dtype='int64')
+        npy.save(index_file, index)
+
+    def _read_index(self, core):
+        """Return valid window, chunk size and chunk offsets."""
+        index = npy.load(self._files(core)[1])
+        return (tuple(int(val) for val in index[:4]), int(index[4]),
+                index[_HEADER_LEN:])
+
+    def window(self, core):
+        """Return valid window of the CWD array of a core area."""
+        return self._read_index(core)[0]
+
+    def read(self, core, window=None):
+        """Return float32 array of CWDs of a core area over a window.
+
+        Cells with no CWD value are NaN.  The window defaults to the valid
+        window of the core area.
+
+        """
+        valid_window, size, offsets = self._read_index(core)
+        if window is None:
+            window = valid_window
+        r0, r1, c0, c1 = window
+        cwd = npy.empty((r1 - r0, c1 - c0), dtype='float32')
+        cwd.fill(npy.nan)
+        overlap = intersect_windows(window, valid_window)
+        if overlap is None or offsets[-1] == 0:
+            return cwd
+
+        data = npy.memmap(self._files(core)[0], dtype='uint8', mode='r')
+        vr0, vr1, vc0, vc1 = valid_window
+        chunk_cols = (vc1 - vc0 + size - 1) // size
+        first_row = (overlap[0] - vr0) // size
+        last_row = (overlap[1] - 1 - vr0) // size
+        first_col = (overlap[2] - vc0) // size
+        last_col = (overlap[3] - 1 - vc0) // size
+        for chunk_row in range(first_row, last_row + 1):
+            for chunk_col in range(first_col, last_col + 1):
+                chunk_num = chunk_row * chunk_cols + chunk_col
+                start = offsets[chunk_num]
+                end = offsets[chunk_num + 1]
+                if start == end:
+                    continue  # No data in chunk
+                # Chunk extent in grid rows and columns
+                cr0 = vr0 + chunk_row * size
+                cr1 = min(cr0 + size, vr1)
+                cc0 = vc0 + chunk_col * size
+                cc1 = min(cc0 + size, vc1)
+                chunk = npy.frombuffer(zlib.decompress(data[start:end]),
+                                       dtype='float32')
+                chunk = chunk.reshape((cr1 - cr0, cc1 - cc0))
+                part = intersect_windows(overlap, (cr0, cr1, cc0, cc1))
+                cwd[part[0] - r0:part[1] - r0, part[2] - c0:part[3] - c0] = (
+                    chunk[part[0] - cr0:part[1] - cr0,
+                          part[2] - cc0:part[3] - cc0])
+        del data
+        return cwd
+
+    def delete(self, core):
+        """Remove the CWD array of a core area from the store."""
+        for store_file in self._files(core):
+            if os.path.exists(store_file):
+                os.remove(store_file)
+
+
+def link_order(cores1, cores2):
+    """Return order to visit links in so links sharing a core are together.
+
+    Core areas are taken in turn, starting with the one with the most links,
+    and all links of a core area not yet visited are visited together.  The
+    core area at the far end of the last of these links is taken next, so
+    the CWD arrays read most recently are read again while still cached.
+
+    cores1, cores2 -- core areas at each end of the links
+
+    Returns a list of link indices.
+
+    """
+    cores1 = [int(core) for core in cores1]
+    cores2 = [int(core) for core in cores2]
+    neighbours = {}
+    for link in range(len(cores1)):
+        neighbours.setdefault(cores1[link], []).append((cores2[link], link))
+        neighbours.setdefault(cores2[link], []).append((cores1[link], link))
+    starts = sorted(neighbours, key=lambda core: (-len(neighbours[core]),
+                                                  core))
+    visited = set()
+    done = set()
+    order = []
+    for start in starts:
+        stack = [start]
+        while stack:
+            core = stack.pop()
+            if core in visited:
+                continue
+            visited.add(core)
+            for other, link in sorted(neighbours[core]):
+                if link not in done:
+                    done.add(link)
+                    order.append(link)
+                    stack.append(other)
+    return order
+
+
+class CwdCache(object):
+    """Least recently used cache of CWD arrays read from a CwdStore.
+
+    The whole valid window of a core area's CWD array (or the part of it
+    within the bounds of the cache) is decoded the first time it is read,
+    and kept until the cache is over its memory budget.  Arrays larger than
+    the budget are read from the store every time.  Has the exists, window
+    and read methods of CwdStore.
+
+    """
+
+    def __init__(self, store, max_mb, bounds=None):
+        """Init cache holding up to max_mb megabytes of CWD arrays.
+
+        bounds -- optional window that all windows read are within.  Only
+            the parts of CWD arrays within it are cached.
+
+        """
+        self.store = store
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.bounds = bounds
+        self.hits = 0
+        self.misses = 0
+        self.bytes_avoided = 0
+        self._arrays = collections.OrderedDict()
+        self._bytes = 0
+        self._windows = {}
+
+    def exists(self, core):
+        """Return True if a CWD array is stored for a core area."""
+        return self.store.exists(core)
+
+    def window(self, core):
+        """Return valid window of the CWD array of a core area."""
+        core = int(core)
+        if core not in self._windows:
+            self._windows[core] = self.store.window(core)
+        return self._windows[core]
+
+    def _cached(self, core):
+        """Return cached window and CWD array of a core area.
+
+        Returns None if the array is too large to cache.
+
+        """
+        if core in self._arrays:
+            cached = self._arrays.pop(core)  # Moved to most recently used
+            self._arrays[core] = cached
+            return cached
+        window = self.window(core)
+        if self.bounds is not None:
+            window = intersect_windows(window, self.bounds)
+            if window is None:
+                window = (0, 0, 0, 0)
+        nbytes = (window[1] - window[0]) * (window[3] - window[2]) * 4
+        if nbytes > self.max_bytes:
+            return None
+        while self._arrays and self._bytes + nbytes > self.max_bytes:
+            self._bytes -= self._arrays.popitem(last=False)[1][1].nbytes
+        cached = (window, self.store.read(core, window))
+        self._arrays[core] = cached
+        self._bytes += nbytes
+        return cached
+
+    def read(self, core, window=None):
+        """Return float32 array of CWDs of a core area over a window.
+
+        As CwdStore.read.  The array is a copy, so can be changed.
+
+        """
+        core = int(core)
+        if window is None:
+            window = self.window(core)
+        hit = core in self._arrays
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        cached = self._cached(core)
+        if cached is None:
+            return self.store.read(core, window)
+        cache_window, cache_cwd = cached
+        r0, r1, c0, c1 = window
+        cwd = npy.empty((r1 - r0, c1 - c0), dtype='float32')
+        cwd.fill(npy.nan)
+        overlap = intersect_windows(window, cache_window)
+        if overlap is not None:
+            cwd[overlap[0] - r0:overlap[1] - r0,
+                overlap[2] - c0:overlap[3] - c0] = (
+                    cache_cwd[overlap[0] - cache_window[0]:
+                              overlap[1] - cache_window[0],
+                              overlap[2] - cache_window[2]:
+                              overlap[3] - cache_window[2]])
+        if hit:
+            self.bytes_avoided += cwd.nbytes
+        return cwd
+
+    def report(self):
+        """Return description of cache use."""
+        return cache_report(self.hits, self.misses, self.bytes_avoided)
+
+
+def cache_report(hits, misses, bytes_avoided):
+    """Return description of use of one or more CwdCaches."""
+    reads = hits + misses
+    if reads == 0:
+        return 'No cwd arrays read.'
+    return ('Read ' + str(reads) + ' cwd arrays, ' + str(hits) +
+            ' from cache (' + str(int(round(100.0 * hits / reads))) +
+            '% hit rate), avoiding decoding ' +
+            str(round(bytes_avoided / 1048576.0, 1)) + ' MB.')
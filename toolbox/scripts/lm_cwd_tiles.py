@@ -0,0 +1,188 @@
+"""Tiled cost allocation for grids too large to fit in memory.
+
+Resistances, cost-weighted distances (CWDs) and allocation zones for the
+whole grid are kept in memory-mapped files, and cost allocation is run on
+one square tile of the grid at a time, so peak memory is set by the tile
+size rather than the grid size.
+
+Each tile is run with a one cell halo taken from its neighbours.  Every
+cell with a CWD so far (source cells, and cells reached from earlier tile
+runs) is a source for the run, starting at its current CWD.  Cells whose
+CWD drops are updated, and if any of these are on the edge of the tile,
+the neighbouring tiles sharing that edge are queued to run again.  Tiles
+are run until the queue is empty, at which point CWDs across tile edges
+agree and are the same as for a single allocation over the whole grid.
+
+"""
+
+import collections
+import math
+import os
+import shutil
+
+import numpy as npy
+
+import lm_cwd
+
+
+def tile_size(tile_mb):
+    """Return rows and columns in a tile that fits in tile_mb megabytes."""
+    cells = tile_mb * 1024.0 * 1024.0 / lm_cwd.BYTES_PER_CELL
+    return max(int(math.sqrt(cells)) - 2, 16)
+
+
+class TiledAllocation(object):
+    """Cost allocation over a grid held in memory-mapped files."""
+
+    def __init__(self, work_dir, nrows, ncols, tile_rows, cell_size=1.0):
+        """Create work files for a grid.
+
+        Rows must then be filled in with set_rows before running.
+
+        """
+        if not os.path.exists(work_dir):
+            os.makedirs(work_dir)
+        self.work_dir = work_dir
+        self.nrows = int(nrows)
+        self.ncols = int(ncols)
+        self.tile_rows = int(tile_rows)
+        self.cell_size = float(cell_size)
+        shape = (self.nrows, self.ncols)
+        open_memmap = npy.lib.format.open_memmap
+        self.res = open_memmap(os.path.join(work_dir, 'res.npy'), mode='w+',
+                               dtype='float64', shape=shape)
+        # CWDs are kept at full precision, so tiles rerun from the CWDs of
+        # their neighbours get the same results as a single allocation
+        self.cwd = open_memmap(os.path.join(work_dir, 'cwd.npy'), mode='w+',
+                               dtype='float64', shape=shape)
+        self.alloc = open_memmap(os.path.join(work_dir, 'alloc.npy'),
+                                 mode='w+', dtype='int32', shape=shape)
+        self.tile_count = ((self.nrows + self.tile_rows - 1) //
+                           self.tile_rows,
+                           (self.ncols + self.tile_rows - 1) //
+                           self.tile_rows)
+        self._queue = collections.deque()
+        self._queued = set()
+
+    def _queue_tile(self, tile):
+        """Add tile to queue of tiles to run, if it is on the grid."""
+        if (0 <= tile[0] < self.tile_count[0] and
+                0 <= tile[1] < self.tile_count[1] and
+                tile not in self._queued):
+            self._queue.append(tile)
+            self._queued.add(tile)
+
+    def set_rows(self, first_row, resistance, zones):
+        """Fill in a block of rows of the grid.
+
+        resistance -- float array of resistances, NaN for NoData
+        zones -- integer array giving the zone of each source cell,
+            negative for other cells
+
+        """
+        last_row = first_row + resistance.shape[0]
+        source = (zones >= 0) & ~npy.isnan(resistance)
+        self.res[first_row:last_row] = resistance
+        self.cwd[first_row:last_row] = npy.where(source, 0, npy.inf)
+        self.alloc[first_row:last_row] = npy.where(source, zones, -1)
+        rows, cols = npy.where(source)
+        tiles = npy.unique(((rows + first_row) // self.tile_rows) *
+                           self.tile_count[1] + cols // self.tile_rows)
+        for tile in tiles.tolist():
+            self._queue_tile((tile // self.tile_count[1],
+                              tile % self.tile_count[1]))
+
+    def tile_window(self, tile):
+        """Return window of the grid covered by a tile."""
+        r0 = tile[0] * self.tile_rows
+        c0 = tile[1] * self.tile_rows
+        return (r0, min(r0 + self.tile_rows, self.nrows),
+                c0, min(c0 + self.tile_rows, self.ncols))
+
+    def _run_tile(self, tile, max_dist):
+        """Run cost allocation on a tile and queue neighbours to update."""
+        r0, r1, c0, c1 = self.tile_window(tile)
+        h0 = max(r0 - 1, 0)
+        h1 = min(r1 + 1, self.nrows)
+        g0 = max(c0 - 1, 0)
+        g1 = min(c1 + 1, self.ncols)
+        old_cwd = npy.array(self.cwd[h0:h1, g0:g1])
+        known = ~npy.isinf(old_cwd)
+        zones = npy.where(known, self.alloc[h0:h1, g0:g1], -1)
+        cwd, alloc = lm_cwd.cost_allocation(
+            zones, self.res[h0:h1, g0:g1], self.cell_size, max_dist,
+            npy.where(known, old_cwd, 0))
+
+        # Only cells in the tile itself are updated.  Halo cells belong to
+        # the neighbouring tiles.
+        improved = npy.zeros(old_cwd.shape, dtype=bool)
+        inner = (slice(r0 - h0, r1 - h0), slice(c0 - g0, c1 - g0))
+        improved[inner] = ~npy.isnan(cwd[inner]) & (cwd[inner] <
+                                                     old_cwd[inner])
+        if not improved.any():
+            return
+        cwd_view = self.cwd[h0:h1, g0:g1]
+        cwd_view[improved] = cwd[improved]
+        alloc_view = self.alloc[h0:h1, g0:g1]
+        alloc_view[improved] = alloc[improved]
+
+        edges = improved[inner]
+        top = edges[0].any()
+        bottom = edges[-1].any()
+        left = edges[:, 0].any()
+        right = edges[:, -1].any()
+        row, col = tile
+        if top:
+            self._queue_tile((row - 1, col))
+        if bottom:
+            self._queue_tile((row + 1, col))
+        if left:
+            self._queue_tile((row, col - 1))
+        if right:
+            self._queue_tile((row, col + 1))
+        if edges[0, 0]:
+            self._queue_tile((row - 1, col - 1))
+        if edges[0, -1]:
+            self._queue_tile((row - 1, col + 1))
+        if edges[-1, 0]:
+            self._queue_tile((row + 1, col - 1))
+        if edges[-1, -1]:
+            self._queue_tile((row + 1, col + 1))
+
+    def run(self, max_dist=None, report=None):
+        """Run tiles until CWDs converge.
+
+        report -- optional function called with the number of tile runs
+            and the number of tiles still queued after each tile run
+
+        Returns the number of tile runs.
+
+        """
+        runs = 0
+        while self._queue:
+            tile = self._queue.popleft()
+            self._queued.discard(tile)
+            self._run_tile(tile, max_dist)
+            runs += 1
+            if report is not None:
+                report(runs, len(self._queue))
+        self.cwd.flush()
+        self.alloc.flush()
+        return runs
+
+    def read(self, window):
+        """Return allocation, CWD and resistance arrays for a window.
+
+        Allocation is -1 and CWD and resistance are NaN for NoData.
+
+        """
+        r0, r1, c0, c1 = window
+        cwd = npy.array(self.cwd[r0:r1, c0:c1])
+        cwd[npy.isinf(cwd)] = npy.nan
+        return (npy.array(self.alloc[r0:r1, c0:c1]), cwd,
+                npy.array(self.res[r0:r1, c0:c1]))
+
+    def delete(self):
+        """Close and remove work files."""
+        del self.res, self.cwd, self.alloc
+        shutil.rmtree(self.work_dir, ignore_errors=True)
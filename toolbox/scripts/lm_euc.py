@@ -0,0 +1,175 @@
+"""Euclidean allocation engine.
+
+Pure NumPy version of the allocation calculated by the Spatial Analyst
+EucAllocation tool.  Each cell is allocated to the zone of its nearest
+zone cell, using an exact separable Euclidean distance transform (Meijster
+et al. 2000) that carries the row and column of the nearest zone cell
+along with the distance.
+
+The transform runs in two passes, each linear in the number of cells.  The
+first works down and up the columns of the grid, and the second along its
+rows.  Rows are independent in the second pass, so it runs on all rows of a
+block at once.  The column pass only needs the nearest zone cell above and
+below each block in each column, so a grid can be allocated a block of rows
+at a time without holding all of it in memory: scan_down the blocks from
+the top, keeping the state at the start of each, then pass the blocks from
+the bottom to nearest_rows and euc_allocation.
+
+Zone arrays are integer arrays with negative values for cells that are not
+in a zone.  Distances are in cells.
+
+"""
+
+import numpy as npy
+
+
+def column_state(ncols, dtype='int32'):
+    """Return rows and zones of the nearest zone cells in columns with none.
+
+    Rows are -1 for columns with no zone cells.
+
+    """
+    rows = npy.empty(ncols, dtype='int32')
+    rows.fill(-1)
+    zones = npy.empty(ncols, dtype=dtype)
+    zones.fill(-1)
+    return rows, zones
+
+
+def scan_down(zones, first_row, state):
+    """Update column state with the last zone cell in each column of a block.
+
+    zones -- block of rows of a zone array, starting at row first_row
+    state -- column_state to update in place, from the blocks above
+
+    """
+    last, last_zone = state
+    for row in range(zones.shape[0]):
+        in_zone = zones[row] >= 0
+        last[in_zone] = first_row + row
+        last_zone[in_zone] = zones[row, in_zone]
+
+
+def nearest_rows(zones, first_row=0, above=None, below=None):
+    """Return row and zone of the nearest zone cell in the same column as
+    each cell of a block of rows.
+
+    zones -- block of rows of a zone array, starting at row first_row
+    above -- column_state of the nearest zone cells above the block, from
+        scan_down of the blocks above it, by default none
+    below -- column_state of the nearest zone cells below the block, by
+        default none.  It is updated in place to include the block, so
+        blocks can be passed in turn from the bottom of the grid.
+
+    Returns an int32 array of rows, -1 for columns with no zone cells, and
+    an array of zones.
+
+    """
+    zones = npy.asarray(zones)
+    nrows, ncols = zones.shape
+    in_zone = zones >= 0
+    if above is None:
+        above = column_state(ncols, zones.dtype)
+    if below is None:
+        below = column_state(ncols, zones.dtype)
+    last = above[0].copy()
+    last_zone = above[1].copy()
+    near = npy.empty((nrows, ncols), dtype='int32')
+    near_zone = npy.empty((nrows, ncols), dtype=last_zone.dtype)
+    for row in range(nrows):
+        last[in_zone[row]] = first_row + row
+        last_zone[in_zone[row]] = zones[row, in_zone[row]]
+        near[row] = last
+        near_zone[row] = last_zone
+    last, last_zone = below
+    for row in range(nrows - 1, -1, -1):
+        grid_row = first_row + row
+        last[in_zone[row]] = grid_row
+        last_zone[in_zone[row]] = zones[row, in_zone[row]]
+        # Use the zone cell below if there is none above or it is closer
+        closer = (last >= 0) & ((near[row] < 0) |
+                                (last - grid_row < grid_row - near[row]))
+        near[row, closer] = last[closer]
+        near_zone[row, closer] = last_zone[closer]
+    return near, near_zone
+
+
+def euc_allocation(near_rows, near_zones, first_row=0):
+    """Return Euclidean allocation of a block of rows of a zone array.
+
+    near_rows, near_zones -- nearest_rows of the block
+    first_row -- first row of the block in the zone array
+
+    Returns an array of the zone of the nearest zone cell for each cell in
+    the block (negative if there are no zone cells), and a float64 array of
+    squared distances in cells to that cell (inf if none).
+
+    """
+    near = npy.asarray(near_rows)
+    nrows, ncols = near.shape
+    rows = npy.arange(nrows)
+
+    # Squared distance to nearest zone cell in each column
+    col_dist = (near - (rows + first_row)[:, npy.newaxis]).astype('float64')
+    col_dist *= col_dist
+    col_dist[near < 0] = npy.inf
+
+    # Lower envelope of the parabolas (x - col)^2 + col_dist[col] along
+    # each row.  Stacks hold the columns of the parabolas making up the
+    # envelope and the first column where each is lowest.
+    stack_cols = npy.zeros((nrows, ncols), dtype='int64')
+    stack_starts = npy.zeros((nrows, ncols), dtype='int64')
+    top = npy.empty(nrows, dtype='int32')
+    top.fill(-1)
+    for col in range(ncols):
+        dist = col_dist[:, col]
+        active = ~npy.isinf(dist)
+        if not active.any():
+            continue
+        # Pop parabolas that are above the new one where they start
+        while True:
+            cand = rows[active & (top >= 0)]
+            if len(cand) == 0:
+                break
+            scols = stack_cols[cand, top[cand]]
+            starts = stack_starts[cand, top[cand]]
+            old = (starts - scols) ** 2 + col_dist[cand, scols]
+            new = (starts - col) ** 2 + dist[cand]
+            pop = cand[old > new]
+            if len(pop) == 0:
+                break
+            top[pop] -= 1
+
+        cand = rows[active]
+        empty = cand[top[cand] < 0]
+        top[empty] = 0
+        stack_cols[empty, 0] = col
+        stack_starts[empty, 0] = 0
+
+        cand = cand[top[cand] >= 0]
+        cand = cand[stack_cols[cand, top[cand]] != col]  # Not just pushed
+        if len(cand) == 0:
+            continue
+        scols = stack_cols[cand, top[cand]]
+        # First column where new parabola is lower than the top one
+        starts = 1 + npy.floor(
+            (col * col - scols * scols + dist[cand] -
+             col_dist[cand, scols]) / (2.0 * (col - scols))).astype('int64')
+        push = starts < ncols
+        cand = cand[push]
+        top[cand] += 1
+        stack_cols[cand, top[cand]] = col
+        stack_starts[cand, top[cand]] = starts[push]
+
+    # Read allocation off the envelope, working back along each row
+    alloc = npy.empty((nrows, ncols), dtype=near_zones.dtype)
+    alloc.fill(-1)
+    dist_sq = npy.empty((nrows, ncols), dtype='float64')
+    dist_sq.fill(npy.inf)
+    cand = rows[top >= 0]
+    for col in range(ncols - 1, -1, -1):
+        scols = stack_cols[cand, top[cand]]
+        alloc[cand, col] = near_zones[cand, scols]
+        dist_sq[cand, col] = (col - scols) ** 2 + col_dist[cand, scols]
+        top[cand[stack_starts[cand, top[cand]] == col]] -= 1
+    return alloc, dist_sq
@@ -0,0 +1,97 @@
+"""Append-only journal of results used to resume interrupted runs.
+
+A journal is a text file with one JSON record per line.  The first record
+is a header describing the inputs and settings of the run, and each later
+record holds the results of one unit of work (e.g. the link table changes,
+least-cost paths and cwd checksum for one core area in step 3).  Records
+are flushed to disk as they are written, so the cost of a checkpoint is
+proportional to the results being saved, and a run that stops part way
+can carry on from the last record written.
+
+"""
+
+import json
+import os
+import zlib
+
+import numpy as npy
+
+
+def checksum(arr, dtype='float32'):
+    """Return CRC-32 checksum of the values in an array."""
+    return zlib.crc32(npy.ascontiguousarray(arr, dtype=dtype)) & 0xffffffff
+
+
+def _normalize(record):
+    """Return record as it will be read back from the journal."""
+    return json.loads(json.dumps(record))
+
+
+class Journal(object):
+    """Append-only journal file."""
+
+    def __init__(self, journal_file):
+        """Init journal.  The file is not opened until open is called."""
+        self.journal_file = journal_file
+        self._file = None
+
+    def read(self, header):
+        """Return records in journal started with header.
+
+        Returns None if there is no journal or it was started with a
+        different header.  A partly written last record is ignored.
+
+        """
+        if not os.path.exists(self.journal_file):
+            return None
+        records = []
+        jfile = open(self.journal_file, 'r')
+        try:
+            for line in jfile:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break  # Record cut off when run stopped
+        finally:
+            jfile.close()
+        if not records or records[0] != _normalize(header):
+            return None
+        return records[1:]
+
+    def open(self, header, records=()):
+        """Start journal with header and records carried over from an
+        earlier run, then keep it open for appending records.
+
+        """
+        self.close()
+        self._file = open(self.journal_file, 'w')
+        self._write(header)
+        for record in records:
+            self._write(record)
+        self._sync()
+
+    def append(self, record):
+        """Add record to journal and flush it to disk."""
+        self._write(record)
+        self._sync()
+
+    def _write(self, record):
+        """Write record as a line of JSON."""
+        self._file.write(json.dumps(record) + '\n')
+
+    def _sync(self):
+        """Flush journal file to disk."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        """Close journal file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def delete(self):
+        """Close and remove journal file."""
+        self.close()
+        if os.path.exists(self.journal_file):
+            os.remove(self.journal_file)
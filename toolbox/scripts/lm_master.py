@@ -138,6 +138,8 @@ def lm_master(argv=None):
             lu.delete_data(cfg.CORERAS)
             arcpy.FeatureToRaster_conversion(cfg.COREFC, cfg.COREFN,
                           cfg.CORERAS, arcpy.Describe(cfg.RESRAST).MeanCellHeight)
+            gprint('Indexing core area cells.')
+            lu.write_core_index(cfg.CORERAS)
 
         def delete_final_gdb(finalgdb):
             """Deletes final geodatabase"""
@@ -0,0 +1,178 @@
+"""Minimum mosaics of corridor arrays.
+
+Corridor arrays for links are folded into a mosaic covering the whole
+analysis grid one at a time, keeping the lowest value in each cell, as done
+by the MosaicToNewRaster tool with the MINIMUM mosaic method.  Each corridor
+array only covers a window of the grid, and only that window of the mosaic
+is updated.
+
+The mosaic is a float32 array, NaN where no corridor has a value.  It is
+held in memory, or for large grids in a memory-mapped file.
+
+Mosaics of corridors from stored CWD arrays can also be built in parallel.
+The grid is split into square tiles, and worker processes each take a
+tile, fold in the corridors of the links whose windows meet it, and write
+it straight into the memory-mapped mosaic files.  Tiles do not overlap, so
+no merging is needed.  The links of a tile are taken core area by core
+area, and the parts of CWD arrays in the tile are cached between links.
+
+"""
+
+import os
+
+import numpy as npy
+
+import lm_cwd_store
+
+BLOCK_CELLS = 4194304  # Cells scanned at a time when finding the minimum
+TILE_SIZE = 2048  # Rows and columns in a tile of a parallel mosaic
+
+
+def nan_min(arr):
+    """Return minimum of the non-NaN values of an array, or None if none."""
+    valid = arr[~npy.isnan(arr)]
+    if len(valid) == 0:
+        return None
+    return float(valid.min())
+
+
+class MinMosaic(object):
+    """Minimum mosaic of corridor arrays over a grid."""
+
+    def __init__(self, shape, work_file=None):
+        """Create mosaic with no values.
+
+        work_file -- if given, the mosaic is kept in this memory-mapped
+            (.npy) file rather than in memory
+
+        """
+        self.work_file = work_file
+        if work_file is None:
+            self.array = npy.empty(shape, dtype='float32')
+        else:
+            if os.path.exists(work_file):
+                os.remove(work_file)
+            self.array = npy.lib.format.open_memmap(
+                work_file, mode='w+', dtype='float32', shape=shape)
+        self.array.fill(npy.nan)
+        if work_file is not None:
+            self.array.flush()  # Ready for worker processes to open
+
+    def add(self, arr, window):
+        """Fold a corridor array covering a window into the mosaic.
+
+        NaN cells in the array leave the mosaic unchanged.
+
+        """
+        r0, r1, c0, c1 = window
+        view = self.array[r0:r1, c0:c1]
+        npy.fmin(view, arr, view)
+
+    def minimum(self):
+        """Return lowest value in the mosaic, or None if it has no values."""
+        rows = max(BLOCK_CELLS // max(self.array.shape[1], 1), 1)
+        lowest = None
+        for first in range(0, self.array.shape[0], rows):
+            block_min = nan_min(self.array[first:first + rows])
+            if block_min is not None and (lowest is None or
+                                          block_min < lowest):
+                lowest = block_min
+        return lowest
+
+    def delete(self):
+        """Free the mosaic, removing its work file if it has one."""
+        del self.array
+        if self.work_file is not None and os.path.exists(self.work_file):
+            os.remove(self.work_file)
+
+
+def tile_tasks(links, shape, tile_size=TILE_SIZE):
+    """Return (tile window, links) tasks for tiles that links meet.
+
+    links -- list of (link number, core 1, core 2, lcDist, window) tuples,
+        giving the window where both cores have CWDs
+
+    """
+    tiles = {}
+    for link in links:
+        r0, r1, c0, c1 = link[4]
+        for tile_row in range(r0 // tile_size, (r1 - 1) // tile_size + 1):
+            for tile_col in range(c0 // tile_size,
+                                  (c1 - 1) // tile_size + 1):
+                tiles.setdefault((tile_row, tile_col), []).append(link)
+    tasks = []
+    for tile_row, tile_col in sorted(tiles):
+        r0 = tile_row * tile_size
+        c0 = tile_col * tile_size
+        window = (r0, min(r0 + tile_size, shape[0]),
+                  c0, min(c0 + tile_size, shape[1]))
+        tile_links = tiles[(tile_row, tile_col)]
+        order = lm_cwd_store.link_order([link[1] for link in tile_links],
+                                        [link[2] for link in tile_links])
+        tasks.append((window, [tile_links[num] for num in order]))
+    return tasks
+
+
+# Store and mosaic files used by worker processes, set by init_worker
+_worker_state = {}
+
+
+def init_worker(store_dir, mosaic_file, non_norm_file=None, cache_mb=0):
+    """Save CWD store and mosaic files in a worker process.
+
+    non_norm_file -- optional mosaic file for NON-normalized corridors
+        (sum of CWDs, without subtracting lcDist)
+    cache_mb -- memory for CWD arrays cached while mosaicking a tile, in MB
+
+    """
+    _worker_state['store'] = lm_cwd_store.CwdStore(store_dir)
+    _worker_state['mosaic_file'] = mosaic_file
+    _worker_state['non_norm_file'] = non_norm_file
+    _worker_state['cache_mb'] = cache_mb
+
+
+def mosaic_tile(task):
+    """Mosaic the corridors of links meeting a tile into the mosaic files.
+
+    Returns the tile window, a dictionary of the lowest corridor value
+    in the tile for each link with values there, and the hits, misses and
+    bytes avoided of the tile's CWD cache.
+
+    """
+    window, links = task
+    store = lm_cwd_store.CwdCache(_worker_state['store'],
+                                  _worker_state['cache_mb'], window)
+    r0, r1, c0, c1 = window
+    tile = npy.empty((r1 - r0, c1 - c0), dtype='float32')
+    tile.fill(npy.nan)
+    non_norm_tile = None
+    if _worker_state['non_norm_file'] is not None:
+        non_norm_tile = tile.copy()
+    link_mins = {}
+    for link_num, core1, core2, lc_dist, link_window in links:
+        part = lm_cwd_store.intersect_windows(window, link_window)
+        if part is None:
+            continue
+        lcc = (store.read(core1, part).astype('float64') +
+               store.read(core2, part))
+        view = (slice(part[0] - r0, part[1] - r0),
+                slice(part[2] - c0, part[3] - c0))
+        if non_norm_tile is not None:
+            npy.fmin(non_norm_tile[view], lcc, non_norm_tile[view])
+        lcc -= lc_dist
+        npy.fmin(tile[view], lcc, tile[view])
+        link_min = nan_min(lcc)
+        if link_min is not None:
+            link_mins[link_num] = link_min
+
+    # Tile is written to its own part of each mosaic file
+    for mosaic_file, arr in ((_worker_state['mosaic_file'], tile),
+                             (_worker_state['non_norm_file'],
+                              non_norm_tile)):
+        if mosaic_file is None:
+            continue
+        mosaic = npy.load(mosaic_file, mmap_mode='r+')
+        mosaic[r0:r1, c0:c1] = arr
+        mosaic.flush()
+        del mosaic
+    return window, link_mins, (store.hits, store.misses, store.bytes_avoided)
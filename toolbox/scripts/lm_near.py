@@ -0,0 +1,288 @@
+"""Distances between core area polygons.
+
+Finds the exact minimum distance between the boundaries of pairs of core
+areas, as found by the GenerateNearTable tool.  Each core area's boundary
+is read once and densified to points no more than a set spacing apart
+(e.g. the cell size) along its segments.  The closest points of two
+boundaries give a distance within the spacing of the exact distance, and
+only the segments near these points need to be checked to find the exact
+distance.
+
+A KD-tree of each core area's boundary points is used to find close points
+if SciPy is available.  Otherwise points are compared in blocks.
+
+Boundaries are lists of rings, each an array of (x, y) vertices.  Bounding
+boxes are rows of (XMin, XMax, YMax, YMin), as from lm_util.get_box_data.
+The distance between the bounding boxes of two core areas is a lower bound
+on the distance between the core areas, so pairs that are too far apart
+can be dropped before finding exact distances.
+
+"""
+
+import numpy as npy
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+BLOCK_SIZE = 4194304  # Point pairs compared at a time without SciPy
+
+
+class CoreBoundary(object):
+    """Boundary segments and densified boundary points of a core area."""
+
+    def __init__(self, rings, spacing):
+        """Split rings into segments and densify them."""
+        segments = []
+        ring_points = []
+        for ring in rings:
+            ring = npy.asarray(ring, dtype='float64').reshape((-1, 2))
+            if len(ring) == 0:
+                continue
+            if len(ring) == 1:  # Point core area
+                ring = npy.vstack((ring, ring))
+            segments.append(npy.hstack((ring[:-1], ring[1:])))
+            ring_points.append(ring[0])
+        self.segments = npy.vstack(segments)
+        # A point on each ring (part or hole), for containment checks
+        self.ring_points = npy.array(ring_points)
+
+        # Points along each segment, including its ends
+        lengths = npy.hypot(self.segments[:, 2] - self.segments[:, 0],
+                            self.segments[:, 3] - self.segments[:, 1])
+        steps = npy.maximum(npy.ceil(lengths / spacing), 1).astype('int64')
+        self.point_segs = npy.repeat(npy.arange(len(steps)), steps + 1)
+        starts = npy.cumsum(steps + 1) - (steps + 1)
+        frac = ((npy.arange(len(self.point_segs)) -
+                 npy.repeat(starts, steps + 1)) /
+                npy.repeat(steps, steps + 1).astype('float64'))
+        segs = self.segments[self.point_segs]
+        self.points = npy.empty((len(frac), 2), dtype='float64')
+        self.points[:, 0] = segs[:, 0] + frac * (segs[:, 2] - segs[:, 0])
+        self.points[:, 1] = segs[:, 1] + frac * (segs[:, 3] - segs[:, 1])
+        self.box = npy.array([self.points[:, 0].min(),
+                              self.points[:, 0].max(),
+                              self.points[:, 1].max(),
+                              self.points[:, 1].min()])
+        self.spacing = float(spacing)
+        self._tree = None
+
+    def tree(self):
+        """Return KD-tree of boundary points, or None without SciPy."""
+        if self._tree is None and cKDTree is not None:
+            self._tree = cKDTree(self.points)
+        return self._tree
+
+    def contains_any(self, points):
+        """Return True if any of the points is inside the polygon."""
+        for point in points:
+            if self.contains(point):
+                return True
+        return False
+
+    def contains(self, point):
+        """Return True if a point is inside the core area polygon."""
+        x, y = point
+        x1, y1, x2, y2 = self.segments.T
+        crosses = (y1 > y) != (y2 > y)
+        with npy.errstate(divide='ignore', invalid='ignore'):
+            cross_x = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+        return bool(npy.count_nonzero(crosses & (x < cross_x)) % 2)
+
+
+def box_distances(boxes1, boxes2):
+    """Return distances between bounding boxes (row by row)."""
+    boxes1 = npy.asarray(boxes1, dtype='float64').reshape((-1, 4))
+    boxes2 = npy.asarray(boxes2, dtype='float64').reshape((-1, 4))
+    gap_x = npy.maximum(npy.maximum(boxes1[:, 0] - boxes2[:, 1],
+                                    boxes2[:, 0] - boxes1[:, 1]), 0)
+    gap_y = npy.maximum(npy.maximum(boxes1[:, 3] - boxes2[:, 2],
+                                    boxes2[:, 3] - boxes1[:, 2]), 0)
+    return npy.hypot(gap_x, gap_y)
+
+
+def close_box_pairs(boxes, max_dist):
+    """Return pairs of bounding boxes no more than max_dist apart.
+
+    Boxes are sorted by XMin and swept in order, so each box is only
+    compared with the boxes starting within max_dist of its XMax.
+
+    Returns an (n, 2) array of row indices of boxes, smaller index first.
+
+    """
+    boxes = npy.asarray(boxes, dtype='float64').reshape((-1, 4))
+    order = npy.argsort(boxes[:, 0], kind='mergesort')
+    x_min = boxes[order, 0]
+    ends = npy.searchsorted(x_min, boxes[order, 1] + max_dist, 'right')
+    counts = npy.maximum(ends - npy.arange(len(boxes)) - 1, 0)
+    pairs = [npy.zeros((0, 2), dtype='int64')]
+    first = 0
+    while first < len(boxes):
+        # Limit number of candidate pairs held at once
+        last = first + 1
+        total = counts[first]
+        while last < len(boxes) and total + counts[last] <= BLOCK_SIZE:
+            total += counts[last]
+            last += 1
+        num = counts[first:last]
+        ids1 = npy.repeat(npy.arange(first, last), num)
+        starts = npy.cumsum(num) - num
+        ids2 = (ids1 + 1 + npy.arange(len(ids1)) -
+                npy.repeat(starts, num))
+        ids1 = order[ids1]
+        ids2 = order[ids2]
+        close = box_distances(boxes[ids1], boxes[ids2]) <= max_dist
+        pairs.append(npy.sort(npy.column_stack((ids1[close], ids2[close])),
+                              axis=1))
+        first = last
+    return npy.vstack(pairs)
+
+
+def _nearest_dists(boundary, points):
+    """Return distance from each point to the closest boundary point."""
+    tree = boundary.tree()
+    if tree is not None:
+        return tree.query(points)[0]
+    dists = npy.empty(len(points), dtype='float64')
+    block = max(BLOCK_SIZE // len(boundary.points), 1)
+    for first in range(0, len(points), block):
+        pnts = points[first:first + block]
+        dist_sq = ((pnts[:, 0:1] - boundary.points[:, 0]) ** 2 +
+                   (pnts[:, 1:2] - boundary.points[:, 1]) ** 2)
+        dists[first:first + block] = npy.sqrt(dist_sq.min(axis=1))
+    return dists
+
+
+def _close_points(boundary, points, radius):
+    """Return indices of points and boundary points within radius."""
+    tree = boundary.tree()
+    point_ids = []
+    bound_ids = []
+    if tree is not None:
+        for num, close in enumerate(tree.query_ball_point(points, radius)):
+            point_ids.extend([num] * len(close))
+            bound_ids.extend(close)
+        return (npy.array(point_ids, dtype='int64'),
+                npy.array(bound_ids, dtype='int64'))
+    block = max(BLOCK_SIZE // len(boundary.points), 1)
+    for first in range(0, len(points), block):
+        pnts = points[first:first + block]
+        dist_sq = ((pnts[:, 0:1] - boundary.points[:, 0]) ** 2 +
+                   (pnts[:, 1:2] - boundary.points[:, 1]) ** 2)
+        rows, cols = npy.where(dist_sq <= radius * radius)
+        point_ids.append(rows + first)
+        bound_ids.append(cols)
+    return npy.concatenate(point_ids), npy.concatenate(bound_ids)
+
+
+def _point_seg_dists(pnts, segs):
+    """Return distances from points to segments (row by row)."""
+    dx = segs[:, 2] - segs[:, 0]
+    dy = segs[:, 3] - segs[:, 1]
+    len_sq = dx * dx + dy * dy
+    with npy.errstate(divide='ignore', invalid='ignore'):
+        frac = ((pnts[:, 0] - segs[:, 0]) * dx +
+                (pnts[:, 1] - segs[:, 1]) * dy) / len_sq
+    frac = npy.clip(npy.nan_to_num(frac), 0, 1)
+    return npy.hypot(segs[:, 0] + frac * dx - pnts[:, 0],
+                     segs[:, 1] + frac * dy - pnts[:, 1])
+
+
+def _seg_seg_dists(segs1, segs2):
+    """Return distances between segments (row by row)."""
+    dists = npy.minimum(
+        npy.minimum(_point_seg_dists(segs1[:, 0:2], segs2),
+                    _point_seg_dists(segs1[:, 2:4], segs2)),
+        npy.minimum(_point_seg_dists(segs2[:, 0:2], segs1),
+                    _point_seg_dists(segs2[:, 2:4], segs1)))
+
+    def orient(segs, x, y):
+        """Return side of segments that points are on."""
+        return npy.sign((segs[:, 2] - segs[:, 0]) * (y - segs[:, 1]) -
+                        (segs[:, 3] - segs[:, 1]) * (x - segs[:, 0]))
+
+    crossing = ((orient(segs1, segs2[:, 0], segs2[:, 1]) *
+                 orient(segs1, segs2[:, 2], segs2[:, 3]) < 0) &
+                (orient(segs2, segs1[:, 0], segs1[:, 1]) *
+                 orient(segs2, segs1[:, 2], segs1[:, 3]) < 0))
+    dists[crossing] = 0
+    return dists
+
+
+def boundary_distance(boundary1, boundary2):
+    """Return exact minimum distance between two core area polygons.
+
+    Zero if the polygons touch, overlap or one contains the other.
+
+    """
+    # Closest boundary points are within the spacing of the exact
+    # distance.  Any pair of segments with points closer than that could
+    # hold the closest points on the boundaries.
+    dists = _nearest_dists(boundary2, boundary1.points)
+    radius = dists.min() + max(boundary1.spacing, boundary2.spacing)
+    close = npy.where(dists <= radius)[0]
+    point_ids, bound_ids = _close_points(boundary2, boundary1.points[close],
+                                         radius)
+    seg_pairs = npy.unique(boundary1.point_segs[close[point_ids]] *
+                           len(boundary2.segments) +
+                           boundary2.point_segs[bound_ids])
+    segs1 = boundary1.segments[seg_pairs // len(boundary2.segments)]
+    segs2 = boundary2.segments[seg_pairs % len(boundary2.segments)]
+    dist = float(_seg_seg_dists(segs1, segs2).min())
+    # Boundaries that don't meet don't cross, so each ring lies wholly
+    # inside or outside the other polygon.  One point per ring will do.
+    if dist > 0 and (boundary2.contains_any(boundary1.ring_points) or
+                     boundary1.contains_any(boundary2.ring_points)):
+        dist = 0.0
+    return dist
+
+
+# Core area boundaries used by worker processes, set by init_worker
+_worker_boundaries = {}
+
+
+def init_worker(boundaries):
+    """Save core area boundaries in a worker process."""
+    _worker_boundaries.clear()
+    _worker_boundaries.update(boundaries)
+
+
+def _worker_dists(pairs):
+    """Return distances between pairs of core areas in a worker process."""
+    return [boundary_distance(_worker_boundaries[core1],
+                              _worker_boundaries[core2])
+            for core1, core2 in pairs]
+
+
+def pair_distances(boundaries, pairs, pool=None, progress=None):
+    """Return exact minimum distances between pairs of core areas.
+
+    boundaries -- dict of CoreBoundary objects keyed by core area
+    pairs -- sequence of (core1, core2) pairs, with both cores in
+        boundaries
+    pool -- optional multiprocessing pool started with init_worker(
+        boundaries), to share pairs out between processes
+    progress -- optional function called with the number of pairs done
+
+    """
+    pairs = [(int(core1), int(core2)) for core1, core2 in pairs]
+    dists = []
+    if pool is None:
+        for core1, core2 in pairs:
+            dists.append(boundary_distance(boundaries[core1],
+                                           boundaries[core2]))
+            if progress is not None:
+                progress(len(dists))
+        return dists
+
+    # Pairs are handed out in chunks sorted by first core, so a worker
+    # reuses the KD-trees it builds
+    pairs_per_chunk = 64
+    chunks = [pairs[first:first + pairs_per_chunk]
+              for first in range(0, len(pairs), pairs_per_chunk)]
+    for chunk_dists in pool.imap(_worker_dists, chunks):
+        dists.extend(chunk_dists)
+        if progress is not None:
+            progress(len(dists))
+    return dists
@@ -1,7 +1,37 @@
 ### USER SETTABLE VARIABLES
 CALCNONNORMLCCS = False  # Mosiac non-normalized LCCs in step 5 (Boolean- set to True or False)
+CWDCACHEMB = 512  # Memory for cwd arrays kept between links in steps 5 and 8, in MB (Integer)
+                  # Cwd arrays from the step 3 cwd store are decoded once
+                  # and reused by the links of their core area while they
+                  # fit.
 MINCOSTDIST = None  # Minimum cost distance- any corridor shorter than this will not be mapped (Integer)
 MINEUCDIST = None  # Minimum euclidean distance- any core areas closer than this will not be connected (Integer)
+S1TILEMB = None  # Memory for each tile of tiled cost-weighted allocation in step 1, in MB (Integer or None)
+                 # For resistance rasters too large for CostAllocation.
+                 # Grids are kept in memory-mapped files in the adjacency
+                 # directory.  None runs CostAllocation on the whole raster.
+S2WORKERS = 1  # Number of processes calculating core area distances in step 2 (Integer)
+               # Capped by number of CPUs.
+S3CWDENGINE = "ARCGIS"  # Cost distance engine used in step 3 (String- set to "ARCGIS" or "NUMPY")
+                        # "NUMPY" calculates cost distances and least-cost
+                        # paths in memory instead of with Spatial Analyst.
+S3CWDMARGIN = None  # Corridor margin for "NUMPY" step 3 engine (Integer or None)
+                    # Cost distance calculations from each core area stop
+                    # this far (in cost units) beyond its farthest target
+                    # core area.  Should be at least CWDTHRESH if corridors
+                    # are truncated in step 5.  None maps the whole area.
+S3RESUME = True  # Resume step 3 from where an interrupted run left off (Boolean- set to True or False)
+                 # Uses the step 3 journal in the datapass directory if
+                 # it was written by a run with the same inputs.
+S3WORKERS = 1  # Number of processes calculating cost distances in step 3 with "NUMPY" engine (Integer)
+               # Capped by number of CPUs and available memory.
+               # Results are identical to running with one process.
+S5MOSAICMB = 1024  # Largest corridor mosaic held in memory in step 5, in MB (Integer or None)
+                   # Larger mosaics are kept in memory-mapped files in the
+                   # scratch directory.  None always keeps them in memory.
+S5WORKERS = 1  # Number of processes mosaicking corridors in step 5 (Integer)
+               # Used when all cwds are in the step 3 cwd store and
+               # SAVENORMLCCS is False.  Capped by number of CPUs.
 SAVENORMLCCS = True  # Save individual normalized LCC grids, not just mosaic (Boolean- set to True or False)
 SIMPLIFY_CORES = True  # Simplify cores before calculating distances (Boolean- set to True or False)
                        # This speeds up distance calculations in step 2,
@@ -13,6 +13,7 @@ import shutil
 import gc
 import ctypes
 import locale
+import multiprocessing
 from lm_retry_decorator import Retry
 
 
@@ -20,6 +21,9 @@ import numpy as npy
 import arcpy
 
 from lm_config import tool_env as cfg
+import lm_cwd
+import lm_core_index
+import lm_cwd_store
 try:
     test = cfg.releaseNum
 except Exception:
@@ -27,6 +31,9 @@ except Exception:
 
 _SCRIPT_NAME = "lm_util.py"
 
+ADJ_BLOCK_CELLS = 4194304  # Cells read at a time when finding adjacencies
+WRITE_BLOCK_CELLS = 16777216  # Cells converted at a time when writing arrays
+
 
 def cwd_cutoff_str(cutoff):
     """Convert CDW cutoff to text and abbreviate if possible."""
@@ -224,6 +231,37 @@ def drop_links(linktable, maxeud, mineud, maxcwd, mincwd,
 
 
 
+def get_core_boundaries(coreFC, coreFN):
+    """Returns dictionary of boundary rings of core areas by core ID.
+
+    Each ring is a list of (x, y) vertices.  Core areas with more than one
+    feature get the rings of all their features.
+
+    """
+    boundaries = {}
+    shapeField = arcpy.Describe(coreFC).shapeFieldName
+    rows = arcpy.SearchCursor(coreFC)
+    row = rows.next()
+    while row:
+        rings = boundaries.setdefault(int(row.getValue(coreFN)), [])
+        shape = row.getValue(shapeField)
+        if shape.type == "point":
+            rings.append([(shape.firstPoint.X, shape.firstPoint.Y)])
+        else:
+            for part in shape:
+                ring = []
+                for pnt in part:
+                    if pnt:
+                        ring.append((pnt.X, pnt.Y))
+                    else:  # Start of interior ring
+                        rings.append(ring)
+                        ring = []
+                rings.append(ring)
+        row = rows.next()
+    del row, rows
+    return boundaries
+
+
 def get_core_list(coreFC, coreFN):
     """Returns a list of core area IDs from polygon file"""
     try:
@@ -396,153 +434,30 @@ def build_stats(raster):
 ## Adjacency and allocation functions ##########################
 ############################################################################
 
-def get_adj_using_shift_method(alloc):
-    """Returns table listing adjacent core areas using a shift method.
-
-    The method involves shifting the allocation grid one pixel and then looking
-    for pixels with different allocations across shifted grids.
-
-    """
-    cellSize = arcpy.Describe(alloc).MeanCellHeight
-    arcpy.env.cellSize = cellSize
-
-    posShift = arcpy.env.cellSize
-    negShift = -1 * float(arcpy.env.cellSize)
-
-    arcpy.env.workspace = cfg.SCRATCHDIR
-
-    gprint('Calculating adjacencies crossing allocation boundaries...')
-    start_time = time.clock()
-    arcpy.Shift_management(alloc, "alloc_r", posShift, "0")
-
-    alloc_r = "alloc_r"
-    adjTable_r = get_allocs_from_shift(arcpy.env.workspace, alloc, alloc_r)
-    arcpy.Shift_management(alloc, "alloc_ul", negShift, posShift)
-
-    alloc_ul = "alloc_ul"
-    adjTable_ul = get_allocs_from_shift(arcpy.env.workspace, alloc, alloc_ul)
-    arcpy.Shift_management(alloc, "alloc_ur", posShift, posShift)
-
-    alloc_ur = "alloc_ur"
-    adjTable_ur = get_allocs_from_shift(arcpy.env.workspace, alloc, alloc_ur)
-    arcpy.Shift_management(alloc, "alloc_u", "0", posShift)
-
-    alloc_u = "alloc_u"
-    adjTable_u = get_allocs_from_shift(arcpy.env.workspace, alloc, alloc_u)
-    start_time = elapsed_time(start_time)
-
-    adjTable = combine_adjacency_tables(adjTable_r, adjTable_u, adjTable_ur,
-                                        adjTable_ul)
-
-    return adjTable
-
-
-def combine_adjacency_tables(adjTable_r, adjTable_u, adjTable_ur, adjTable_ul):
-    """Combines tables describing whether core areas are adjacent based on
-    allocation zones that touch on horizontal, vertical, and diagonal axes
+def combine_adjacency_tables(adjKeys):
+    """Combines lists of adjacent core area pair keys (see
+    lm_cwd.pair_keys) into a sorted table of unique core area pairs
     """
-    try:
-        adjTable = npy.append(adjTable_r, adjTable_u, axis=0)
-        adjTable = npy.append(adjTable, adjTable_ur, axis=0)
-        adjTable = npy.append(adjTable, adjTable_ul, axis=0)
-
-        pairs = npy.sort(adjTable[:, 0:2])
-        adjTable[:, 0:2] = pairs
-
-        # sort by 1st core Id then by 2nd core Id
-        ind = npy.lexsort((adjTable[:, 1], adjTable[:, 0]))
-        adjTable = adjTable[ind]
-
-        numDists = len(adjTable)
-        x = 1
-        while x < numDists:
-            if (adjTable[x, 0] == adjTable[x - 1, 0] and
-                adjTable[x, 1] == adjTable[x - 1, 1]):
-                adjTable[x - 1, 0] = 0  # mark for deletion
-            x = x + 1
-
-        if numDists > 0:
-            delRows = npy.asarray(npy.where(adjTable[:, 0] == 0))
-            delRowsVector = npy.zeros((delRows.shape[1]), dtype="int32")
-            delRowsVector[:] = delRows[0, :]
-            adjTable = delete_row(adjTable, delRowsVector)
-            del delRows
-            del delRowsVector
-
-        return adjTable
-    except arcpy.ExecuteError:
-        exit_with_geoproc_error(_SCRIPT_NAME)
-    except Exception:
-        exit_with_python_error(_SCRIPT_NAME)
-
-
-def get_allocs_from_shift(workspace, alloc, alloc_sh):
-    """Returns a table of adjacent allocation zones using grid shift method"""
-    try:
-        arcpy.env.scratchWorkspace = cfg.ARCSCRATCHDIR
-        arcpy.env.workspace = workspace
-        combine_ras = os.path.join(arcpy.env.workspace, "combine")
-        count = 0
-        statement = ('comb_ras = arcpy.sa.Combine([alloc, alloc_sh]); '
-                     'comb_ras.save(combine_ras)')
-        while True:
-            try:
-                exec statement
-            except Exception:
-                count, tryAgain = retry_arc_error(count, statement)
-                if not tryAgain:
-                    exec statement
-            else:
-                break
-        allocLookupTable = get_alloc_lookup_table(arcpy.env.workspace,
-                                                  combine_ras)
-        # Overwrite setting does not work for Combine, so delete raster
-        delete_data(combine_ras)
-        return allocLookupTable[:, 1:3]
+    return lm_cwd.key_pairs(npy.unique(npy.concatenate(adjKeys))).astype(
+        'int32')
 
-    except arcpy.ExecuteError:
-        exit_with_geoproc_error(_SCRIPT_NAME)
-    except Exception:
-        exit_with_python_error(_SCRIPT_NAME)
 
+def get_row_blocks(nrows, ncols):
+    """Returns windows of blocks of rows covering a grid.
 
-# Try this in script 4 too... and anything else with minras...
-def get_alloc_lookup_table(workspace, combine_ras):
-    """Returns a table of adjacent allocation zones.
-
-    Requires a raster with allocation zone attributes.
+    Each block after the first starts with the last row of the block
+    before it, so every cell can be compared with its 8 neighbours.
 
     """
-    try:
-        fldlist = arcpy.ListFields(combine_ras)
-
-        valFld = fldlist[1].name
-        allocFld = fldlist[3].name
-        allocFld_sh = fldlist[4].name
-
-        allocLookupTable = npy.zeros((0, 3), dtype="int32")
-        appendRow = npy.zeros((1, 3), dtype="int32")
-
-        rows = arcpy.SearchCursor(combine_ras)
-        row = rows.next()
-        while row:
-            alloc = row.getValue(allocFld)
-            alloc_sh = row.getValue(allocFld_sh)
-            if alloc != alloc_sh:
-                appendRow[0, 0] = row.getValue(valFld)
-                appendRow[0, 1] = alloc
-                appendRow[0, 2] = alloc_sh
-                allocLookupTable = npy.append(allocLookupTable, appendRow,
-                                              axis=0)
-            row = rows.next()
-        del row
-        del rows
-
-        return allocLookupTable
-    except arcpy.ExecuteError:
-        exit_with_geoproc_error(_SCRIPT_NAME)
-    except Exception:
-        exit_with_python_error(_SCRIPT_NAME)
+    blockRows = max(ADJ_BLOCK_CELLS // max(ncols, 1), 2)
+    windows = []
+    r0 = 0
+    while True:
+        r1 = min(r0 + blockRows, nrows)
+        windows.append((r0, r1, 0, ncols))
+        if r1 >= nrows:
+            return windows
+        r0 = r1 - 1
 
 
 ############################################################################
@@ -653,6 +568,29 @@ def get_ext_box_coords(feature):
     return get_box_data(1, arcpy.Describe(feature).extent)
 
 
+def get_core_boxes(feature, field_name):
+    """Get bounding boxes of all features, merged by field value.
+
+    Returns dictionary of [XMin, XMax, YMax, YMin] lists keyed by field
+    value, read with one cursor.
+
+    """
+    boxes = {}
+    shp_field = arcpy.Describe(feature).shapeFieldName
+    rows = arcpy.SearchCursor(feature, fields=field_name + "; " + shp_field)
+    for row in rows:
+        extent = row.getValue(shp_field).extent
+        box = [extent.XMin, extent.XMax, extent.YMax, extent.YMin]
+        field_val = int(row.getValue(field_name))
+        if field_val in boxes:
+            old_box = boxes[field_val]
+            box = [min(box[0], old_box[0]), max(box[1], old_box[1]),
+                   max(box[2], old_box[2]), min(box[3], old_box[3])]
+        boxes[field_val] = box
+    del rows
+    return boxes
+
+
 def make_points(workspace, pointArray, outFC):
     """Creates a shapefile with points specified by coordinates in pointArray
 
@@ -710,116 +648,322 @@ def make_points(workspace, pointArray, outFC):
 
 
 ############################################################################
-## LCP Shapefile Functions #################################################
+## NumPy Raster Functions ##################################################
 ############################################################################
 
-def create_lcp_shapefile(ws,linktable, sourceCore, targetCore, lcpLoop):
-    """Creates lcp shapefile.
+def get_raster_grid(raster):
+    """Return RasterGrid describing the geometry of a raster."""
+    desc = arcpy.Describe(raster)
+    return lm_cwd.RasterGrid(desc.extent.XMin, desc.extent.YMax,
+                             desc.meanCellWidth, desc.height, desc.width,
+                             desc.spatialReference)
 
-    Shows locations of least-cost path lines attributed with corridor
-    info/status.
 
-    """
-    try:
-        arcpy.env.workspace = ws
-        rows = get_links_from_core_pairs(linktable, sourceCore, targetCore)
-        link = rows[0]
-
-        lcpline = os.path.join(ws, "lcpline.shp")
-        lcpRas = os.path.join(ws, "lcp")
-
-        arcpy.RasterToPolyline_conversion(lcpRas, lcpline, "NODATA", "",
-                                           "NO_SIMPLIFY")
-
-        lcplineDslv = os.path.join(ws, "lcplineDslv.shp")
-        arcpy.Dissolve_management(lcpline, lcplineDslv)
-
-        arcpy.AddField_management(lcplineDslv, "Link_ID", "LONG", "5")
-        arcpy.CalculateField_management(lcplineDslv, "Link_ID",
-                                     int(linktable[link, cfg.LTB_LINKID]),
-                                     "PYTHON_9.3")
-
-        linktypecode = linktable[link, cfg.LTB_LINKTYPE]
-        activelink, linktypedesc = get_link_type_desc(linktypecode)
-
-        arcpy.AddField_management(lcplineDslv, "Active", "SHORT")
-        arcpy.CalculateField_management(lcplineDslv, "Active", activelink,
-                                     "PYTHON_9.3")
-
-        arcpy.AddField_management(lcplineDslv, "Link_Info", "TEXT")
-        arcpy.CalculateField_management(lcplineDslv, "Link_Info",
-                                         linktypedesc, "PYTHON_9.3")
-
-        arcpy.AddField_management(lcplineDslv, "From_Core", "LONG", "5")
-        arcpy.CalculateField_management(lcplineDslv, "From_Core",
-                                         int(sourceCore), "PYTHON_9.3")
-        arcpy.AddField_management(lcplineDslv, "To_Core", "LONG", "5")
-        arcpy.CalculateField_management(lcplineDslv, "To_Core",
-                                         int(targetCore), "PYTHON_9.3")
-
-        arcpy.AddField_management(lcplineDslv, "Euc_Dist", "DOUBLE", "10",
-                                   "2")
-        arcpy.CalculateField_management(lcplineDslv, "Euc_Dist",
-                                     linktable[link, cfg.LTB_EUCDIST],
-                                     "PYTHON_9.3")
-
-        arcpy.AddField_management(lcplineDslv, "CW_Dist", "DOUBLE", "10", "2")
-        arcpy.CalculateField_management(lcplineDslv, "CW_Dist",
-                                     linktable[link, cfg.LTB_CWDIST],
-                                     "PYTHON_9.3")
-        arcpy.AddField_management(lcplineDslv, "LCP_Length", "DOUBLE", "10",
-                                   "2")
-        rows = arcpy.UpdateCursor(lcplineDslv)
-        row = rows.next()
-        while row:
-            feat = row.shape
-            lcpLength = int(feat.length)
-            row.setValue("LCP_Length", lcpLength)
-            rows.updateRow(row)
-            row = rows.next()
-        del row, rows
+@Retry(10)
+def raster_to_array(raster, grid, window=None, nodata=npy.nan):
+    """Read a window of a raster into a NumPy array.
 
-        try:
-            distRatio1 = (float(linktable[link, cfg.LTB_CWDIST])
-                        / float(linktable[link, cfg.LTB_EUCDIST]))
-        except ZeroDivisionError:
-            distRatio1 = -1
+    NoData cells are set to nodata.  Float rasters are returned as float64
+    arrays, integer rasters as int32 arrays if an integer nodata value is
+    passed and as float64 arrays otherwise.
 
-        arcpy.AddField_management(lcplineDslv, "cwd2Euc_R", "DOUBLE", "10",
-                                   "2")
-        arcpy.CalculateField_management(lcplineDslv, "cwd2Euc_R", distRatio1,
-                                     "PYTHON_9.3")
+    """
+    if window is None:
+        window = grid.full_window()
+    r0, r1, c0, c1 = window
+    lower_left = arcpy.Point(*grid.window_lower_left(window))
+    arr = arcpy.RasterToNumPyArray(raster, lower_left, c1 - c0, r1 - r0,
+                                   -9999)
+    if arr.dtype.kind == 'f' or nodata != nodata:  # NaN for NoData
+        arr = arr.astype('float64')
+    else:
+        arr = arr.astype('int32')
+    arr[arr == -9999] = nodata
+    return arr
 
-        try:
-            distRatio2 = (float(linktable[link, cfg.LTB_CWDIST])
-                        / float(lcpLength))
-        except ZeroDivisionError:
-            distRatio2 = -1
 
-        arcpy.AddField_management(lcplineDslv, "cwd2Path_R", "DOUBLE", "10",
-                                   "2")
-        arcpy.CalculateField_management(lcplineDslv, "cwd2Path_R", distRatio2,
-                                     "PYTHON_9.3")
+@Retry(10)
+def array_to_raster(arr, out_raster, grid, window=None, noData=None,
+                    roundInt=False):
+    """Save a NumPy array as a raster.
 
-        lcpLoop = lcpLoop + 1
-        lcpShapefile = os.path.join(cfg.DATAPASSDIR, "lcpLines_s3.shp")
-        if lcpLoop == 1:
-            if arcpy.Exists(lcpShapefile):
-                try:
-                    arcpy.Delete(lcpShapefile)
+    NaN values in float arrays and negative values in integer arrays are
+    written as NoData, unless a boolean array of NoData cells is passed as
+    noData, or a function returning one for a block of rows of arr.  Float
+    arrays are written as float32 and integer arrays as int32.  With
+    roundInt, float arrays are rounded to int32 as by arcpy.sa.Int(arr +
+    0.5).
 
-                except Exception:
-                    dashline(1)
-                    msg = ('ERROR: Could not remove LCP shapefile ' +
-                           lcpShapefile + '. Was it open in ArcMap?\n You may '
-                           'need to re-start ArcMap to release the file lock.')
-                    raise_error(msg)
+    The array is converted a block of rows at a time, so no full-size copy
+    of it is made.  Blocks are mosaicked if there is more than one.
 
-            arcpy.Copy_management(lcplineDslv, lcpShapefile)
+    """
+    if window is None:
+        window = grid.full_window()
+    nrows, ncols = arr.shape
+    if arr.dtype.kind == 'f' and not roundInt:
+        dtype, pixelType = 'float32', '32_BIT_FLOAT'
+    else:
+        dtype, pixelType = 'int32', '32_BIT_SIGNED'
+    blockRows = max(WRITE_BLOCK_CELLS // max(ncols, 1), 1)
+    blockDir = os.path.join(cfg.SCRATCHDIR, 'blocks_' + str(os.getpid()))
+    blockRasters = []
+    for r0 in range(0, nrows, blockRows):
+        r1 = min(r0 + blockRows, nrows)
+        block = arr[r0:r1]
+        if noData is None:
+            if arr.dtype.kind == 'f':
+                blockNoData = npy.isnan(block)
+            else:
+                blockNoData = block < 0
+        elif callable(noData):
+            blockNoData = noData(block)
+        else:
+            blockNoData = noData[r0:r1]
+        if roundInt:
+            outBlock = block + npy.asarray(0.5, dtype=block.dtype)
+            outBlock[blockNoData] = 0
+            outBlock = outBlock.astype(dtype)  # Truncates
+        else:
+            outBlock = block.astype(dtype)
+        outBlock[blockNoData] = -9999
+        del blockNoData
+        blockWindow = (window[0] + r0, window[0] + r1, window[2], window[3])
+        lower_left = arcpy.Point(*grid.window_lower_left(blockWindow))
+        out_ras = arcpy.NumPyArrayToRaster(outBlock, lower_left,
+                                           grid.cell_size, grid.cell_size,
+                                           -9999)
+        del outBlock
+        if r0 == 0 and r1 == nrows:
+            out_ras.save(out_raster)
         else:
-            arcpy.Append_management(lcplineDslv, lcpShapefile, "TEST")
+            create_dir(blockDir)
+            blockRaster = os.path.join(blockDir,
+                                       'blk' + str(len(blockRasters)))
+            out_ras.save(blockRaster)
+            blockRasters.append(blockRaster)
+        del out_ras
+    if blockRasters:
+        arcpy.MosaicToNewRaster_management(
+            ';'.join(blockRasters), os.path.dirname(out_raster),
+            os.path.basename(out_raster), "", pixelType, grid.cell_size, "1")
+        for blockRaster in blockRasters:
+            delete_data(blockRaster)
+        delete_dir(blockDir)
+    if grid.spatial_ref is not None:
+        arcpy.DefineProjection_management(out_raster, grid.spatial_ref)
+
+
+def get_window_extent(grid, window):
+    """Return arcpy Extent of a window of a raster grid."""
+    xmin, ymin = grid.window_lower_left(window)
+    return arcpy.Extent(xmin, ymin,
+                        xmin + (window[3] - window[2]) * grid.cell_size,
+                        ymin + (window[1] - window[0]) * grid.cell_size)
+
+
+def get_search_reach(resRaster, maxDist):
+    """Return number of cells cost distance calcs can spread from sources.
+
+    Based on maxDist and the minimum resistance of resRaster.  Returns None
+    if there is no limit.
+
+    """
+    if maxDist is None:
+        return None
+    # Minimum is read from the raster rather than its statistics, which
+    # may be out of date or sampled with a skip factor
+    grid = get_raster_grid(resRaster)
+    minRes = None
+    for window in get_row_blocks(grid.nrows, grid.ncols):
+        resArray = raster_to_array(resRaster, grid, window)
+        resArray = resArray[~npy.isnan(resArray)]
+        if len(resArray) > 0 and (minRes is None or
+                                  resArray.min() < minRes):
+            minRes = float(resArray.min())
+    return lm_cwd.max_reach(maxDist, minRes, grid.cell_size)
+
+
+def write_core_index(coreRaster):
+    """Index cells of core raster and save index to datapass directory.
+
+    Only cells with resistance data are indexed.
 
-        return lcpLoop
+    """
+    grid = get_raster_grid(cfg.RESRAST)
+    coreArray = raster_to_array(coreRaster, grid, nodata=0)
+    coreArray[npy.isnan(raster_to_array(cfg.RESRAST, grid))] = 0
+    delete_dir(cfg.COREINDEXDIR)
+    lm_core_index.save_core_index(cfg.COREINDEXDIR, coreArray, grid)
+
+
+def get_core_index(raster=None):
+    """Return core area cell index, or None if it has not been created.
+
+    If a raster is given, None is also returned if the index grid is not
+    aligned with the raster.  Otherwise the index grid is given the spatial
+    reference of the raster.
+
+    """
+    if not lm_core_index.index_exists(cfg.COREINDEXDIR):
+        return None
+    coreIndex = lm_core_index.CoreIndex(cfg.COREINDEXDIR)
+    if raster is not None:
+        rasterGrid = get_raster_grid(raster)
+        if not coreIndex.grid.is_aligned(rasterGrid):
+            return None
+        coreIndex.grid.spatial_ref = rasterGrid.spatial_ref
+    return coreIndex
+
+
+def get_cwd_store():
+    """Return store of cwd arrays saved in step 3."""
+    return lm_cwd_store.CwdStore(cfg.CWDSTOREDIR)
+
+
+def get_cwd_raster(core, bufferCells=0):
+    """Return path of a cwd raster for a core area.
+
+    Cwds are kept in the step 3 cwd store rather than as rasters, so a
+    raster is written from the store to the scratch directory the first
+    time it is needed.  The raster covers the window holding cwd values,
+    grown by bufferCells.  Cwd rasters in the cwd directory (e.g. from
+    earlier versions) are used as they are.
+
+    """
+    cwdRaster = get_cwd_path(core)
+    cwdStore = get_cwd_store()
+    if arcpy.Exists(cwdRaster) or not cwdStore.exists(core):
+        return cwdRaster
+    outRaster = os.path.join(cfg.SCRATCHDIR, 'cwd', 'cwd_' + str(int(core)))
+    if not arcpy.Exists(outRaster):
+        create_dir(os.path.dirname(outRaster))
+        # Stored windows are in rows and columns of the resistance grid
+        grid = get_raster_grid(cfg.RESRAST)
+        window = grid.buffer_window(cwdStore.window(core), bufferCells)
+        array_to_raster(cwdStore.read(core, window), outRaster, grid,
+                        window)
+    return outRaster
+
+
+def get_store_lcc(cwdStore, corex, corey, lcDist):
+    """Return corridor array for a core pair from stored cwd arrays.
+
+    Corridor values are the sum of the two cwds minus lcDist, over the
+    window where both cwd arrays have values.  Returns the array and the
+    window.  cwdStore can also be a CwdCache reading from the store.
+
+    """
+    window = lm_cwd_store.intersect_windows(cwdStore.window(corex),
+                                            cwdStore.window(corey))
+    if window is None:
+        raise ValueError('Cost-weighted distances from core areas ' +
+                         str(corex) + ' and ' + str(corey) +
+                         ' do not overlap.')
+    lccArray = (cwdStore.read(corex, window).astype('float64') +
+                cwdStore.read(corey, window) - lcDist)
+    return lccArray, window
+
+
+def write_store_lcc(cwdStore, corex, corey, lcDist, lccRaster, grid):
+    """Write corridor raster for a core pair from stored cwd arrays."""
+    lccArray, window = get_store_lcc(cwdStore, corex, corey, lcDist)
+    array_to_raster(lccArray, lccRaster, grid, window)
+
+
+############################################################################
+## LCP Shapefile Functions #################################################
+############################################################################
+
+# Fields of LCP shapefile: (name, type, precision, scale)
+LCP_FIELDS = [("Link_ID", "LONG", "5", ""),
+              ("Active", "SHORT", "", ""),
+              ("Link_Info", "TEXT", "", ""),
+              ("From_Core", "LONG", "5", ""),
+              ("To_Core", "LONG", "5", ""),
+              ("Euc_Dist", "DOUBLE", "10", "2"),
+              ("CW_Dist", "DOUBLE", "10", "2"),
+              ("LCP_Length", "DOUBLE", "10", "2"),
+              ("cwd2Euc_R", "DOUBLE", "10", "2"),
+              ("cwd2Path_R", "DOUBLE", "10", "2")]
+
+
+def get_lcp_record(linktable, sourceCore, targetCore, vertices, lcpLength):
+    """Returns least-cost path line record for writing to lcp shapefile.
+
+    Record is a dictionary of LCP_FIELDS values plus path vertices, with
+    link info/status taken from the link table.
+
+    """
+    rows = get_links_from_core_pairs(linktable, sourceCore, targetCore)
+    link = rows[0]
+    activelink, linktypedesc = get_link_type_desc(
+        linktable[link, cfg.LTB_LINKTYPE])
+    cwDist = float(linktable[link, cfg.LTB_CWDIST])
+    eucDist = float(linktable[link, cfg.LTB_EUCDIST])
+    lcpLength = int(lcpLength)
+    try:
+        distRatio1 = cwDist / eucDist
+    except ZeroDivisionError:
+        distRatio1 = -1
+    try:
+        distRatio2 = cwDist / float(lcpLength)
+    except ZeroDivisionError:
+        distRatio2 = -1
+    return {"vertices": vertices,
+            "Link_ID": int(linktable[link, cfg.LTB_LINKID]),
+            "Active": int(activelink),
+            "Link_Info": linktypedesc.strip('"'),
+            "From_Core": int(sourceCore),
+            "To_Core": int(targetCore),
+            "Euc_Dist": eucDist,
+            "CW_Dist": cwDist,
+            "LCP_Length": lcpLength,
+            "cwd2Euc_R": distRatio1,
+            "cwd2Path_R": distRatio2}
+
+
+def write_lcp_shapefile(lcpRecords, spatialRef):
+    """Writes lcp shapefile in one pass from least-cost path line records.
+
+    Shows locations of least-cost path lines attributed with corridor
+    info/status.
+
+    """
+    try:
+        if len(lcpRecords) == 0:
+            return
+        lcpShapefile = os.path.join(cfg.DATAPASSDIR, "lcpLines_s3.shp")
+        if arcpy.Exists(lcpShapefile):
+            try:
+                arcpy.Delete_management(lcpShapefile)
+            except Exception:
+                dashline(1)
+                msg = ('ERROR: Could not remove LCP shapefile ' +
+                       lcpShapefile + '. Was it open in ArcMap?\n You may '
+                       'need to re-start ArcMap to release the file lock.')
+                raise_error(msg)
+
+        arcpy.CreateFeatureclass_management(
+            cfg.DATAPASSDIR, "lcpLines_s3.shp", "POLYLINE", "", "DISABLED",
+            "DISABLED", spatialRef)
+        for field in LCP_FIELDS:
+            arcpy.AddField_management(lcpShapefile, *field)
+        # Remove default field added by CreateFeatureclass
+        arcpy.DeleteField_management(lcpShapefile, "Id")
+
+        lineArray = arcpy.Array()
+        rows = arcpy.InsertCursor(lcpShapefile)
+        for record in lcpRecords:
+            for x, y in record["vertices"]:
+                lineArray.add(arcpy.Point(x, y))
+            row = rows.newRow()
+            row.shape = arcpy.Polyline(lineArray, spatialRef)
+            for field in LCP_FIELDS:
+                row.setValue(field[0], record[field[0]])
+            rows.insertRow(row)
+            lineArray.removeAll()
+        del rows
 
     except arcpy.ExecuteError:
         exit_with_geoproc_error(_SCRIPT_NAME)
@@ -993,93 +1137,36 @@ def delete_col(A, delcol):
     return A[keeprows][:, keepcols]
 
 
-def components_no_sparse(G):
-    """Returns components of a graph while avoiding use of sparse matrices
-
-    From gapdt.py by Viral Shah
-
-    """
-    try:
-        U, V = npy.where(G)
-        n = G.shape[0]
-        D = npy.arange(0, n, dtype='int32')
-        star = npy.zeros(n, 'int32')
-        all_stars = False
-        while True:
-            star = check_stars(D, star)
-            D = conditional_hooking(D, star, U, V)
-            star = check_stars(D, star)
-            D = unconditional_hooking(D, star, U, V)
-
-            # pointer jumping
-            D = D[D]
-
-            if all_stars:
-                return relabel(D, 1)
-
-            if sum(star) == n:
-                all_stars = True
-    except Exception:
-        exit_with_python_error(_SCRIPT_NAME)
-
+def find_root(parents, node):
+    """Returns root of a node in a union-find forest
 
-def relabel(oldlabel, offset=0): # same as gapdt
-    """Utility for components code
-
-    From gapdt.py by Viral Shah
+    parents is a dictionary of parent nodes.  Nodes not in it are roots.
+    Nodes on the path to the root are pointed at the root (path
+    compression).
 
     """
-    newlabel = npy.zeros(npy.size(oldlabel), dtype='int32')
-    s = npy.sort(oldlabel)
-    perm = npy.argsort(oldlabel)
-    f = npy.where(npy.diff(npy.concatenate(([s[0] - 1], s))))
-    newlabel[f] = 1
-    newlabel = npy.cumsum(newlabel)
-    newlabel[perm] = npy.copy(newlabel)
-    return newlabel - 1 + offset
+    root = node
+    while root in parents:
+        root = parents[root]
+    while node != root:
+        parents[node], node = root, parents[node]
+    return root
 
 
-def conditional_hooking (D, star, u, v):
-    """Utility for components code (updated Jan 2012)
+def union_roots(parents, node1, node2):
+    """Joins the trees of two nodes in a union-find forest
 
-    From gapdt.py by Viral Shah
+    The lower root becomes the root of the joined tree, so each tree is
+    labelled by its lowest node.  Returns False if the nodes were already
+    in the same tree.
 
     """
-    Du = D[u]
-    Dv = D[v]
-
-    hook = npy.where ((star[u] == 1) & (Du > Dv))
-    D[Du[hook]] = Dv[hook]
-
-    return D
-
-def unconditional_hooking (D, star, u, v):
-    """Utility for components code (updated Jan 2012)
-
-    From gapdt.py by Viral Shah
-
-    """
-
-    Du = D[u]
-    Dv = D[v]
-
-    hook = npy.where((star[u] == 1) & (Du != Dv))
-    D[Du[hook]] = Dv[hook]
-
-    return D
-
-def check_stars(D, star): # same as gapdt
-    """Utility for components code
-
-    From gapdt.py by Viral Shah
-
-    """
-    star[:] = 1
-    notstars = npy.where(D != D[D])
-    star[notstars] = 0
-    star[D[D[notstars]]] = 0
-    star = star[D]
-    return star
+    root1 = find_root(parents, node1)
+    root2 = find_root(parents, node2)
+    if root1 == root2:
+        return False
+    parents[max(root1, root2)] = min(root1, root2)
+    return True
 
 
 ############################################################################
@@ -1287,13 +1374,25 @@ def write_link_table(linktable, outlinkTableFile, *inLinkTableFile):
 
 
 def write_adj_file(outcsvfile, adjTable):
-    """Outputs adjacent core areas to pass adjacency info between steps"""
+    """Outputs adjacent core areas to pass adjacency info between steps
+
+    If adjTable has a third column of least-cost distances between the
+    core areas, it is written as an lcDist column.
+
+    """
+    lcDists = adjTable.shape[1] > 2
     outfile = open(outcsvfile, "w")
     outfile.write("#Edge" + "," + str(cfg.COREFN) + "," + str(cfg.COREFN) +
-                  "_1" + "\n")
+                  "_1")
+    if lcDists:
+        outfile.write(",lcDist")
+    outfile.write("\n")
     for x in range(0, len(adjTable)):
-        outfile.write(str(x) + "," + str(adjTable[x, 0]) + "," +
-                      str(adjTable[x, 1]) + "\n")
+        outfile.write(str(x) + "," + str(int(adjTable[x, 0])) + "," +
+                      str(int(adjTable[x, 1])))
+        if lcDists:
+            outfile.write("," + str(adjTable[x, 2]))
+        outfile.write("\n")
     outfile.close()
 
 
@@ -2313,8 +2412,29 @@ class MEMORYSTATUSEX(ctypes.Structure):
         return super(MEMORYSTATUSEX, self).__init__()
 
 def get_mem():
-    stat = MEMORYSTATUSEX()
-    ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(stat))
-    totMem = float(int(10 * float(stat.ullTotalPhys)/1073741824))/10
-    availMem = float(int(10 * float(stat.ullAvailPhys)/1073741824))/10
+    """Return total and available physical memory in GB."""
+    if os.name == 'nt':
+        stat = MEMORYSTATUSEX()
+        ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(stat))
+        totPhys = float(stat.ullTotalPhys)
+        availPhys = float(stat.ullAvailPhys)
+    else:
+        pageSize = os.sysconf('SC_PAGE_SIZE')
+        totPhys = float(os.sysconf('SC_PHYS_PAGES') * pageSize)
+        availPhys = float(os.sysconf('SC_AVPHYS_PAGES') * pageSize)
+    totMem = float(int(10 * totPhys/1073741824))/10
+    availMem = float(int(10 * availPhys/1073741824))/10
     return totMem, availMem
+
+
+def start_pool(numWorkers, initializer, initargs):
+    """Return multiprocessing pool of worker processes.
+
+    Each worker runs initializer(*initargs) when it starts.
+
+    """
+    # Python run within ArcGIS reports ArcMap/ArcCatalog as executable
+    pythonExe = os.path.join(sys.exec_prefix, 'python.exe')
+    if os.path.exists(pythonExe):
+        multiprocessing.set_executable(pythonExe)
+    return multiprocessing.Pool(numWorkers, initializer, initargs)
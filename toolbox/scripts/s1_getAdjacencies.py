@@ -8,12 +8,16 @@ cost-weighted distance space
 """
 
 from os import path
+import functools
 import time
 
 import numpy as npy
 import arcpy
 
 from lm_config import tool_env as cfg
+import lm_cwd
+import lm_cwd_tiles
+import lm_euc
 import lm_util as lu
 
 
@@ -134,6 +138,20 @@ def cwadjacency():
                               str(cfg.TMAXCWDIST))
         arcpy.env.cellSize = arcpy.Describe(bResistance).MeanCellHeight
         arcpy.env.extent = "MAXOF"
+        searchWindow = None
+        if cfg.BUFFERDIST is None:
+            # Limit allocation to cells that can be within the maximum
+            # cost-weighted distance of a core area
+            searchReach = lu.get_search_reach(cfg.RESRAST, cfg.TMAXCWDIST)
+            coreIndex = lu.get_core_index(cfg.RESRAST)
+            if searchReach is not None and coreIndex is not None:
+                searchWindow = coreIndex.search_window(coreIndex.core_ids,
+                                                       searchReach)
+                if searchWindow is not None:
+                    arcpy.env.extent = lu.get_window_extent(coreIndex.grid,
+                                                            searchWindow)
+                    gprint('Cost-weighted distance allocation limited to ' +
+                           str(searchReach) + ' cells around core areas.')
         gprint('Processing cell size: ' + arcpy.env.cellSize)
 
         arcpy.env.workspace = cfg.ADJACENCYDIR
@@ -147,27 +165,46 @@ def cwadjacency():
         lu.delete_data(alloc_ras)
         lu.delete_data(outDistanceRaster)
 
-        statement = ('costAllocOut = arcpy.sa.CostAllocation(cfg.CORERAS, '
-                     'bResistance, cfg.TMAXCWDIST, cfg.CORERAS,"VALUE", '
-                     'outDistanceRaster);'
-                     'costAllocOut.save(alloc_ras)')
-        count = 0
-        while True:
-            try:
-                exec statement
-            except Exception:
-                count, tryAgain = lu.retry_arc_error(count, statement)
-                if not tryAgain:
+        if cfg.S1TILEMB is not None:
+            # Allocate a tile at a time, for rasters too large for memory
+            adjTable = tiled_cwadjacency(bResistance, searchWindow)
+        else:
+            statement = ('costAllocOut = arcpy.sa.CostAllocation('
+                         'cfg.CORERAS, bResistance, cfg.TMAXCWDIST, '
+                         'cfg.CORERAS,"VALUE", outDistanceRaster);'
+                         'costAllocOut.save(alloc_ras)')
+            count = 0
+            while True:
+                try:
                     exec statement
-            else:
-                break
+                except Exception:
+                    count, tryAgain = lu.retry_arc_error(count, statement)
+                    if not tryAgain:
+                        exec statement
+                else:
+                    break
+
+            gprint('\nBuilding output statistics and pyramids for CWD '
+                   'raster.')
+            lu.build_stats(outDistanceRaster)
+            arcpy.env.scratchWorkspace = cfg.ARCSCRATCHDIR
+            gprint('Cost-weighted distance allocation done.')
+            start_time = lu.elapsed_time(start_time)
 
-        gprint('\nBuilding output statistics and pyramids for CWD raster.')
-        lu.build_stats(outDistanceRaster)
-        arcpy.env.scratchWorkspace = cfg.ARCSCRATCHDIR
-        gprint('Cost-weighted distance allocation done.')
+            # Allocation zones of adjacent core areas meet, and the
+            # least-cost path between them crosses the boundary where the
+            # cwds on either side plus the cost of the step across are
+            # smallest
+            grid = lu.get_raster_grid(alloc_ras)
+            read_block = functools.partial(read_alloc_rasters, alloc_ras,
+                                           outDistanceRaster, bResistance,
+                                           grid)
+            adjTable = get_adjacency_dists(read_block, grid.nrows,
+                                           grid.ncols, grid.cell_size)
+        gprint(str(len(adjTable)) + ' pairs of adjacent core areas found.')
         start_time = lu.elapsed_time(start_time)
-        adjshiftwrite(alloc_ras, outcsvfile, outcsvLogfile)
+        lu.write_adj_file(outcsvfile, adjTable)
+        lu.write_adj_file(outcsvLogfile, adjTable)
 
     # Return GEOPROCESSING specific errors
     except arcpy.ExecuteError:
@@ -182,10 +219,90 @@ def cwadjacency():
         lu.exit_with_python_error(_SCRIPT_NAME)
 
 
+def tiled_cwadjacency(resRaster, window):
+    """Calculate cost-weighted allocation a tile at a time and return
+    adjacency table.
+
+    Resistance, cwd and allocation grids are kept in memory-mapped files,
+    so memory use is set by the S1TILEMB tile budget instead of the
+    raster size.  No cwd raster is written.
+
+    """
+    grid = lu.get_raster_grid(cfg.RESRAST)
+    if cfg.BUFFERDIST is not None:
+        extent = arcpy.Describe(cfg.BNDCIR).extent
+        window = grid.bounds_window(extent.XMin, extent.YMin, extent.XMax,
+                                    extent.YMax)
+    elif window is None:
+        window = grid.full_window()
+    nrows = window[1] - window[0]
+    ncols = window[3] - window[2]
+    tileRows = lm_cwd_tiles.tile_size(cfg.S1TILEMB)
+    tiles = lm_cwd_tiles.TiledAllocation(
+        path.join(cfg.ADJACENCYDIR, "cwd_tiles"), nrows, ncols, tileRows,
+        grid.cell_size)
+    numTiles = tiles.tile_count[0] * tiles.tile_count[1]
+    gprint('Running tiled cost-weighted distance allocation on ' +
+           str(numTiles) + ' tiles of up to ' + str(tileRows) + ' by ' +
+           str(tileRows) + ' cells.')
+
+    for r0, r1, c0, c1 in lu.get_row_blocks(nrows, ncols):
+        blockWindow = (window[0] + r0, window[0] + r1, window[2], window[3])
+        resArray = lu.raster_to_array(resRaster, grid, blockWindow)
+        coreArray = lu.raster_to_array(cfg.CORERAS, grid, blockWindow,
+                                       nodata=-1)
+        tiles.set_rows(r0, resArray, coreArray)
+        del resArray, coreArray
+
+    def report(numRuns, numQueued):
+        """Report progress every 100 tile runs."""
+        if numRuns % 100 == 0:
+            gprint(str(numRuns) + ' tile runs done, ' + str(numQueued) +
+                   ' tiles queued.')
+
+    numRuns = tiles.run(cfg.TMAXCWDIST, report)
+    gprint('Cost-weighted distance allocation converged after ' +
+           str(numRuns) + ' tile runs.')
+    adjTable = get_adjacency_dists(tiles.read, nrows, ncols, grid.cell_size)
+    tiles.delete()
+    return adjTable
+
+
+def read_alloc_rasters(allocRaster, cwdRaster, resRaster, grid, window):
+    """Returns allocation, cwd and resistance arrays for a window"""
+    return (lu.raster_to_array(allocRaster, grid, window, nodata=-1),
+            lu.raster_to_array(cwdRaster, grid, window),
+            lu.raster_to_array(resRaster, grid, window))
+
+
+def get_adjacency_dists(read_block, nrows, ncols, cellSize):
+    """Return table of adjacent core areas and least-cost distances
+    between them.
+
+    read_block is a function returning allocation, cwd and resistance
+    arrays for a window.  The grid is read a block of rows at a time.
+
+    """
+    gprint('Calculating adjacencies and least-cost distances crossing '
+           'allocation boundaries...')
+    adjKeys = npy.zeros(0, dtype='int64')
+    adjDists = npy.zeros(0, dtype='float64')
+    for window in lu.get_row_blocks(nrows, ncols):
+        allocArray, cwdArray, resArray = read_block(window)
+        blockKeys, blockDists = lm_cwd.allocation_distances(
+            allocArray, cwdArray, resArray, cellSize)
+        del allocArray, cwdArray, resArray
+        adjKeys, adjDists = lm_cwd.min_key_dists(
+            npy.append(adjKeys, blockKeys), npy.append(adjDists, blockDists))
+    adjTable = npy.zeros((len(adjKeys), 3), dtype='float64')
+    adjTable[:, 0:2] = lm_cwd.key_pairs(adjKeys)
+    adjTable[:, 2] = npy.where(npy.isinf(adjDists), -1, adjDists)
+    return adjTable
+
+
 def euadjacency():
     """Calculate Euclidean adjacency."""
     try:
-        ALLOC_RASFN = "Euc_alloc_ras"
         lu.dashline()
         gprint('Calculating Euclidean adjacency')
         outcsvfile = cfg.EUCADJFILE
@@ -193,46 +310,57 @@ def euadjacency():
 
         # ----------------------------------------------
         # Euclidean allocation code
-        arcpy.env.workspace = cfg.ADJACENCYDIR
         gprint('Starting Euclidean adjacency processing...')
-        # Euclidean cell size
-        cellSizeEuclidean = arcpy.Describe(cfg.RESRAST).MeanCellHeight
-
-        oldextent = arcpy.env.extent
+        # Euclidean allocation uses the core raster's cells, which match
+        # those of the resistance raster
+        grid = lu.get_raster_grid(cfg.CORERAS)
+        window = grid.full_window()
         if cfg.BUFFERDIST is not None:
-            arcpy.env.extent = arcpy.Describe(cfg.BNDCIR).extent
+            extent = arcpy.Describe(cfg.BNDCIR).extent
+            window = grid.bounds_window(extent.XMin, extent.YMin,
+                                        extent.XMax, extent.YMax)
 
         start_time = time.clock()
-
-        arcpy.env.scratchWorkspace = cfg.ARCSCRATCHDIR
-        outDistanceRaster = path.join(cfg.ADJACENCYDIR, "euc")
-        alloc_ras = path.join(cfg.ADJACENCYDIR, ALLOC_RASFN)
-        lu.delete_data(alloc_ras)
-        lu.delete_data(outDistanceRaster)
-
-        count = 0
-        statement = ('alloc_raster = arcpy.sa.EucAllocation('
-                     'cfg.CORERAS, "", "", '
-                     'cellSizeEuclidean, "", outDistanceRaster, ""); '
-                     'alloc_raster.save(alloc_ras)')
-        while True:
-            try:
-                exec statement
-            except Exception:
-                count, tryAgain = lu.retry_arc_error(count, statement)
-                if not tryAgain:
-                    exec statement
-            else:
-                break
-
-        arcpy.env.scratchWorkspace = cfg.ARCSCRATCHDIR
+        nrows = window[1] - window[0]
+        ncols = window[3] - window[2]
+        rowBlocks = lu.get_row_blocks(nrows, ncols)
+
+        # Find the nearest core cell above each block in each column,
+        # reading the core raster a block of rows at a time
+        aboveStates = []
+        state = None
+        for r0, r1, c0, c1 in rowBlocks:
+            coreArray = read_core_rows(grid, window, r0, r1)
+            if state is None:
+                state = lm_euc.column_state(ncols, coreArray.dtype)
+            aboveStates.append((state[0].copy(), state[1].copy()))
+            lm_euc.scan_down(coreArray, r0, state)
+            del coreArray
+        del state
+
+        # Allocate the blocks from the bottom up, passing each block
+        # straight on to find adjacent allocation zones
+        adjKeys = []
+        below = None
+        while rowBlocks:
+            r0, r1, c0, c1 = rowBlocks.pop()
+            above = aboveStates.pop()
+            coreArray = read_core_rows(grid, window, r0, r1)
+            if below is None:
+                below = lm_euc.column_state(ncols, coreArray.dtype)
+            nearRows, nearZones = lm_euc.nearest_rows(coreArray, r0, above,
+                                                      below)
+            del coreArray, above
+            allocArray, distArray = lm_euc.euc_allocation(nearRows,
+                                                          nearZones, r0)
+            del nearRows, nearZones, distArray
+            adjKeys.append(lm_cwd.adjacent_zones(allocArray))
+            del allocArray
+        adjTable = lu.combine_adjacency_tables(adjKeys)
         gprint('\nEuclidean distance allocation done.')
         start_time = lu.elapsed_time(start_time)
-        arcpy.env.extent = oldextent
-        adjshiftwrite(alloc_ras, outcsvfile, outcsvLogfile)
-
-        # Clean up
-        lu.delete_data(outDistanceRaster)
+        lu.write_adj_file(outcsvfile, adjTable)
+        lu.write_adj_file(outcsvLogfile, adjTable)
 
      # Return GEOPROCESSING specific errors
     except arcpy.ExecuteError:
@@ -249,9 +377,8 @@ def euadjacency():
         lu.exit_with_python_error(_SCRIPT_NAME)
 
 
-def adjshiftwrite(araster, csvfile, logfile):
-    """Get adjacencies using shift method and write to disk"""
-    # To be replaced by getLeastCostDistsUsingShiftMethod if implemented
-    adjTable = lu.get_adj_using_shift_method(araster)
-    lu.write_adj_file(csvfile, adjTable)
-    lu.write_adj_file(logfile, adjTable)
+def read_core_rows(grid, window, r0, r1):
+    """Returns core area array for rows r0 to r1 of a window"""
+    return lu.raster_to_array(cfg.CORERAS, grid,
+                              (window[0] + r0, window[0] + r1, window[2],
+                               window[3]), nodata=-1)
@@ -8,12 +8,15 @@ adjacencies of core areas
 """
 
 from os import path
+import multiprocessing
 import time
 
 import numpy as npy
 import arcpy
 
 from lm_config import tool_env as cfg
+import lm_cwd
+import lm_near
 import lm_util as lu
 
 
@@ -73,19 +76,15 @@ def STEP2_build_network():
 
         #----------------------------------------------------------------------
         # Get rid of duplicate pairs of cores, retaining MINIMUM distance
-        # between them
+        # between them.  Rows are sorted by pair then distance, so the first
+        # row for each pair is kept.
         numDistsOld = numDists
-        for x in range(numDists - 2, -1, -1):
-            if (eucDists[x, 0] == eucDists[x + 1, 0]
-                and (eucDists[x, 1] == eucDists[x + 1, 1])):
-                eucDists[x + 1, 0] = 0
-        delRows = npy.asarray(npy.where(eucDists[:, 0] == 0))
-        delRowsVector = npy.zeros((delRows.shape[1]), dtype="int32")
-        delRowsVector[:] = delRows[0, :]
-        eucDists = lu.delete_row(eucDists, delRowsVector)
-        del delRows
-        del delRowsVector
+        distKeys = lm_cwd.pair_keys(eucDists[:, 0], eucDists[:, 1])
+        keepRows = npy.ones(numDists, dtype=bool)
+        keepRows[1:] = distKeys[1:] != distKeys[:-1]
+        eucDists = eucDists[keepRows]
         numDists = eucDists.shape[0]
+        del distKeys, keepRows
 
         lu.dashline(1)
         gprint('Removed ' + str(numDistsOld - numDists) +
@@ -102,71 +101,44 @@ def STEP2_build_network():
         linkTable = npy.zeros((len(eucDists), 10), dtype='int32')
         linkTable[:, 1:3] = eucDists[:, 0:2]
         linkTable[:, cfg.LTB_EUCDIST] = eucDists[:, 2]
+        del eucDists
 
         #----------------------------------------------------------------------
-        # Get adjacencies using adj files from step 1.
+        # Get adjacencies using adj files from step 1.  Links are matched to
+        # adjacent core pairs by packed pair keys.
+        gprint('Creating link table')
+        linkTable[:, cfg.LTB_CWDADJ] = -1  # Euc adjacency not evaluated
+        linkTable[:, cfg.LTB_EUCADJ] = -1
         if cfg.S2ADJMETH_CW or cfg.S2ADJMETH_EU:  # Keep ALL links
-            cwdAdjList = []
-            eucAdjList = []
+            linkKeys = link_keys(linkTable)
+            linkTable[:, cfg.LTB_CWDADJ] = 0
+            linkTable[:, cfg.LTB_EUCADJ] = 0
             if cfg.S2ADJMETH_CW:
                 cwdAdjTable = get_adj_list(cfg.CWDADJFILE)
-                cwdAdjList = []
-                for i in range(0, len(cwdAdjTable)):
-                    listEntry = (str(cwdAdjTable[i, 0]) + '_' + str(cwdAdjTable[i, 1]))
-                    cwdAdjList.append(listEntry)
                 gprint('Cost-weighted adjacency file loaded.')
-                maxCwdAdjCoreID = max(cwdAdjTable[:, 1])
+                linkTable[npy.in1d(linkKeys, adj_keys(cwdAdjTable)),
+                          cfg.LTB_CWDADJ] = 1
                 del cwdAdjTable
 
             if cfg.S2ADJMETH_EU:
                 eucAdjTable = get_adj_list(cfg.EUCADJFILE)
-                eucAdjList = []
-                for i in range(0, len(eucAdjTable)):
-                    listEntry = (str(eucAdjTable[i, 0]) + '_' + str(eucAdjTable[i, 1]))
-                    eucAdjList.append(listEntry)
-                maxEucAdjCoreID = max(eucAdjTable[:, 1])
+                linkTable[npy.in1d(linkKeys, adj_keys(eucAdjTable)),
+                          cfg.LTB_EUCADJ] = 1
                 del eucAdjTable
-
-        del eucDists
-
-        gprint('Creating link table')
-        linkTable[:, cfg.LTB_CWDADJ] = -1  # Euc adjacency not evaluated
-        linkTable[:, cfg.LTB_EUCADJ] = -1
-        if cfg.S2ADJMETH_CW or cfg.S2ADJMETH_EU:
-            for x in range(0, linkTable.shape[0]):
-                listEntry = (str(linkTable[x, cfg.LTB_CORE1]) + '_' +
-                             str(linkTable[x, cfg.LTB_CORE2]))
-                if listEntry in cwdAdjList:
-                    linkTable[x, cfg.LTB_CWDADJ] = 1
-                else:
-                    linkTable[x, cfg.LTB_CWDADJ] = 0
-                if listEntry in eucAdjList:
-                    linkTable[x, cfg.LTB_EUCADJ] = 1
-                else:
-                    linkTable[x, cfg.LTB_EUCADJ] = 0
+            del linkKeys
 
         if cfg.S2ADJMETH_CW and cfg.S2ADJMETH_EU:  # "Keep all adjacent links"
             gprint("\nKeeping all adjacent links\n")
-            rows = []
-            for row in range(0, linkTable.shape[0]):
-                if (linkTable[row, cfg.LTB_EUCADJ] == 0
-                    and linkTable[row, cfg.LTB_CWDADJ] == 0):
-                    rows.append(row)
-            linkTable = lu.delete_row(linkTable, rows)
+            linkTable = linkTable[(linkTable[:, cfg.LTB_EUCADJ] == 1) |
+                                  (linkTable[:, cfg.LTB_CWDADJ] == 1)]
 
         elif cfg.S2ADJMETH_CW:
             gprint("\nKeeping cost-weighted adjacent links\n")
-            delRows = npy.asarray(npy.where(linkTable[:, cfg.LTB_CWDADJ] == 0))
-            delRowsVector = npy.zeros((delRows.shape[1]), dtype="int32")
-            delRowsVector[:] = delRows[0, :]
-            linkTable = lu.delete_row(linkTable, delRowsVector)
+            linkTable = linkTable[linkTable[:, cfg.LTB_CWDADJ] == 1]
 
         elif cfg.S2ADJMETH_EU:
             gprint("\nKeeping Euclidean adjacent links\n")
-            delRows = npy.asarray(npy.where(linkTable[:, cfg.LTB_EUCADJ] == 0))
-            delRowsVector = npy.zeros((delRows.shape[1]), dtype="int32")
-            delRowsVector[:] = delRows[0, :]
-            linkTable = lu.delete_row(linkTable, delRowsVector)
+            linkTable = linkTable[linkTable[:, cfg.LTB_EUCADJ] == 1]
 
         else:  # For Climate Corridor tool
             gprint("\nIgnoring adjacency and keeping all links\n")
@@ -174,8 +146,9 @@ def STEP2_build_network():
         linkTable[:, cfg.LTB_CLUST1] = -1  # No clusters until later steps
         linkTable[:, cfg.LTB_CLUST2] = -1
 
-        # not evaluated yet. May eventually have ability to get lcdistances
-        # for adjacent cores from s1_getAdjacencies.py
+        # not evaluated yet.  Least-cost distances found for adjacent cores
+        # by s1_getAdjacencies.py can be upper bounds, so they are kept out
+        # of the link table (see drop_short_adj_links)
         linkTable[:, cfg.LTB_CWDIST] = -1
 
         # Get list of core IDs, based on core area shapefile.
@@ -210,17 +183,26 @@ def STEP2_build_network():
         if cfg.CONNECTFRAGS:
             connect_clusters(linkTable)
         else:
-            # Drop links that are too long
+            # Drop links that are too long.  Least-cost distances from step 1
+            # can be upper bounds, so only Euclidean distances are checked.
             gprint('\nChecking for corridors that are too long to map.')
             DISABLE_LEAST_COST_NO_VAL = False
             linkTable, numDroppedLinks = lu.drop_links(linkTable, cfg.MAXEUCDIST,
-                                                       0, cfg.MINEUCDIST, 0,
+                                                       0, None, 0,
                                                        DISABLE_LEAST_COST_NO_VAL)
             if numDroppedLinks > 0:
                 lu.dashline(1)
                 gprint('Removed ' + str(numDroppedLinks) +
                                   ' links that were too long in Euclidean '
                                   'distance.')
+            if cfg.S2ADJMETH_CW and cfg.MINCOSTDIST is not None:
+                numDroppedLinks = drop_short_adj_links(linkTable,
+                                                       cfg.CWDADJFILE)
+                if numDroppedLinks > 0:
+                    lu.dashline(1)
+                    gprint('Removed ' + str(numDroppedLinks) +
+                           ' links that were too short in cost-weighted '
+                           'distance.')
 
             # Write linkTable to disk
             gprint('Writing ' + outlinkTableFile)
@@ -251,17 +233,34 @@ def STEP2_build_network():
     return
 
 
+def link_keys(linkTable):
+    """Returns int64 pair keys for the core pairs of links"""
+    return lm_cwd.pair_keys(linkTable[:, cfg.LTB_CORE1],
+                            linkTable[:, cfg.LTB_CORE2])
+
+
+def adj_keys(adjTable):
+    """Returns int64 pair keys for the core pairs in an adjacency table"""
+    return lm_cwd.pair_keys(adjTable[:, 0], adjTable[:, 1])
+
+
 # Fixme: routine below could be used for other operations in code above.
+def read_adj_file(adjFile):
+    """Returns rows of adjacency file as a 2D array"""
+    inAdjList = npy.loadtxt(adjFile, dtype='Float64', comments='#',
+                      delimiter=',')  # creates a numpy array
+    if len(inAdjList) == inAdjList.size:  # Just one connection
+        outAdjList = npy.zeros((1, len(inAdjList)), dtype='Float64')
+        outAdjList[0, :] = inAdjList
+    else:
+        outAdjList = inAdjList
+    return outAdjList
+
+
 def get_adj_list(adjFile):
     try:
-        inAdjList = npy.loadtxt(adjFile, dtype='int32', comments='#',
-                          delimiter=',')  # creates a numpy array
-        if len(inAdjList) == inAdjList.size:  # Just one connection
-            outAdjList = npy.zeros((1, 3), dtype='int32')
-            outAdjList[:, 0:3] = inAdjList[0:3]
-        else:
-            outAdjList = inAdjList
-        outAdjList = outAdjList[:, 1:3]  # Drop first column
+        outAdjList = read_adj_file(adjFile)
+        outAdjList = outAdjList[:, 1:3].astype('int32')  # Drop first column
         outAdjList = npy.sort(outAdjList)  # sorts left-right
         return outAdjList
 
@@ -277,10 +276,56 @@ def get_adj_list(adjFile):
         lu.exit_with_python_error(_SCRIPT_NAME)
 
 
+def drop_short_adj_links(linkTable, adjFile):
+    """Disables links between cost-weighted adjacent cores that are too
+    short in cost-weighted distance, using least-cost distances from the
+    adjacency file from step 1.
+
+    Step 1 finds these where allocation zones meet.  A distance is an upper
+    bound when the least-cost path between two cores crosses a third zone,
+    so it is only used to drop links shorter than cfg.MINCOSTDIST, and is
+    not written to the link table.  Step 3 calculates exact distances.
+
+    Returns number of links disabled.
+
+    """
+    adjDists = read_adj_file(adjFile)
+    if adjDists.shape[1] < 4:
+        return 0  # Adjacency file has no least-cost distances
+    adjDists = adjDists[adjDists[:, 3] >= 0]
+    adjKeys = adj_keys(adjDists[:, 1:3])
+    order = npy.argsort(adjKeys)
+    adjKeys = adjKeys[order]
+    lcDists = adjDists[order, 3]
+    linkKeys = link_keys(linkTable)
+    ind = npy.searchsorted(adjKeys, linkKeys)
+    found = ind < len(adjKeys)
+    found[found] = adjKeys[ind[found]] == linkKeys[found]
+    numDroppedLinks = 0
+    for x in npy.where(found)[0].tolist():
+        lcDist = lcDists[ind[x]]
+        # Check only enabled corridor links
+        if (lcDist < cfg.MINCOSTDIST and
+                linkTable[x, cfg.LTB_LINKTYPE] > 0 and
+                linkTable[x, cfg.LTB_LINKTYPE] != cfg.LT_KEEP):
+            gprint("Link #" + str(int(linkTable[x, cfg.LTB_LINKID])) +
+                   " connecting cores " +
+                   str(int(linkTable[x, cfg.LTB_CORE1])) + " and " +
+                   str(int(linkTable[x, cfg.LTB_CORE2])) + " is at most " +
+                   str(lcDist) + " units long- too short in cost distance "
+                   "units.")
+            # Disable link
+            linkTable[x, cfg.LTB_LINKTYPE] = cfg.LT_TSLC
+            numDroppedLinks = numDroppedLinks + 1
+    return numDroppedLinks
+
+
 def generate_distance_file():
-    """Use ArcGIS to create Conefor distance file
+    """Create Conefor distance file
 
-    Requires ArcInfo license.
+    Distances are exact minimum distances between core area polygons, as
+    from the GenerateNearTable tool.  Each core area's boundary is read
+    once and densified to the cell size to find the closest segments.
 
     """
     try:
@@ -297,55 +342,81 @@ def generate_distance_file():
             except Exception:
                 pass # In case point geometry is entered for core area FC
 
-        arcpy.env.workspace = cfg.SCRATCHDIR
-        FS2COREFC = "fscores"
-        FS2COREFC2 = "fscores2"
-        arcpy.MakeFeatureLayer_management(S2COREFC, FS2COREFC)
-        arcpy.MakeFeatureLayer_management(S2COREFC, FS2COREFC2)
-
         output = []
         csvseparator = "\t"
 
-
-        adjList = get_full_adj_list()
-        gprint('\nFinding distances between cores using Generate Near Table.')
-        near_tbl = path.join(cfg.SCRATCHDIR, "neartbl.dbf")
+        gprint('\nFinding distances between core area boundaries.')
+        cellSize = float(arcpy.env.cellSize)
+        boundaries = {}
+        for core, rings in lu.get_core_boundaries(S2COREFC,
+                                                  cfg.COREFN).items():
+            boundaries[core] = lm_near.CoreBoundary(rings, cellSize)
+
+        # Core areas are at least as far apart as their bounding boxes, so
+        # pairs with boxes farther apart than the maximum Euclidean
+        # distance can be skipped.  Not done when connecting fragments, as
+        # long links are needed to connect clusters.
+        pruneBoxes = cfg.MAXEUCDIST is not None and not cfg.CONNECTFRAGS
+        if (pruneBoxes and not cfg.S2ADJMETH_CW and
+                not cfg.S2ADJMETH_EU):
+            # Only look at pairs with close bounding boxes
+            cores = sorted(boundaries)
+            pairIds = lm_near.close_box_pairs(
+                [boundaries[core].box for core in cores], cfg.MAXEUCDIST)
+            adjList = sorted([(cores[id1], cores[id2])
+                              for id1, id2 in pairIds.tolist()])
+            numPairs = len(cores) * (len(cores) - 1) // 2
+        else:
+            adjList = get_full_adj_list()
+            # May be running on selected core areas in step 2
+            adjList = [(sourceCore, targetCore)
+                       for sourceCore, targetCore in adjList.tolist()
+                       if sourceCore in boundaries and
+                       targetCore in boundaries]
+            numPairs = len(adjList)
+            if pruneBoxes and numPairs > 0:
+                boxDists = lm_near.box_distances(
+                    [boundaries[pair[0]].box for pair in adjList],
+                    [boundaries[pair[1]].box for pair in adjList])
+                adjList = [adjList[x] for x in
+                           npy.where(boxDists <= cfg.MAXEUCDIST)[0]]
+        numPruned = numPairs - len(adjList)
+        if numPruned > 0:
+            gprint('Skipped ' + str(numPruned) + ' core pairs with bounding '
+                   'boxes farther apart than the maximum Euclidean '
+                   'corridor distance.')
         gprint('There are ' + str(len(adjList)) + ' adjacent core pairs to '
                'process.')
-        pctDone = 0
         start_time = time.clock()
-        for x in range(0, len(adjList)):
+        pool = None
+        numWorkers = min(int(cfg.S2WORKERS), multiprocessing.cpu_count(),
+                         max(len(adjList) // 64, 1))
+        if numWorkers > 1:
+            gprint('Using ' + str(numWorkers) + ' worker processes.')
+            pool = lu.start_pool(numWorkers, lm_near.init_worker,
+                                 (boundaries,))
+        pctDone = [0]
+
+        def report_progress(numDone):
+            pctDone[0] = lu.report_pct_done(numDone - 1, len(adjList),
+                                            pctDone[0])
+
+        try:
+            dists = lm_near.pair_distances(boundaries, adjList, pool,
+                                           report_progress)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
 
-            pctDone = lu.report_pct_done(x, len(adjList), pctDone)
-            sourceCore = adjList[x, 0]
-            targetCore = adjList[x, 1]
-            expression = cfg.COREFN + " = " + str(sourceCore)
-            arcpy.SelectLayerByAttribute_management(
-                FS2COREFC, "NEW_SELECTION", expression)
-            expression = cfg.COREFN + " = " + str(targetCore)
-            arcpy.SelectLayerByAttribute_management(
-                FS2COREFC2, "NEW_SELECTION", expression)
-
-            arcpy.GenerateNearTable_analysis(FS2COREFC, FS2COREFC2, near_tbl,
-                "#", "NO_LOCATION", "NO_ANGLE", "ALL", "0")
-
-            rows = arcpy.SearchCursor(near_tbl)
-            row = rows.next()
-            minDist = 1e20
-            if row:  # May be running on selected core areas in step 2
-                while row:
-                    dist = row.getValue("NEAR_DIST")
-                    if dist <= 0:  # In case simplified polygons abut one another
-                        dist = float(arcpy.env.cellSize)
-                    if dist < minDist:
-                        minDist = dist
-                        outputrow = []
-                        outputrow.append(str(sourceCore))
-                        outputrow.append(str(targetCore))
-                        outputrow.append(str(dist))
-                    del row
-                    row = rows.next()
-            del rows
+        for x in range(0, len(adjList)):
+            dist = dists[x]
+            if dist <= 0:  # In case simplified polygons abut one another
+                dist = cellSize
+            outputrow = []
+            outputrow.append(str(adjList[x][0]))
+            outputrow.append(str(adjList[x][1]))
+            outputrow.append(str(dist))
             output.append(csvseparator.join(outputrow))
 
         start_time = lu.elapsed_time(start_time)
@@ -379,13 +450,10 @@ def get_full_adj_list():
             coreList = lu.get_core_list(cfg.COREFC, cfg.COREFN)
             coreList = coreList[:,0]
             numCores = len(coreList)
-            adjList = npy.zeros((numCores*(numCores-1)/2,2), dtype="int32")
-            pairIndex = 0
-            for sourceIndex in range(0,numCores-1):
-                for targetIndex in range(sourceIndex + 1, numCores):
-                    adjList[pairIndex,0]=coreList[sourceIndex]
-                    adjList[pairIndex,1]=coreList[targetIndex]
-                    pairIndex = pairIndex + 1
+            sourceIndex, targetIndex = npy.triu_indices(numCores, 1)
+            adjList = npy.zeros((len(sourceIndex), 2), dtype="int32")
+            adjList[:, 0] = coreList[sourceIndex]
+            adjList[:, 1] = coreList[targetIndex]
             return adjList
         eucAdjList = get_adj_list(cfg.EUCADJFILE)
         if cfg.S2ADJMETH_CW:
@@ -393,28 +461,10 @@ def get_full_adj_list():
             adjList = npy.append(eucAdjList, cwdAdjList, axis=0)
         else:
             adjList = eucAdjList
-        adjList = npy.sort(adjList)
-
-                # sort by 1st core Id then by 2nd core Id
-        ind = npy.lexsort((adjList[:, 1], adjList[:, 0]))
-        adjList = adjList[ind]
-
-        numDists = len(adjList)
-        x = 1
-        while x < numDists:
-            if (adjList[x, 0] == adjList[x - 1, 0] and
-                adjList[x, 1] == adjList[x - 1, 1]):
-                adjList[x - 1, 0] = 0  # mark for deletion
-            x = x + 1
-
-        if numDists > 0:
-            delRows = npy.asarray(npy.where(adjList[:, 0] == 0))
-            delRowsVector = npy.zeros((delRows.shape[1]), dtype="int32")
-            delRowsVector[:] = delRows[0, :]
-            adjList = lu.delete_row(adjList, delRowsVector)
-            del delRows
-            del delRowsVector
 
+        # Unique pairs, sorted by 1st core Id then by 2nd core Id
+        adjKeys = npy.unique(adj_keys(adjList))
+        adjList = lm_cwd.key_pairs(adjKeys).astype('int32')
         return adjList
 
     except arcpy.ExecuteError:
@@ -435,58 +485,43 @@ def connect_clusters(linkTable):
         arcpy.CopyFeatures_management(cfg.COREFC,clusterFC)
 
         gprint('Running custom fragment connecting code.')
-        numLinks = linkTable.shape[0]
 
         fieldList = arcpy.ListFields(clusterFC)
         cluster_ID = 'clus' + str(int(cfg.MAXEUCDIST))
         for field in fieldList:
-            if str(field.name) == cluster_ID:
-                arcpy.DeleteField_management(clusterFC, cluster_ID)
+            if str(field.name) in (cluster_ID, "clust_area"):
+                arcpy.DeleteField_management(clusterFC, str(field.name))
         arcpy.AddField_management(clusterFC, cluster_ID, "LONG")
+        arcpy.AddField_management(clusterFC, "clust_area", "DOUBLE")
+
+        # Join fragments closer than cutoff, nearest first.  Clusters are
+        # trees in a union-find forest of core IDs, labelled by their
+        # lowest core ID.
+        clusters = {}
+        ind = npy.argsort(linkTable[:, cfg.LTB_EUCDIST], kind='mergesort')
+        for x in ind.tolist():
+            eucDist = linkTable[x, cfg.LTB_EUCDIST]
+            if eucDist >= cfg.MAXEUCDIST:
+                break
+            frag1ID = int(linkTable[x, cfg.LTB_CORE1])
+            frag2ID = int(linkTable[x, cfg.LTB_CORE2])
+            if lu.union_roots(clusters, frag1ID, frag2ID):
+                gprint("Joining fragments "+str(frag1ID)+" and "+str(frag2ID)+" separated by distance "+str(eucDist))
+
+        cores = npy.unique(linkTable[:, cfg.LTB_CORE1:cfg.LTB_CORE2 + 1])
+        clustIDs = npy.array([lu.find_root(clusters, core)
+                              for core in cores.tolist()], dtype='int32')
+        for coreCol, clustCol in ((cfg.LTB_CORE1, cfg.LTB_CLUST1),
+                                  (cfg.LTB_CORE2, cfg.LTB_CLUST2)):
+            linkTable[:, clustCol] = clustIDs[
+                npy.searchsorted(cores, linkTable[:, coreCol])]
 
         rows = arcpy.UpdateCursor(clusterFC)
-        row = rows.next()
-        while row:
-            # linkCoords indices
-            fragID = row.getValue(cfg.COREFN)
-            row.setValue(cluster_ID, fragID)
-            rows.UpdateRow(row)
-            row = rows.next()
-        del row, rows
-
-
-        linkTable[:, cfg.LTB_CLUST1] = linkTable[:, cfg.LTB_CORE1]
-        linkTable[:, cfg.LTB_CLUST2] = linkTable[:, cfg.LTB_CORE2]
-
-        #if frags less than cutoff set cluster_ID equal.
-        for x in range(0,numLinks):
-                gprint("link #"+str(x+1))
-                # Set newfragmentID of 2nd fragment to that of frag 1
-                frag1ID = linkTable[x, cfg.LTB_CLUST1]
-                frag2ID = linkTable[x, cfg.LTB_CLUST2]
-                if frag1ID == frag2ID:
-                    continue
-                eucDist = linkTable[x, cfg.LTB_EUCDIST]
-
-
-                if eucDist < cfg.MAXEUCDIST:
-                    gprint("Joining fragments "+str(frag1ID)+" and "+str(frag2ID)+" separated by distance "+str(eucDist))
-                    # update linktable to new fragment ID in cluster field
-                    rows = npy.where(linkTable[:,cfg.LTB_CLUST1] == frag2ID)
-                    linkTable[rows, cfg.LTB_CLUST1] = frag1ID
-                    rows = npy.where(linkTable[:,cfg.LTB_CLUST2] == frag2ID)
-                    linkTable[rows, cfg.LTB_CLUST2] = frag1ID
-                    del rows
-
-                    # update shapefile to new fragment ID in cluster_ID field
-                    rows = arcpy.UpdateCursor(clusterFC)
-                    row = rows.next()
-                    while row:
-                        if row.getValue(cluster_ID) == frag2ID:
-                            row.setValue(cluster_ID, frag1ID)
-                        rows.UpdateRow(row)
-                        row = rows.next()
-                    del row, rows
+        for row in rows:
+            clustID = lu.find_root(clusters, int(row.getValue(cfg.COREFN)))
+            row.setValue(cluster_ID, clustID)
+            rows.updateRow(row)
+        del rows
 
         gprint('Done Joining.  Creating output shapefiles.')
 
@@ -495,37 +530,25 @@ def connect_clusters(linkTable):
         outputFN = coreBaseName + "_Cluster"+str(int(cfg.MAXEUCDIST))+"_dissolve.shp"
         outputShapefile = path.join(cfg.SCRATCHDIR,outputFN)
         arcpy.Dissolve_management(clusterFC, outputShapefile, cluster_ID)
-        outputFN = coreBaseName + "_Cluster"+str(int(cfg.MAXEUCDIST))+"_dissolve_area.shp"
-        coreFCWithArea = path.join(cfg.SCRATCHDIR,outputFN)
-        arcpy.CalculateAreas_stats(outputShapefile, coreFCWithArea)
+
+        # Get cluster areas from the dissolved clusters, so overlapping or
+        # touching cores are only counted once, then write them in one pass
+        shapeField = arcpy.Describe(outputShapefile).shapeFieldName
+        clustAreas = {}
+        rows = arcpy.SearchCursor(outputShapefile)
+        for row in rows:
+            clustAreas[row.getValue(cluster_ID)] = (
+                row.getValue(shapeField).area)
+        del rows
+        rows = arcpy.UpdateCursor(clusterFC)
+        for row in rows:
+            row.setValue("clust_area", clustAreas[row.getValue(cluster_ID)])
+            rows.updateRow(row)
+        del rows
 
         outputFN = coreBaseName + "_Cluster"+str(int(cfg.MAXEUCDIST))+".shp"
         clusterFCFinal = path.join(cfg.PROJECTDIR,outputFN)
         arcpy.CopyFeatures_management(clusterFC,clusterFCFinal)
-
-        # Update final core featureclass with cluster ID and area
-        arcpy.AddField_management(clusterFCFinal, cluster_ID, "LONG")
-        arcpy.AddField_management(clusterFCFinal, "clust_area", "DOUBLE")
-
-        #run through rows- get cluster id, then get area from coreFCwitharea using searchcursor
-
-        rows = arcpy.UpdateCursor(clusterFCFinal)
-        row = rows.next()
-        while row:
-            # linkCoords indices
-            clustID = row.getValue(cluster_ID)
-            rows2 = arcpy.SearchCursor(coreFCWithArea)
-            row2 = rows2.next()
-            while row2:
-                if row2.getValue(cluster_ID) == clustID:
-                    fArea = "F_AREA"
-                    clustArea = row2.getValue(fArea)
-                    break
-                row2 = rows2.next()
-            row.setValue("clust_area", clustArea)
-            rows.UpdateRow(row)
-            row = rows.next()
-        del row, rows, row2, rows2
         gprint('Cores with cluster ID and cluster area written to: '
                 + clusterFCFinal)
 
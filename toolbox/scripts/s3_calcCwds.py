@@ -11,12 +11,16 @@ extent of cwd calculations and speed computation.
 
 from os import path
 import time
+import multiprocessing
 
 import numpy as npy
 import arcpy
 
 from lm_config import tool_env as cfg
 import lm_util as lu
+import lm_cwd
+import lm_core_index
+import lm_journal
 
 _SCRIPT_NAME = "s3_calcCwds.py"
 
@@ -25,30 +29,6 @@ tif = ''
 gprint = lu.gprint
 
 
-def write_cores_to_map(x, coresToMap):
-    """ Save core list at start of loop to allow a run to be re-started
-        if it fails.
-
-    """
-    try:
-        coreListFile = path.join(cfg.DATAPASSDIR, "temp_cores_to_map.csv")
-        outFile = open(coreListFile, "w")
-        outFile.write("#INDEX of last core being processed:\n")
-        outFile.write(str(int(x)))
-        outFile.write("\n")
-        outFile.write("#Full list of IDs of cores to be processed:\n")
-        for coreToMap in range(len(coresToMap)):
-            outFile.write(str(int(coresToMap[coreToMap])))
-            outFile.write("\n")
-        outFile.close()
-
-    # Return any PYTHON or system specific errors
-    except Exception:
-        lu.dashline(1)
-        lu.exit_with_python_error(_SCRIPT_NAME)
-
-
-
 def STEP3_calc_cwds():
     """Calculates cost-weighted distances from each core area.
     Uses bounding circles around source and target cores to limit
@@ -60,14 +40,6 @@ def STEP3_calc_cwds():
         gprint('Running script ' + _SCRIPT_NAME)
         lu.dashline(0)
 
-        # Super secret setting to re-start failed run.  Enter 'RESTART' as the
-        # Name of the pairwise distance table in step 2, and uncheck step 2.
-        # We can eventually place this in a .ini file.
-        rerun = False
-        if cfg.S2EUCDISTFILE != None:
-            if cfg.S2EUCDISTFILE.lower() == "restart":
-                rerun = True
-
         if (cfg.BUFFERDIST) is not None:
             gprint('Bounding circles plus a buffer of ' +
                               str(float(cfg.BUFFERDIST)) + ' map units will '
@@ -102,39 +74,41 @@ def STEP3_calc_cwds():
         gprint('\nNumber of core areas to connect: ' +
                           str(numCoresToMap))
 
-        if rerun:
-            # If picking up a failed run, make sure needed files are there
-            lu.dashline(1)
-            gprint ('\n****** RESTART MODE ENABLED ******\n')
-            gprint ('**** NOTE: This mode picks up step 3 where a\n'
-                    'previous run left off due to a crash or user\n'
-                    'abort.  It assumes you are using the same input\n'
-                    'data used in the terminated run.\n\n')
-            lu.warn('IMPORTANT: Your LCP and stick feature classes\n'
-                    'will LOSE LCPs that were already created, but\n'
-                    'your final raster corridor map should be complete.\n')
-
-            lu.dashline(0)
-            lu.snooze(10)
-            savedLinkTableFile = path.join(cfg.DATAPASSDIR,
-                                           "temp_linkTable_s3_partial.csv")
-            coreListFile = path.join(cfg.DATAPASSDIR, "temp_cores_to_map.csv")
-
-            if not path.exists(savedLinkTableFile) or not path.exists(
-                                                          coreListFile):
-
-                gprint('No partial results file found from previous '
-                       'stopped run. Starting run from beginning.\n')
-                lu.dashline(0)
-                rerun = False
-
-        # If picking up a failed run, use old folders
-        if not rerun:
-            startIndex = 0
-            if cfg.TOOL != cfg.TOOL_CC:
-                # Set up cwd directories
-                lu.make_raster_paths(int(max(coresToMap)), cfg.CWDBASEDIR,
-                                     cfg.CWDSUBDIR_NM)
+        # Core area cell index created with core area raster.  Rebuilt if
+        # missing (e.g. for projects started with an earlier version) or
+        # not aligned with the resistance raster.
+        coreIndex = lu.get_core_index(cfg.RESRAST)
+        if coreIndex is None:
+            gprint('Indexing core area cells.')
+            lu.write_core_index(cfg.CORERAS)
+            coreIndex = lu.get_core_index(cfg.RESRAST)
+
+        # Results for each core area are saved to a journal as they are
+        # calculated.  A journal left by an interrupted run with the same
+        # inputs lets the run pick up where it left off.
+        journal = lm_journal.Journal(path.join(cfg.DATAPASSDIR,
+                                               "s3_journal.txt"))
+        journalHeader = get_journal_header(linkTable, coresToMap, coreIndex)
+        coreRecords = []
+        if cfg.S3RESUME:
+            coreRecords = journal.read(journalHeader)
+            if coreRecords:
+                lu.dashline(1)
+                gprint('\n****** RESUMING INTERRUPTED RUN ******\n')
+                gprint('Found results for ' + str(len(coreRecords)) +
+                       ' core areas in step 3 journal ' +
+                       journal.journal_file + '.\nChecking stored '
+                       'cost-weighted distances.')
+                coreRecords = check_journal_cwds(coreRecords)
+            coreRecords = coreRecords or []
+        journal.open(journalHeader, coreRecords)
+
+        # If picking up an interrupted run, use old folders
+        startIndex = len(coreRecords)
+        if startIndex == 0 and cfg.TOOL != cfg.TOOL_CC:
+            # Set up cwd directories
+            lu.make_raster_paths(int(max(coresToMap)), cfg.CWDBASEDIR,
+                                 cfg.CWDSUBDIR_NM)
 
         # make a feature layer for input cores to select from
         arcpy.MakeFeatureLayer_management(cfg.COREFC, cfg.FCORES)
@@ -229,7 +203,6 @@ def STEP3_calc_cwds():
             extentBoxList = npy.append(extentBoxList,boxCoords,axis=0)
             extentBoxList[0,0] = 0
 
-            boundingCirclePointArray  = npy.zeros((0,5),dtype='float32')
             circlePointData=lu.get_bounding_circle_data(extentBoxList, 0,
                                                         0, cfg.BUFFERDIST)
 
@@ -258,6 +231,43 @@ def STEP3_calc_cwds():
         else: #if not using bounding circles, just go with resistance raster.
             cfg.BOUNDRESIS = cfg.RESRAST
 
+        # Read raster into memory if calculating cwds with NumPy engine
+        npyRasters = None
+        if cfg.S3CWDENGINE.upper() == "NUMPY" and cfg.TOOL != cfg.TOOL_CC:
+            start_time = time.clock()
+            gprint('Reading resistance raster into memory for NumPy cost '
+                   'distance engine.')
+            if cfg.BUFFERDIST is not None:
+                npyRasters = load_npy_rasters(boundingCirclePointArray,
+                                              circlePointData, coreIndex)
+            else:
+                npyRasters = load_npy_rasters(None, None, coreIndex)
+            start_time = lu.elapsed_time(start_time)
+            if cfg.S3CWDMARGIN is not None:
+                gprint('Cost distances will only be calculated out to ' +
+                       str(cfg.S3CWDMARGIN) + ' cost units beyond the '
+                       'farthest target core area.')
+        elif cfg.S3CWDENGINE.upper() not in ("ARCGIS", "NUMPY"):
+            lu.raise_error('S3CWDENGINE setting must be "ARCGIS" or '
+                           '"NUMPY".')
+
+        # Without bounding circles, limit cwd calcs from each core area to
+        # the cells that can be within the maximum cost-weighted distance
+        searchReach = None
+        if cfg.BUFFERDIST is None and cfg.TOOL != cfg.TOOL_CC:
+            if npyRasters is not None:
+                searchReach = lm_cwd.max_reach(
+                    cfg.TMAXCWDIST,
+                    float(npy.nanmin(npyRasters['resistance'])),
+                    npyRasters['grid'].cell_size)
+                npyRasters['reach'] = searchReach
+            else:
+                searchReach = lu.get_search_reach(cfg.BOUNDRESIS,
+                                                  cfg.TMAXCWDIST)
+            if searchReach is not None:
+                gprint('Cost distance calculations will be limited to ' +
+                       str(searchReach) + ' cells around each core area.')
+
         # ---------------------------------------------------------------------
         # Rasterize core areas to speed cost distance calcs
         gprint("Creating core area raster.")
@@ -266,15 +276,17 @@ def STEP3_calc_cwds():
 
         arcpy.env.cellSize = cfg.BOUNDRESIS
         arcpy.env.extent = cfg.BOUNDRESIS
-        if rerun:
-            # saved linktable replaces the one now in memory
-            linkTable = lu.load_link_table(savedLinkTableFile)
-            coresToMapSaved = npy.loadtxt(coreListFile, dtype='Float64',
-                                          comments='#', delimiter=',')
-            startIndex = coresToMapSaved[0] # Index of core where we left off
-            del coresToMapSaved
-            gprint ('\n****** Re-starting run at core area number '
-                    + str(int(coresToMap[startIndex]))+ ' ******\n')
+        lcpRecords = []
+        if startIndex > 0:
+            # Replay journaled results for core areas already done
+            for coreRecord in coreRecords:
+                linkRows = coreRecord['links']['rows']
+                if len(linkRows) > 0:
+                    linkTable[linkRows] = coreRecord['links']['values']
+                lcpRecords.extend(coreRecord['lcps'])
+            if startIndex < len(coresToMap):
+                gprint ('\n****** Re-starting run at core area number '
+                        + str(int(coresToMap[startIndex]))+ ' ******\n')
             lu.dashline(0)
 
         arcpy.env.extent = "MINOF"
@@ -285,36 +297,65 @@ def STEP3_calc_cwds():
             gprint("\nMapping least-cost paths.\n")
         else:
             gprint("\nStarting cost distance calculations.\n")
-        lcpLoop = 0
+        lcpLoop = len(lcpRecords)
         failures = 0
         x = startIndex
         endIndex = len(coresToMap)
         linkTableMod = linkTable.copy()
-        while x < endIndex:
-            startTime1 = time.clock()
-            # Modification of linkTable in function was causing problems. so
-            # make a copy:
-            linkTablePassed = linkTableMod.copy()
-
-            (linkTableReturned, failures, lcpLoop) = do_cwd_calcs(x,
-                        linkTablePassed, coresToMap, lcpLoop, failures)
-            if failures == 0:
-                # If iteration was successful, continue with next core
-                linkTableMod = linkTableReturned
-                sourceCore = int(coresToMap[x])
-                gprint('Done with all calculations for core ID #' +
-                        str(sourceCore) + '. ' + str(int(x + 1)) + ' of ' +
-                        str(endIndex) + ' cores have been processed.')
-                start_time = lu.elapsed_time(startTime1)
-
-                outlinkTableFile = path.join(cfg.DATAPASSDIR,
-                                             "temp_linkTable_s3_partial.csv")
-                lu.write_link_table(linkTableMod, outlinkTableFile)
-                # Increment  loop counter
-                x = x + 1
-            else:
-                # If iteration failed, try again after a wait period
-                delay_restart(failures)
+        cwdPool = None
+        if npyRasters is not None:
+            numWorkers = get_num_workers(npyRasters)
+            if numWorkers > 1:
+                gprint('Calculating cost distances using ' +
+                       str(numWorkers) + ' worker processes.\n')
+                cwdPool = CwdWorkerPool(numWorkers, npyRasters)
+        try:
+            while x < endIndex:
+                startTime1 = time.clock()
+                if cwdPool is not None:
+                    # Keep workers busy with core areas coming up next
+                    cwdPool.submit(coresToMap, x, linkTableMod)
+                # Modification of linkTable in function was causing
+                # problems. so make a copy:
+                linkTablePassed = linkTableMod.copy()
+
+                coreRecord = {}
+                (linkTableReturned, failures, lcpLoop) = do_cwd_calcs(x,
+                            linkTablePassed, coresToMap, lcpLoop, failures,
+                            coreIndex, coreRecord, npyRasters, cwdPool,
+                            searchReach)
+                if failures == 0:
+                    # If iteration was successful, journal results and continue
+                    # with next core
+                    sourceCore = int(coresToMap[x])
+                    linkRows = npy.where((linkTableReturned !=
+                                          linkTableMod).any(axis=1))[0]
+                    coreRecord['core'] = sourceCore
+                    coreRecord['links'] = {
+                        'rows': linkRows.tolist(),
+                        'values': linkTableReturned[linkRows].tolist()}
+                    journal.append(coreRecord)
+                    lcpRecords.extend(coreRecord['lcps'])
+                    linkTableMod = linkTableReturned
+                    gprint('Done with all calculations for core ID #' +
+                            str(sourceCore) + '. ' + str(int(x + 1)) + ' of ' +
+                            str(endIndex) + ' cores have been processed.')
+                    start_time = lu.elapsed_time(startTime1)
+
+                    # Increment  loop counter
+                    x = x + 1
+                else:
+                    # If iteration failed, try again after a wait period
+                    delay_restart(failures)
+        finally:
+            if cwdPool is not None:
+                cwdPool.close()
+
+        # Write all least-cost path lines at once
+        start_time = time.clock()
+        gprint('Writing ' + str(len(lcpRecords)) + ' least-cost path lines.')
+        lu.write_lcp_shapefile(lcpRecords, coreIndex.grid.spatial_ref)
+        start_time = lu.elapsed_time(start_time)
         #----------------------------------------------------------------------
 
         linkTable = linkTableMod
@@ -346,16 +387,13 @@ def STEP3_calc_cwds():
             lu.write_link_maps(outlinkTableFile, step=3)
         start_time = lu.elapsed_time(start_time)
 
-        gprint('\nIndividual cost-weighted distance layers written '
-                          'to "cwd" directory. \n')
+        gprint('\nCost-weighted distances from each core area saved '
+                          'to ' + cfg.CWDSTOREDIR + '\n')
         gprint(outlinkTableFile +
                 '\n updated with cost-weighted distances between core areas.')
 
-        #Clean up temporary files for restart code
-        tempFile = path.join(cfg.DATAPASSDIR, "temp_cores_to_map.csv")
-        lu.delete_file(tempFile)
-        tempFile = path.join(cfg.DATAPASSDIR, "temp_linkTable_s3_partial.csv")
-        lu.delete_file(tempFile)
+        # Journal is only needed to resume an interrupted run
+        journal.delete()
 
         # Check if climate tool is calling linkage mapper
         if cfg.TOOL == cfg.TOOL_CC:
@@ -382,7 +420,14 @@ def STEP3_calc_cwds():
 
 
 
-def do_cwd_calcs(x, linkTable, coresToMap, lcpLoop, failures):
+def do_cwd_calcs(x, linkTable, coresToMap, lcpLoop, failures, coreIndex,
+                 coreRecord, npyRasters=None, cwdPool=None, searchReach=None):
+    """Calculate cwds from a core area and map least-cost paths from it.
+
+    On success, least-cost path line records and a checksum of the cwd
+    array are stored in coreRecord for the step 3 journal.
+
+    """
     try:
         # This is the focal core area we're running cwd out from
         sourceCore = int(coresToMap[x])
@@ -396,23 +441,13 @@ def do_cwd_calcs(x, linkTable, coresToMap, lcpLoop, failures):
         arcpy.env.scratchWorkspace = cfg.ARCSCRATCHDIR
         arcpy.env.extent = "MINOF"
 
-        write_cores_to_map(x, coresToMap)
-
-        # Get target cores based on linktable with reinstated links
-        # (we temporarily disable them below by adding 1000)
-        linkTableTemp = linkTable.copy()
-        # reinstate temporarily disabled links
-        rows = npy.where(linkTableTemp[:,cfg.LTB_LINKTYPE] > 1000)
-        linkTableTemp[rows,cfg.LTB_LINKTYPE] = (
-            linkTableTemp[rows,cfg.LTB_LINKTYPE] - 1000)
-        del rows
-
         # get core areas to be connected to focal core
-        targetCores = lu.get_core_targets(sourceCore, linkTableTemp)
-        del linkTableTemp
+        targetCores = get_cwd_targets(sourceCore, linkTable)
 
         if len(targetCores)==0:
             # Nothing to do, so reset failure count and return.
+            coreRecord['lcps'] = []
+            coreRecord['cwd'] = None
             failures = 0
             return linkTable, failures, lcpLoop
 
@@ -424,7 +459,8 @@ def do_cwd_calcs(x, linkTable, coresToMap, lcpLoop, failures):
         # Create BOUNDING FEATURE to limit extent of cost distance
         # calculations-This is a set of circles encompassing core areas
         # we'll be connecting each core area to.
-        if cfg.BUFFERDIST is not None:
+        # The NumPy engine applies bounding circles as an array mask instead.
+        if cfg.BUFFERDIST is not None and npyRasters is None:
             # fixme: move outside of loop   # new circle
             arcpy.MakeFeatureLayer_management(
                 cfg.BNDCIRS, "fGlobalBoundingFeat")
@@ -481,12 +517,35 @@ def do_cwd_calcs(x, linkTable, coresToMap, lcpLoop, failures):
         # Check if climate tool is calling linkage mapper
         if cfg.TOOL == cfg.TOOL_CC:
             back_rast = outDistanceRaster.replace("cwd_", "back_")
+        elif npyRasters is not None:
+            # Calculate cwds in memory. Back directions are kept in memory
+            # for tracing least-cost paths.  Cwds are only saved to the cwd
+            # store below, not as a raster.
+            lu.delete_data(outDistanceRaster)
+            start_time = time.clock()
+            npyCwds = None
+            if cwdPool is not None:
+                npyCwds = cwdPool.get_cwds(sourceCore, targetCores)
+            if npyCwds is None:
+                npyCwds = calc_npy_cwd(sourceCore, targetCores, npyRasters,
+                                       cfg.TMAXCWDIST, cfg.S3CWDMARGIN)
+            window, cwdArray, backArray = npyCwds
         else:
             back_rast = "BACK"
             lu.delete_data(path.join(coreDir, back_rast))
             lu.delete_data(outDistanceRaster)
             start_time = time.clock()
 
+            # Limit calcs to cells that can be within max cwd of source core
+            searchExtent = "MINOF"
+            if searchReach is not None:
+                searchWindow = coreIndex.search_window(sourceCore,
+                                                       searchReach)
+                if searchWindow is not None:
+                    searchExtent = lu.get_window_extent(coreIndex.grid,
+                                                        searchWindow)
+            arcpy.env.extent = searchExtent
+
             # Create raster that just has source core in it
             # Note: this seems faster than setnull with LI grid.
             SRCRASTER = 'source' + tif
@@ -503,7 +562,7 @@ def do_cwd_calcs(x, linkTable, coresToMap, lcpLoop, failures):
                 else: exec statement
 
             # Cost distance raster creation
-            arcpy.env.extent = "MINOF"
+            arcpy.env.extent = searchExtent
 
             lu.delete_data(path.join(coreDir,"BACK"))
 
@@ -518,58 +577,49 @@ def do_cwd_calcs(x, linkTable, coresToMap, lcpLoop, failures):
                     return None, failures, lcpLoop
                 else:
                     exec statement
+            arcpy.env.extent = "MINOF"
 
         start_time = time.clock()
         # Extract cost distances from source core to target cores
         # Fixme: there will be redundant calls to b-a when already
         # done a-b
-        ZNSTATS = path.join(coreDir, "zonestats.dbf")
-        lu.delete_data(ZNSTATS)
-        #Fixme: zonalstatistics is returning integer values for minimum. Why???
-        #Extra zonalstatistics code implemented later in script to correct
-        #values.
-        statement = ('outZSaT = arcpy.sa.ZonalStatisticsAsTable(cfg.CORERAS, '
-                    '"VALUE", outDistanceRaster,ZNSTATS, "DATA", "MINIMUM")')
-        try:
-            exec statement
-        except Exception:
-            failures = lu.print_arcgis_failures(statement, failures)
-            if failures < 20:
-                return None,failures,lcpLoop
-            else:
-                if cfg.TOOL == cfg.TOOL_CC:
-                    msg = ('ERROR in Zonal Stats. Please restart ArcMap '
-                        'and try again.')
+        if npyRasters is None:
+            statement = ('window, cwdArray, backArray = '
+                         'read_cwd_arrays(outDistanceRaster, '
+                         'path.join(coreDir, back_rast), coreIndex)')
+            try:
+                exec statement
+            except Exception:
+                failures = lu.print_arcgis_failures(statement, failures)
+                if failures < 20:
+                    return None,failures,lcpLoop
                 else:
-                    msg = ('ERROR in Zonal Stats. Restarting ArcMap '
-                        'then restarting Linkage Mapper at step 3 usually\n'
-                        'solves this one so please restart and try again.')
-
-                lu.raise_error(msg)
-        tableRows = arcpy.SearchCursor(ZNSTATS)
-        tableRow = tableRows.next()
-        while tableRow:
-            if tableRow.Value > sourceCore:
-                link = lu.get_links_from_core_pairs(linkTable,
-                                                    sourceCore,
-                                                    tableRow.Value)
-                if linkTable[link,cfg.LTB_LINKTYPE] > 0: # valid link
-                    linkTable[link,cfg.LTB_CWDIST] = tableRow.Min
-                    if cfg.MAXCOSTDIST is not None:
-                        if ((tableRow.Min > cfg.MAXCOSTDIST) and
-                           (linkTable[link,cfg.LTB_LINKTYPE] != cfg.LT_KEEP)):
-                             # Disable link, it's too long
-                            linkTable[link,cfg.LTB_LINKTYPE] = cfg.LT_TLLC
-                    if cfg.MINCOSTDIST is not None:
-                        if (tableRow.Min < cfg.MINCOSTDIST and
-                           (linkTable[link,cfg.LTB_LINKTYPE] != cfg.LT_KEEP)):
-                            # Disable link, it's too short
-                            linkTable[link,cfg.LTB_LINKTYPE] = cfg.LT_TSLC
-            tableRow = tableRows.next()
-        del tableRow, tableRows
+                    if cfg.TOOL == cfg.TOOL_CC:
+                        msg = ('ERROR extracting cost distances. Please '
+                            'restart ArcMap and try again.')
+                    else:
+                        msg = ('ERROR extracting cost distances. Restarting '
+                            'ArcMap then restarting Linkage Mapper at step 3 '
+                            'usually\nsolves this one so please restart and '
+                            'try again.')
+
+                    lu.raise_error(msg)
+        zoneMins = get_zone_mins(coreIndex, cwdArray, window)
+        for zone in sorted(zoneMins):
+            if zone > sourceCore:
+                set_link_cwdist(linkTable, sourceCore, zone, zoneMins[zone])
+
+        # Keep compressed copy of cwds for corridor mapping in later steps.
+        # Later steps write cwd rasters from the store if they need them,
+        # so the raster is only kept for the climate corridor tool.
+        cwdStore = lu.get_cwd_store()
+        cwdStore.save(sourceCore, cwdArray, window, cfg.TMAXCWDIST)
+        if cfg.TOOL != cfg.TOOL_CC:
+            lu.delete_data(outDistanceRaster)
 
         # ---------------------------------------------------------
         # Check for intermediate cores AND map LCP lines
+        coreLcps = []
         for y in range(0,len(targetCores)):
             targetCore = targetCores[y]
             rows = lu.get_links_from_core_pairs(linkTable, sourceCore,
@@ -585,122 +635,25 @@ def do_cwd_calcs(x, linkTable, coresToMap, lcpLoop, failures):
                                                [rows,cfg.LTB_LINKTYPE]
                                                + 1000)
 
-                # Create raster that just has target core in it
-                TARGETRASTER = 'targ' + tif
-                lu.delete_data(path.join(coreDir,TARGETRASTER))
-                try:
-                    # For climate corridors, errors occur when core raster
-                    # overlaps null values in cwd rasters
-                    statement = (
-                        'conRaster = '
-                        'arcpy.sa.Con(arcpy.sa.IsNull(outDistanceRaster), '
-                        'arcpy.sa.Int(outDistanceRaster), '
-                        'arcpy.sa.Con(arcpy.sa.Raster(cfg.CORERAS) '
-                        '== int(targetCore), 1)); '
-                        'conRaster.save(TARGETRASTER)')
-                    exec statement
-                except Exception:
-                    failures = lu.print_arcgis_failures(statement, failures)
-                    if failures < 20:
-                        return None,failures,lcpLoop
-                    else: exec statement
-                # Execute ZonalStatistics to get more precise cw distance if
-                # arc rounded it earlier (not critical, hence the try/pass)
-                if (linkTable[link,cfg.LTB_CWDIST] ==
-                                int(linkTable[link,cfg.LTB_CWDIST])):
-                    try:
-                        zonalRas = path.join(coreDir,'zonal')
-                        arcpy.sa.ZonalStatistics(TARGETRASTER, "VALUE",
-                            outDistanceRaster, zonalRas, "MINIMUM", "DATA")
-                        minObject = arcpy.GetRasterProperties_management(zonalRas,
-                                                                "MINIMUM")
-                        rasterMin = float(str(minObject.getOutput(0)))
-                        linkTable[link,cfg.LTB_CWDIST] = rasterMin
-                        lu.delete_data(zonalRas)
-                    except Exception:
-                        pass
-                # Cost path maps the least cost path
-                # between source and target
-                lcpRas = path.join(coreDir,"lcp" + tif)
-                lu.delete_data(lcpRas)
-
-                # Note: costpath uses GDAL.
-                statement = (
-                    'outCostPath = arcpy.sa.CostPath(TARGETRASTER,'
-                    'outDistanceRaster, back_rast, "BEST_SINGLE", ""); '
-                    'outCostPath.save(lcpRas)')
-                try:
-                    exec statement
-                except Exception:
-                    failures = lu.print_arcgis_failures(statement, failures)
-                    if failures < 20:
-                        return None,failures,lcpLoop
-                    else:
-                        lu.dashline(1)
-                        gprint('\nCost path is failing for Link #'
-                           + str(int(link)) + ' connecting core areas ' +
-                            str(int(sourceCore)) + ' and ' +
-                            str(int(targetCore)) + '\n.'
-                            'Retrying one more time in 5 minutes.')
-                        lu.snooze(300)
-                        exec statement
-
-                # fixme: may be fastest to not do selection, do
-                # EXTRACTBYMASK,.getValuelist, use code snippet at end
-                # of file to discard src and target values. Still this
-                # is fast- 13 sec for LI data...But I'm not very
-                # comfortable using failed coreMin as our test....
+                # Trace least cost path back to source core from target
+                # core cell with the lowest cwd
+                lcpCells, lcpVertices, lcpLength = trace_core_lcp(
+                    targetCore, coreIndex, cwdArray, backArray, window)
+
                 if (cfg.S3DROPLCCSic and
                     (linkTable[link,cfg.LTB_LINKTYPE] != cfg.LT_KEEP) and
                     (linkTable[link,cfg.LTB_LINKTYPE] != cfg.LT_KEEP + 1000)):
                     # -------------------------------------------------
                     # Drop links where lcp passes through intermediate
-                    # core area. Method below is faster than valuelist
-                    # method because of soma in valuelist method.
-                    # make a feature layer for input cores to select from
-                    arcpy.MakeFeatureLayer_management(cfg.COREFC, cfg.FCORES)
-
-                    arcpy.SelectLayerByAttribute_management(cfg.FCORES,
-                                              "NEW_SELECTION",
-                                              cfg.COREFN + ' <> ' +
-                                              str(int(targetCore)) +
-                                              ' AND ' + cfg.COREFN +
-                                              ' <> ' +
-                                              str(int(sourceCore)))
-
-                    corePairRas = path.join(coreDir,"s3corepair"+ tif)
-                    arcpy.env.extent = cfg.BOUNDRESIS
-
-                    statement = ('arcpy.FeatureToRaster_conversion(cfg.FCORES, '
-                                'cfg.COREFN, corePairRas, arcpy.env.cellSize)')
-                    try:
-                        exec statement
-                    except Exception:
-                        failures = lu.print_arcgis_failures(statement,
-                                                            failures)
-                        if failures < 20:
-                            return None,failures,lcpLoop
-                        else: exec statement
-
-                    #------------------------------------------
-                    # Intermediate core test
-                    try:
-                        coreDetected = test_for_intermediate_core(coreDir,
-                                                lcpRas, corePairRas)
-                    except Exception:
-                        statement = 'test_for_intermediate_core'
-                        failures = lu.print_arcgis_failures(statement,
-                                                            failures)
-                        if failures < 20:
-                            return None,failures,lcpLoop
-                        else:
-                            coreDetected = test_for_intermediate_core(
-                                        coreDir, lcpRas, corePairRas)
-
-                    if coreDetected:
+                    # core area, found by looking up core areas at lcp cells
+                    intCores = get_intermediate_cores(sourceCore, targetCore,
+                                                      coreIndex, lcpCells,
+                                                      window)
+                    if len(intCores) > 0:
                         gprint(
-                            "Found an intermediate core in the "
-                            "least-cost path between cores " +
+                            "Found intermediate core(s) " +
+                            ", ".join([str(int(core)) for core in intCores]) +
+                            " in the least-cost path between cores " +
                             str(int(sourceCore)) + " and " +
                             str(int(targetCore)) + ".  The corridor "
                             "will be removed.")
@@ -711,13 +664,16 @@ def do_cwd_calcs(x, linkTable, coresToMap, lcpLoop, failures):
                         linkTable[rows,cfg.LTB_LINKTYPE] = cfg.LT_INT
                     #------------------------------------------
 
-                # Create lcp shapefile.  lcploop just keeps track of
-                # whether this is first time function is called.
-                lcpLoop = lu.create_lcp_shapefile(coreDir, linkTable,
-                                                  sourceCore, targetCore,
-                                                  lcpLoop)
+                # Keep lcp line for lcp shapefile, written at end of step.
+                # lcploop counts lines mapped.
+                coreLcps.append(lu.get_lcp_record(linkTable, sourceCore,
+                                                  targetCore, lcpVertices,
+                                                  lcpLength))
+                lcpLoop = lcpLoop + 1
 
         # Made it through, so reset failure count and return.
+        coreRecord['lcps'] = coreLcps
+        coreRecord['cwd'] = lm_journal.checksum(cwdStore.read(sourceCore))
         failures = 0
         lu.delete_dir(coreDir)
         return linkTable, failures, lcpLoop
@@ -733,43 +689,322 @@ def do_cwd_calcs(x, linkTable, coresToMap, lcpLoop, failures):
         lu.exit_with_python_error(_SCRIPT_NAME)
 
 
-def test_for_intermediate_core(workspace,lcpRas,corePairRas):
-    """ Test if there is an intermediate core by seeing if least-cost
-        path and remaining cores intersect
+def get_journal_header(linkTable, coresToMap, coreIndex):
+    """Return step 3 journal header describing inputs and settings.
+
+    A journal is only used to resume a run with the same header.
 
     """
-    try:
-        arcpy.env.workspace = workspace
-        if arcpy.Exists("addRas"): #Can't use tif for getrasterproperties
-            arcpy.Delete_management("addRas")
-        count = 0
-        statement = ('outRas = arcpy.sa.Raster(lcpRas) '
-                     '+ arcpy.sa.Raster(corePairRas); '
-                     'outRas.save("addRas")')
-        while True:
-            try:
-                exec statement
-            except Exception:
-                count,tryAgain = lu.retry_arc_error(count,statement)
-                if not tryAgain: exec statement
-            else: break
-
-        # Test to see if raster has data
-        if (arcpy.GetRasterProperties_management("addRas", "ALLNODATA")
-                .getOutput(0) == "0"):
-            return True  # Data present and therefore overlap
+    settings = {}
+    for setting in ('TOOL', 'RESRAST_IN', 'COREFC', 'COREFN', 'BUFFERDIST',
+                    'TMAXCWDIST', 'MAXCOSTDIST', 'MINCOSTDIST', 'MAXEUCDIST',
+                    'MINEUCDIST', 'S3DROPLCCSic', 'S3CWDENGINE',
+                    'S3CWDMARGIN'):
+        settings[setting] = getattr(cfg, setting, None)
+    return {'journal': 'step 3',
+            'settings': settings,
+            'linkTable': lm_journal.checksum(linkTable, 'float64'),
+            'cores': [int(core) for core in coresToMap],
+            'coreIndex': [lm_journal.checksum(coreIndex.core_ids, 'int64'),
+                          lm_journal.checksum(coreIndex.ptrs, 'int64'),
+                          lm_journal.checksum(coreIndex.windows, 'int64')]}
+
+
+def check_journal_cwds(coreRecords):
+    """Return journal records up to the first core area with missing or
+    changed cwds in the cwd store.
+
+    """
+    cwdStore = lu.get_cwd_store()
+    for recordNum, coreRecord in enumerate(coreRecords):
+        if coreRecord['cwd'] is None:
+            continue
+        core = int(coreRecord['core'])
+        if (cwdStore.exists(core) and
+                lm_journal.checksum(cwdStore.read(core)) == coreRecord['cwd']):
+            continue
+        lu.warn('Stored cost-weighted distances for core area #' +
+                str(core) + ' are missing or have changed.\nResults for '
+                'this and later core areas will be recalculated.')
+        return coreRecords[:recordNum]
+    return coreRecords
+
+
+def set_link_cwdist(linkTable, sourceCore, targetCore, cwDist):
+    """Record cwd between a pair of cores in the link table.
+
+    Disables links that are too long or too short.
+
+    """
+    link = lu.get_links_from_core_pairs(linkTable, sourceCore, targetCore)
+    if linkTable[link,cfg.LTB_LINKTYPE] > 0: # valid link
+        linkTable[link,cfg.LTB_CWDIST] = cwDist
+        if cfg.MAXCOSTDIST is not None:
+            if ((cwDist > cfg.MAXCOSTDIST) and
+               (linkTable[link,cfg.LTB_LINKTYPE] != cfg.LT_KEEP)):
+                 # Disable link, it's too long
+                linkTable[link,cfg.LTB_LINKTYPE] = cfg.LT_TLLC
+        if cfg.MINCOSTDIST is not None:
+            if (cwDist < cfg.MINCOSTDIST and
+               (linkTable[link,cfg.LTB_LINKTYPE] != cfg.LT_KEEP)):
+                # Disable link, it's too short
+                linkTable[link,cfg.LTB_LINKTYPE] = cfg.LT_TSLC
+
+
+def load_npy_rasters(pairCircles, globalCircle, coreIndex):
+    """Read resistance raster into memory for the NumPy cost distance
+    engine.
+
+    Cells outside the global bounding circle are set to NoData, as is done
+    for the ArcGIS engine by extracting BOUNDRESIS.
+
+    """
+    grid = lu.get_raster_grid(cfg.RESRAST)
+    resistance = lu.raster_to_array(cfg.RESRAST, grid)
+    if globalCircle is not None:
+        inCircle = grid.circle_mask(grid.full_window(),
+                                    globalCircle[:, [0, 1, 4]])
+        resistance[~inCircle] = npy.nan
+    return {'grid': grid, 'resistance': resistance, 'coreIndex': coreIndex,
+            'circles': pairCircles, 'reach': None}
+
+
+def get_cwd_targets(sourceCore, linkTable):
+    """Return core areas to be connected to a focal core."""
+    # Get target cores based on linktable with reinstated links
+    # (we temporarily disable them in do_cwd_calcs by adding 1000)
+    linkTableTemp = linkTable.copy()
+    # reinstate temporarily disabled links
+    rows = npy.where(linkTableTemp[:,cfg.LTB_LINKTYPE] > 1000)
+    linkTableTemp[rows,cfg.LTB_LINKTYPE] = (
+        linkTableTemp[rows,cfg.LTB_LINKTYPE] - 1000)
+    return lu.get_core_targets(sourceCore, linkTableTemp)
+
+
+def calc_npy_cwd(sourceCore, targetCores, npyRasters, maxDist, margin):
+    """Calculate cwds from a core area using the NumPy engine.
+
+    Returns the window of the grid used, and cwd and back direction arrays
+    for that window.
+
+    """
+    grid = npyRasters['grid']
+    circles = npyRasters['circles']
+    coreIndex = npyRasters['coreIndex']
+    if circles is None:
+        window = None
+        if npyRasters['reach'] is not None:
+            # Cells out of reach of source core can't be within maxDist
+            window = coreIndex.search_window(sourceCore, npyRasters['reach'])
+        if window is None:
+            window = grid.full_window()
+        inCircles = None
+    else:
+        # Get bounding circles that contain focal core and target cores
+        circleRows = []
+        for targetCore in targetCores:
+            corex = min(sourceCore, int(targetCore))
+            corey = max(sourceCore, int(targetCore))
+            circleRows.extend(npy.where((circles[:, 2] == corex) &
+                                        (circles[:, 3] == corey))[0])
+        pairCircles = circles[circleRows][:, [0, 1, 4]]
+        window = grid.circle_window(pairCircles)
+        inCircles = grid.circle_mask(window, pairCircles)
+
+    r0, r1, c0, c1 = window
+    resArray = npyRasters['resistance'][r0:r1, c0:c1]
+    if inCircles is not None:
+        resArray = npy.where(inCircles, resArray, npy.nan)
+    if margin is not None:
+        # Stop once target cores and corridor margin around them are done
+        targArray = coreIndex.mask(targetCores, window)
+    else:
+        targArray = None
+    cwdArray, backArray = lm_cwd.cost_distance(
+        coreIndex.mask(sourceCore, window), resArray, grid.cell_size,
+        maxDist, targArray, margin)
+    return window, cwdArray, backArray
+
+
+def get_num_workers(npyRasters):
+    """Return number of worker processes to use for cwd calculations.
+
+    Limited by the S3WORKERS setting, number of CPUs and available memory.
+
+    """
+    numWorkers = min(int(cfg.S3WORKERS), multiprocessing.cpu_count())
+    if numWorkers > 1:
+        totMem, availMem = lu.get_mem()
+        # Allow for worker using the full grid
+        workerMem = (float(npyRasters['resistance'].size) *
+                     lm_cwd.BYTES_PER_CELL / 1073741824)
+        memWorkers = max(int(availMem / workerMem), 1)
+        if memWorkers < numWorkers:
+            lu.warn('Limiting step 3 to ' + str(memWorkers) + ' worker '
+                    'processes because available memory is ~' +
+                    str(availMem) + ' GB.')
+            numWorkers = memWorkers
+    return numWorkers
+
+
+# Rasters used by cwd worker processes, set by init_cwd_worker
+_workerRasters = {}
+
+
+def init_cwd_worker(resFile, coreIndexDir, gridParams, circles, reach):
+    """Load rasters saved by CwdWorkerPool in a worker process."""
+    _workerRasters['grid'] = lm_cwd.RasterGrid(*gridParams)
+    _workerRasters['resistance'] = npy.load(resFile, mmap_mode='r')
+    _workerRasters['coreIndex'] = lm_core_index.CoreIndex(coreIndexDir)
+    _workerRasters['circles'] = circles
+    _workerRasters['reach'] = reach
+
+
+def calc_cwd_worker(sourceCore, targetCores, maxDist, margin, outDir):
+    """Calculate cwds from a core area in a worker process.
+
+    Cwd and back direction arrays are saved to outDir.  Returns the window
+    of the grid used.
+
+    """
+    window, cwdArray, backArray = calc_npy_cwd(
+        sourceCore, targetCores, _workerRasters, maxDist, margin)
+    npy.save(path.join(outDir, 'cwd.npy'), cwdArray)
+    npy.save(path.join(outDir, 'back.npy'), backArray)
+    return window
+
+
+class CwdWorkerPool(object):
+    """Calculates cwds for upcoming core areas in worker processes.
+
+    Cwds are calculated ahead of the step 3 loop using the target cores
+    known when the calculation is submitted.  They are only used if the
+    target cores are unchanged when the loop reaches the core area, so
+    results match running with a single process.
+
+    """
+
+    def __init__(self, numWorkers, npyRasters):
+        """Save rasters for workers to read and start processes."""
+        self.numWorkers = numWorkers
+        self.npyRasters = npyRasters
+        self.pending = {}
+        self.numDiscarded = 0
+        self.poolDir = path.join(cfg.SCRATCHDIR, 'cwdpool')
+        lu.delete_dir(self.poolDir)
+        lu.create_dir(self.poolDir)
+        resFile = path.join(self.poolDir, 'resistance.npy')
+        npy.save(resFile, npyRasters['resistance'])
+        grid = npyRasters['grid']
+        gridParams = (grid.xmin, grid.ymax, grid.cell_size, grid.nrows,
+                      grid.ncols)
+        self.pool = lu.start_pool(numWorkers, init_cwd_worker,
+                                  (resFile,
+                                   npyRasters['coreIndex'].index_dir,
+                                   gridParams, npyRasters['circles'],
+                                   npyRasters['reach']))
+
+    def submit(self, coresToMap, x, linkTable):
+        """Start cwd calcs for core areas up to two per worker ahead."""
+        for y in range(x, min(x + 2 * self.numWorkers, len(coresToMap))):
+            sourceCore = int(coresToMap[y])
+            if sourceCore in self.pending:
+                continue
+            targetCores = get_cwd_targets(sourceCore, linkTable)
+            if len(targetCores) == 0:
+                continue
+            outDir = path.join(self.poolDir, 'core' + str(sourceCore))
+            lu.create_dir(outDir)
+            result = self.pool.apply_async(calc_cwd_worker,
+                                           (sourceCore, targetCores,
+                                            cfg.TMAXCWDIST, cfg.S3CWDMARGIN,
+                                            outDir))
+            self.pending[sourceCore] = (targetCores, result)
+
+    def get_cwds(self, sourceCore, targetCores):
+        """Return window, cwd and back direction arrays.
+
+        Returns None if cwds were not calculated for the same target cores.
+
+        """
+        if sourceCore not in self.pending:
+            return None
+        submittedTargets, result = self.pending.pop(sourceCore)
+        window = result.get()
+        outDir = path.join(self.poolDir, 'core' + str(sourceCore))
+        npyCwds = None
+        if npy.array_equal(submittedTargets, targetCores):
+            cwdArray = npy.load(path.join(outDir, 'cwd.npy'))
+            backArray = npy.load(path.join(outDir, 'back.npy'))
+            npyCwds = window, cwdArray, backArray
         else:
-            return False  # Empty and therefore no overlap
+            self.numDiscarded += 1
+        lu.delete_dir(outDir)
+        return npyCwds
 
-    # Return GEOPROCESSING specific errors
-    except arcpy.ExecuteError:
-        lu.dashline(1)
-        lu.exit_with_geoproc_error(_SCRIPT_NAME)
+    def close(self):
+        """Stop worker processes and remove saved rasters."""
+        if self.numDiscarded > 0:
+            gprint('Discarded cost distances from worker processes for ' +
+                   str(self.numDiscarded) + ' core areas whose target '
+                   'cores changed.  These were recalculated serially.')
+        self.pool.terminate()
+        self.pool.join()
+        lu.delete_dir(self.poolDir)
+
+
+def read_cwd_arrays(cwdRaster, backRaster, coreIndex):
+    """Read cwd and back direction rasters.
+
+    Returns window of core area index grid covered by the cwd raster, and
+    cwd and back direction arrays for that window.
+
+    """
+    cwdGrid = lu.get_raster_grid(cwdRaster)
+    cwdArray = lu.raster_to_array(cwdRaster, cwdGrid)
+    backArray = lu.raster_to_array(backRaster, cwdGrid,
+                                   nodata=lm_cwd.BACK_NODATA)
+    return coreIndex.grid.subgrid_window(cwdGrid), cwdArray, backArray
+
+
+def get_zone_mins(coreIndex, cwdArray, window):
+    """Return dictionary of minimum cwd within each core area."""
+    zones, zoneMins = coreIndex.zonal_min(cwdArray, window)
+    return dict(zip(zones.tolist(), zoneMins.tolist()))
+
+
+def trace_core_lcp(targetCore, coreIndex, cwdArray, backArray, window):
+    """Trace least-cost path from target core back to source core.
+
+    Path starts at the target core cell with the lowest cwd, as with the
+    "BEST_SINGLE" option of CostPath.  Returns path cells (flat indices into
+    window), path vertices and path length.
+
+    """
+    targRows, targCols = coreIndex.window_cells(targetCore, window)
+    startCell = npy.nanargmin(cwdArray[targRows, targCols])
+    return lm_cwd.trace_lcp(backArray, (targRows[startCell],
+                                        targCols[startCell]),
+                            coreIndex.grid, window)
+
+
+def get_intermediate_cores(sourceCore, targetCore, coreIndex, lcpCells,
+                           window):
+    """Return core areas other than source and target crossed by an lcp.
+
+    lcpCells are flat indices of path cells in window.
+
+    """
+    r0, r1, c0, c1 = window
+    rows = lcpCells // (c1 - c0) + r0
+    cols = lcpCells % (c1 - c0) + c0
+    grid = coreIndex.grid
+    inGrid = ((rows >= 0) & (rows < grid.nrows) &
+              (cols >= 0) & (cols < grid.ncols))
+    cores = npy.unique(coreIndex.labels_at(rows[inGrid] * grid.ncols +
+                                           cols[inGrid]))
+    return cores[(cores > 0) & (cores != sourceCore) & (cores != targetCore)]
 
-    # Return any PYTHON or system specific errors
-    except Exception:
-        lu.dashline(1)
-        lu.exit_with_python_error(_SCRIPT_NAME)
 
 def delay_restart(failures):
     gprint('That was try #' + str(failures) + ' of 20 for this core area.')
@@ -75,25 +75,13 @@ def STEP4_refine_network():
                           str(cfg.S4MAXNN) + ' nearest neighbors.')
 
         # Code written assuming NO duplicate core pairs
-        for core in coresToProcess:
-            rows,cols = npy.where(
-                corridorLinks[:,cfg.LTB_CORE1:cfg.LTB_CORE2+1] == core)
-            distsFromCore = corridorLinks[rows,:]
-
-            # Sort by distance from target core
-            ind = npy.argsort(distsFromCore[:,distCol])
-            distsFromCore = distsFromCore[ind]
-
-            # Set N nearest neighbor connections to Nearest Neighbor (NNCT)
-            # optionally ignore max nearest neighbor setting
-            if cfg.IGNORES4MAXNN:
-                maxRange = len(rows)
-            else:
-                maxRange = min(len(rows), cfg.S4MAXNN)
-            for link in range (0, maxRange):
-                linkId = distsFromCore[link, cfg.LTB_LINKID]
-                # assumes linktable sequentially numbered with no gaps
-                linkTable[linkId - 1, cfg.LTB_LINKTYPE] = cfg.LT_NNCT
+        if cfg.IGNORES4MAXNN:
+            maxNN = len(corridorLinks)
+        else:
+            maxNN = cfg.S4MAXNN
+        nnLinkIds = get_nn_link_ids(corridorLinks, distCol, maxNN)
+        # assumes linktable sequentially numbered with no gaps
+        linkTable[nnLinkIds - 1, cfg.LTB_LINKTYPE] = cfg.LT_NNCT
 
         # Connect constellations (aka components or clusters)
         # Fixme: needs testing.  Move to function.
@@ -101,92 +89,46 @@ def STEP4_refine_network():
             lu.dashline(1)
             gprint('Connecting constellations')
 
-            # linkTableComp has 4 extra cols to track COMPONENTS
-            numLinks = linkTable.shape[0]
-            # g1' g2' THEN c1 c2
-            compCols = npy.zeros((numLinks, 4), dtype="int32")
-            linkTableComp = npy.append(linkTable, compCols, axis=1)
-            del compCols
-
-            # renumber cores to save memory for this next step.  Place in
-            # columns 10 and 11
-            for coreInd in range(0, len(coresToProcess)):
-                # here, cols are 0 for cfg.LTB_CORE1 and 1 for cfg.LTB_CORE2
-                rows, cols = npy.where(
-                    linkTableComp[:,cfg.LTB_CORE1:cfg.LTB_CORE2+1] ==
-                    coresToProcess[coreInd])
-                # want results in cols 10 and 11- These are NEW core numbers
-                # (0 - numcores)
-                linkTableComp[rows, cols + 10] = coreInd
-
-            rows, cols = npy.where(
-                linkTableComp[:, cfg.LTB_LINKTYPE:cfg.LTB_LINKTYPE + 1] ==
-                cfg.LT_NNCT)
-            # The new, improved corridorLinks- only NN links
-            corridorLinksComp = linkTableComp[rows, :]
-            # These are NEW core numbers (range from 0 to numcores)
-            coresToProcess = npy.unique(linkTableComp[:, 10:12])
-
-            #Create graph describing connected cores.
-            Graph = npy.zeros((len(coresToProcess), len(coresToProcess)),
-                          dtype="int32")
-            rows = corridorLinksComp[:,10].astype('int32')
-            cols = corridorLinksComp[:,11].astype('int32')
-            vals = npy.where(corridorLinksComp[:,cfg.LTB_LINKTYPE] ==
-                         cfg.LT_NNCT, cfg.LT_CORR, 0)
-
-            Graph[rows,cols] = vals
-            Graph = Graph + Graph.T
-
-            # Use graph to identify components (disconnected sub-groups) in
-            # core area network
-            components = lu.components_no_sparse(Graph)
-
-            for coreInd in range(0,len(coresToProcess)):
-                # In resulting cols, cols are 0 for LTB_CORE1 and 1 for
-                # LTB_CORE2
-                rows, cols = (npy.where(linkTableComp[:,10:12] ==
-                              coresToProcess[coreInd]))
-                # want results in cols 12 and 13  Note: we've replaced new core
-                # numbers with COMPONENT numbers.
-                linkTableComp[rows,cols+12] = components[coreInd]
-            # Additional column indexes for linkTableComp
-            component1Col = 12
-            component2Col = 13
-            linkTableComp[:,cfg.LTB_CLUST1] = linkTableComp[:,component1Col]
-            linkTableComp[:,cfg.LTB_CLUST2] = linkTableComp[:,component2Col]
-
-            # Sort by distance
-            ind = npy.argsort(linkTableComp[:,distCol])
-            linkTableComp = linkTableComp[ind]
+            # Constellations are trees in a union-find forest of core IDs,
+            # built from the nearest neighbor links
+            clusters = {}
+            nnRows = npy.where(
+                linkTable[:, cfg.LTB_LINKTYPE] == cfg.LT_NNCT)[0]
+            for row in nnRows.tolist():
+                lu.union_roots(clusters,
+                               int(linkTable[row, cfg.LTB_CORE1]),
+                               int(linkTable[row, cfg.LTB_CORE2]))
+
+            # Number constellations from 1, in order of lowest core ID
+            cores = npy.unique(linkTable[:, cfg.LTB_CORE1:cfg.LTB_CORE2 + 1])
+            roots = npy.array([lu.find_root(clusters, int(core))
+                               for core in cores.tolist()])
+            uniqueRoots = npy.unique(roots)
+            components = npy.searchsorted(uniqueRoots, roots) + 1
+            numComponents = len(uniqueRoots)
+            gprint('There are ' + str(numComponents) + ' constellations.')
+            for coreCol, clustCol in ((cfg.LTB_CORE1, cfg.LTB_CLUST1),
+                                      (cfg.LTB_CORE2, cfg.LTB_CLUST2)):
+                linkTable[:, clustCol] = components[
+                    npy.searchsorted(cores, linkTable[:, coreCol])]
 
             # Connect constellations via shortest inter-constellation links,
-            # until all constellations connected.
-            for row in range(0,numLinks):
-                if ((linkTableComp[row,distCol] > 0) and
-                    ((linkTableComp[row,cfg.LTB_LINKTYPE] == cfg.LT_CORR) or
-                    (linkTableComp[row,cfg.LTB_LINKTYPE] == cfg.LT_KEEP)) and
-                    (linkTableComp[row,component1Col] !=
-                     linkTableComp[row,component2Col])):
+            # until all constellations connected (Kruskal's algorithm over
+            # constellations)
+            candidates = ((linkTable[:, distCol] > 0) &
+                          ((linkTable[:, cfg.LTB_LINKTYPE] == cfg.LT_CORR) |
+                           (linkTable[:, cfg.LTB_LINKTYPE] == cfg.LT_KEEP)))
+            candRows = npy.where(candidates)[0]
+            ind = npy.argsort(linkTable[candRows, distCol], kind='mergesort')
+            for row in candRows[ind].tolist():
+                if numComponents == 1:
+                    break
+                if lu.union_roots(clusters,
+                                  int(linkTable[row, cfg.LTB_CORE1]),
+                                  int(linkTable[row, cfg.LTB_CORE2])):
                     # Make this an inter-component link
-                    linkTableComp[row,cfg.LTB_LINKTYPE] = cfg.LT_CLU
-                    newComp = min(linkTableComp
-                                  [row,component1Col:component2Col + 1])
-                    oldComp = max(linkTableComp
-                                  [row,component1Col:component2Col + 1])
-                    # cols are 0 and 1
-                    rows, cols = npy.where(linkTableComp
-                                       [:,component1Col:component2Col + 1]
-                                       == oldComp)
-                    # want results in cols 12 and 13
-                    linkTableComp[rows,cols + 12] = newComp
-
-            # Remove extra columns from link table
-            linkTable = lu.delete_col(linkTableComp,[10, 11, 12, 13])
-
-            # Re-sort link table by link ID
-            ind = npy.argsort(linkTable[:,cfg.LTB_LINKID])
-            linkTable = linkTable[ind]
+                    linkTable[row, cfg.LTB_LINKTYPE] = cfg.LT_CLU
+                    numComponents = numComponents - 1
 
         # At end, any non-constellation links that are not NN's get dropped
         # (too long to be in cfg.S4MAXNN, not a component link)
@@ -226,3 +168,25 @@ def STEP4_refine_network():
         lu.exit_with_python_error(_SCRIPT_NAME)
 
     return
+
+
+def get_nn_link_ids(corridorLinks, distCol, maxNN):
+    """Returns IDs of links from each core area to its maxNN nearest
+    neighbors
+
+    Both ends of every link are listed together as (core, distance, link
+    ID) rows and sorted once, so each core's links are in a group sorted by
+    distance.  Links ranked below maxNN in the group of either of their
+    cores are returned.  Ties are broken by link ID.
+
+    """
+    numLinks = corridorLinks.shape[0]
+    cores = npy.concatenate((corridorLinks[:, cfg.LTB_CORE1],
+                             corridorLinks[:, cfg.LTB_CORE2]))
+    dists = npy.concatenate((corridorLinks[:, distCol],) * 2)
+    linkIds = npy.concatenate((corridorLinks[:, cfg.LTB_LINKID],) * 2)
+    ind = npy.lexsort((linkIds, dists, cores))
+    cores = cores[ind]
+    # Rank of each link within its core's group
+    ranks = npy.arange(2 * numLinks) - npy.searchsorted(cores, cores)
+    return npy.unique(linkIds[ind][ranks < maxNN]).astype('int32')
@@ -8,12 +8,16 @@ pairs specified in linkTable and cwd layers
 """
 
 from os import path
+import multiprocessing
 import time
 
 import numpy as npy
 import arcpy
 
 from lm_config import tool_env as cfg
+import lm_cwd
+import lm_cwd_store
+import lm_mosaic
 import lm_util as lu
 
 _SCRIPT_NAME = "s5_calcLccs.py"
@@ -28,16 +32,7 @@ def STEP5_calc_lccs():
 
     """
     try:
-
-        normalize = True
-        calc_lccs(normalize)
-
-        #Code to allow extra iteration to mosaic NON-normalized LCCs
-        if cfg.CALCNONNORMLCCS:
-            normalize = False
-            lu.dashline(1)
-            gprint('\n**EXTRA STEP 5 RUN to mosaic NON-normalized corridors**')
-            calc_lccs(normalize)
+        calc_lccs()
 
     # Return any PYTHON or system specific errors
     except Exception:
@@ -46,18 +41,149 @@ def STEP5_calc_lccs():
         lu.exit_with_python_error(_SCRIPT_NAME)
 
 
-def calc_lccs(normalize):
+def new_mosaic(grid, workName, shared=False):
+    """Return empty corridor mosaic over a grid.
+
+    Mosaics larger than cfg.S5MOSAICMB, or shared with worker processes,
+    are kept in a memory-mapped file in the scratch directory.
+
+    """
+    mosaicMB = grid.nrows * grid.ncols * 4 / 1048576.0
+    workFile = None
+    if shared or (cfg.S5MOSAICMB is not None and
+                  mosaicMB > cfg.S5MOSAICMB):
+        workFile = path.join(cfg.SCRATCHDIR, workName)
+    return lm_mosaic.MinMosaic((grid.nrows, grid.ncols), workFile)
+
+
+def get_mosaic_links(linkTable):
+    """Returns rows of valid links in link table, keeping the first link
+    of each core pair
+
+    """
+    rows = npy.where(linkTable[:, cfg.LTB_LINKTYPE] >= 1)[0]
+    pairKeys = lm_cwd.pair_keys(linkTable[rows, cfg.LTB_CORE1],
+                                linkTable[rows, cfg.LTB_CORE2])
+    firstRows = npy.unique(pairKeys, return_index=True)[1]
+    return rows[npy.sort(firstRows)]
+
+
+def mosaic_tiles(linkTable, linkRows, cwdStore, mosaic, nonNormMosaic,
+                 numWorkers, cellSize):
+    """Mosaics corridors of links from stored cwds in worker processes
+
+    The grid is split into tiles and each worker mosaics a tile at a time,
+    reading only the parts of cwd arrays in the tile, and writes it to the
+    memory-mapped mosaic files.  Each worker caches up to cfg.CWDCACHEMB of
+    cwd arrays.
+
+    """
+    links = []
+    for x in linkRows.tolist():
+        corex = int(min(linkTable[x, cfg.LTB_CORE1],
+                        linkTable[x, cfg.LTB_CORE2]))
+        corey = int(max(linkTable[x, cfg.LTB_CORE1],
+                        linkTable[x, cfg.LTB_CORE2]))
+        window = lm_cwd_store.intersect_windows(cwdStore.window(corex),
+                                                cwdStore.window(corey))
+        if window is None:
+            raise ValueError('Cost-weighted distances from core areas ' +
+                             str(corex) + ' and ' + str(corey) +
+                             ' do not overlap.')
+        links.append((x, corex, corey,
+                       float(linkTable[x, cfg.LTB_CWDIST]), window))
+    tasks = lm_mosaic.tile_tasks(links, mosaic.array.shape)
+    gprint('Mosaicking corridors for ' + str(len(links)) + ' links in ' +
+           str(len(tasks)) + ' tiles using ' + str(numWorkers) +
+           ' worker processes.')
+
+    nonNormFile = None
+    if nonNormMosaic is not None:
+        nonNormFile = nonNormMosaic.work_file
+    pool = lu.start_pool(numWorkers, lm_mosaic.init_worker,
+                         (cwdStore.store_dir, mosaic.work_file, nonNormFile,
+                          cfg.CWDCACHEMB))
+    linkMins = {}
+    cacheStats = [0, 0, 0]  # Hits, misses and bytes avoided
+    pctDone = 0
     try:
-        if normalize:
-            mosaicBaseName = "_corridors"
-            writeTruncRaster = cfg.WRITETRUNCRASTER
-            outputGDB = cfg.OUTPUTGDB
-            SAVENORMLCCS = cfg.SAVENORMLCCS
-        else:
-            mosaicBaseName = "_NON_NORMALIZED_corridors"
-            SAVENORMLCCS = False
-            outputGDB = cfg.EXTRAGDB
-            writeTruncRaster = False
+        numDone = 0
+        for window, tileMins, tileStats in pool.imap_unordered(
+                lm_mosaic.mosaic_tile, tasks):
+            for x, tileMin in tileMins.items():
+                if x not in linkMins or tileMin < linkMins[x]:
+                    linkMins[x] = tileMin
+            for i in range(3):
+                cacheStats[i] += tileStats[i]
+            numDone = numDone + 1
+            pctDone = lu.report_pct_done(numDone, len(tasks), pctDone)
+    finally:
+        pool.terminate()
+        pool.join()
+    gprint(lm_cwd_store.cache_report(*cacheStats))
+
+    tolerance = cellSize * -10
+    for x in sorted(linkMins):
+        if linkMins[x] < tolerance:
+            lu.dashline(1)
+            msg = ('WARNING: Minimum value of a corridor #' + str(x+1)
+                   + ' is much less than zero ('+str(linkMins[x])+').'
+                   '\nThis could mean that BOUNDING CIRCLE BUFFER DISTANCES '
+                   'were too small and a corridor passed outside of a '
+                   'bounding circle, or that a corridor passed outside of the '
+                   'resistance map. \n')
+            lu.warn(msg)
+
+
+def write_corridor_rasters(mosaic, grid, outputGDB, mosaicBaseName,
+                           writeTruncRaster):
+    """Writes integer corridor raster from a corridor mosaic, and optionally
+    the corridor raster truncated at cfg.CWDTHRESH
+
+    Returns paths of the integer and truncated rasters (None if not
+    written).
+
+    """
+    if not arcpy.Exists(outputGDB):
+        arcpy.CreateFileGDB_management(cfg.OUTPUTDIR,
+                                       path.basename(outputGDB))
+
+    # Round to integer, as arcpy.sa.Int(mosaic + 0.5), a block of rows at a
+    # time
+    intRaster = path.join(outputGDB, cfg.PREFIX + mosaicBaseName)
+    lu.array_to_raster(mosaic.array, intRaster, grid, roundInt=True)
+
+    truncRaster = None
+    if writeTruncRaster:
+        # Set anything beyond cfg.CWDTHRESH to NODATA.
+        truncRaster = path.join(outputGDB, cfg.PREFIX + mosaicBaseName +
+                                '_truncated_at_' +
+                                lu.cwd_cutoff_str(cfg.CWDTHRESH))
+        lu.array_to_raster(mosaic.array, truncRaster, grid,
+                           noData=beyond_cwd_thresh, roundInt=True)
+    return intRaster, truncRaster
+
+
+def beyond_cwd_thresh(block):
+    """Returns NoData cells of a block of a corridor mosaic, including
+    cells that round to more than cfg.CWDTHRESH
+
+    """
+    noData = npy.isnan(block)
+    noData |= (npy.trunc(block + npy.asarray(0.5, dtype=block.dtype)) >
+               cfg.CWDTHRESH)
+    return noData
+
+
+def calc_lccs():
+    """Creates normalized least-cost corridors and mosaics them, along
+    with the NON-normalized corridors if cfg.CALCNONNORMLCCS is set
+
+    Each pair of cwd layers is read once for both mosaics.
+
+    """
+    try:
+        SAVENORMLCCS = cfg.SAVENORMLCCS
 
         lu.dashline(1)
         gprint('Running script ' + _SCRIPT_NAME)
@@ -115,24 +241,64 @@ def calc_lccs(normalize):
         arcpy.CreateFolder_management(cfg.LCCBASEDIR, cfg.LCCNLCDIR_NM)
         clccdir = path.join(cfg.LCCBASEDIR, cfg.LCCNLCDIR_NM)
         gprint("")
-        if normalize:
-            gprint('Normalized least-cost corridors will be written '
-                          'to ' + clccdir + '\n')
+        gprint('Normalized least-cost corridors will be written '
+                      'to ' + clccdir + '\n')
+        if cfg.CALCNONNORMLCCS:
+            gprint('NON-normalized least-cost corridors will also be '
+                   'mosaicked.\n')
         PREFIX = cfg.PREFIX
 
-        # Add CWD layers for core area pairs to produce NORMALIZED LCC layers
-        numGridsWritten = 0
+        # Cwd arrays stored in step 3 are read instead of cwd rasters where
+        # available
+        cwdStore = lu.get_cwd_store()
+        coreIndex = lu.get_core_index(cfg.RESRAST)
+        if coreIndex is not None:
+            grid = coreIndex.grid
+        else:
+            grid = lu.get_raster_grid(cfg.RESRAST)
+
+        # Valid links, one for each core pair
+        linkRows = get_mosaic_links(linkTable)
+        numMosaicLinks = len(linkRows)
+
+        # Corridors from stored cwds can be mosaicked tile by tile in
+        # worker processes.  Individual corridor rasters are written one
+        # link at a time.
+        numWorkers = min(int(cfg.S5WORKERS), multiprocessing.cpu_count())
+        useTiles = (numWorkers > 1 and not SAVENORMLCCS and
+                    coreIndex is not None)
+        if useTiles:
+            for core in npy.unique(linkTable[linkRows, cfg.LTB_CORE1:
+                                             cfg.LTB_CORE2 + 1]).tolist():
+                if not cwdStore.exists(int(core)):
+                    useTiles = False
+                    break
+
+        # Corridors are mosaicked in memory, keeping the minimum value in
+        # each cell, and the mosaic is written once all links are added
+        mosaic = new_mosaic(grid, 'mos.npy', useTiles)
+        nonNormMosaic = None
+        if cfg.CALCNONNORMLCCS:
+            nonNormMosaic = new_mosaic(grid, 'mos_non_norm.npy', useTiles)
+
         coreList = linkTable[:,cfg.LTB_CORE1:cfg.LTB_CORE2+1]
         coreList = npy.sort(coreList)
+        if useTiles:
+            mosaic_tiles(linkTable, linkRows, cwdStore, mosaic, nonNormMosaic,
+                         numWorkers, grid.cell_size)
+            serialRows = []
+        else:
+            # Links sharing a core area are done together, so its cwd array
+            # is decoded once and read from the cache after that
+            serialRows = linkRows[lm_cwd_store.link_order(
+                coreList[linkRows, 0], coreList[linkRows, 1])].tolist()
+        cwdCache = lm_cwd_store.CwdCache(cwdStore, cfg.CWDCACHEMB)
 
-        x = 0
-        linkCount = 0
-        endIndex = numLinks
-        while x < endIndex:
-            if (linkTable[x, cfg.LTB_LINKTYPE] < 1): # If not a valid link
-                x = x + 1
-                continue
+        # Add CWD layers for core area pairs to produce NORMALIZED LCC layers
+        numGridsWritten = 0
 
+        linkCount = 0
+        for x in serialRows:
             linkCount = linkCount + 1
             start_time = time.clock()
 
@@ -142,136 +308,87 @@ def calc_lccs(normalize):
             corex=int(coreList[x,0])
             corey=int(coreList[x,1])
 
-            # Get cwd rasters for source and target cores
-            cwdRaster1 = lu.get_cwd_path(corex)
-            cwdRaster2 = lu.get_cwd_path(corey)
-
-            if not arcpy.Exists(cwdRaster1):
-                msg =('\nError: cannot find cwd raster:\n' + cwdRaster1)
-            if not arcpy.Exists(cwdRaster2):
-                msg =('\nError: cannot find cwd raster:\n' + cwdRaster2)
-                lu.raise_error(msg)
-
-
             lccNormRaster = path.join(clccdir, str(corex) + "_" +
                                       str(corey))# + ".tif")
-            arcpy.env.extent = "MINOF"
 
             link = lu.get_links_from_core_pairs(linkTable, corex, corey)
 
-            offset = 10000
-
             # Normalized lcc rasters are created by adding cwd rasters and
             # subtracting the least cost distance between them.
-            lcDist = (float(linkTable[link,cfg.LTB_CWDIST]) - offset)
-
-            if normalize:
-                statement = ('outras = arcpy.sa.Raster(cwdRaster1) '
-                             '+ arcpy.sa.Raster(cwdRaster2) - lcDist; '
-                             'outras.save(lccNormRaster)')
+            lcDist = float(linkTable[link,cfg.LTB_CWDIST])
+
+            if (coreIndex is not None and cwdStore.exists(corex) and
+                    cwdStore.exists(corey)):
+                lccArray, lccWindow = lu.get_store_lcc(cwdCache, corex, corey,
+                                                       lcDist)
+                if SAVENORMLCCS:
+                    lu.array_to_raster(lccArray, lccNormRaster, grid,
+                                       lccWindow)
             else:
+                cwdRaster1 = lu.get_cwd_raster(corex)
+                cwdRaster2 = lu.get_cwd_raster(corey)
+                if not arcpy.Exists(cwdRaster1):
+                    msg =('\nError: cannot find cwd raster:\n' + cwdRaster1)
+                    lu.raise_error(msg)
+                if not arcpy.Exists(cwdRaster2):
+                    msg =('\nError: cannot find cwd raster:\n' + cwdRaster2)
+                    lu.raise_error(msg)
+
+                arcpy.env.extent = "MINOF"
                 statement = ('outras = arcpy.sa.Raster(cwdRaster1) '
-                             '+ arcpy.sa.Raster(cwdRaster2); '
+                             '+ arcpy.sa.Raster(cwdRaster2) - lcDist; '
                              'outras.save(lccNormRaster)')
-
-            count = 0
-            while True:
-                try:
-                    exec statement
-                except Exception:
-                    count,tryAgain = lu.retry_arc_error(count,statement)
-                    if not tryAgain:
-                        exec statement
-                else: break
-
-            if normalize:
-                try:
-                    minObject = arcpy.GetRasterProperties_management(lccNormRaster, "MINIMUM")
-                    rasterMin = float(str(minObject.getOutput(0)))
-                except Exception:
-                    lu.warn('\n------------------------------------------------')
-                    lu.warn('WARNING: Raster minimum check failed in step 5. \n'
-                        'This may mean the output rasters are corrupted. Please \n'
-                        'be sure to check for valid rasters in '+ outputGDB)
-                    rasterMin = 0
-                tolerance = (float(arcpy.env.cellSize) * -10)
-                if rasterMin < tolerance:
-                    lu.dashline(1)
-                    msg = ('WARNING: Minimum value of a corridor #' + str(x+1)
-                           + ' is much less than zero ('+str(rasterMin)+').'
-                           '\nThis could mean that BOUNDING CIRCLE BUFFER DISTANCES '
-                           'were too small and a corridor passed outside of a '
-                           'bounding circle, or that a corridor passed outside of the '
-                           'resistance map. \n')
-                    lu.warn(msg)
-
-            arcpy.env.extent = cfg.RESRAST
-
-            mosaicDir = path.join(cfg.LCCBASEDIR,'mos'+str(x+1))
-            lu.create_dir(mosaicDir)
-            mosFN = 'mos'#.tif' change and move
-            mosaicRaster = path.join(mosaicDir,mosFN)
-
-            if numGridsWritten == 0 and dirCount == 0:
-                #If this is the first grid then copy rather than mosaic
-                arcpy.CopyRaster_management(lccNormRaster, mosaicRaster)
-            else:
-
-                rasterString = '"'+lccNormRaster+";"+lastMosaicRaster+'"'
-                statement = ('arcpy.MosaicToNewRaster_management('
-                            'rasterString,mosaicDir,mosFN, "", '
-                            '"32_BIT_FLOAT", arcpy.env.cellSize, "1", "MINIMUM", '
-                            '"MATCH")')
-
                 count = 0
                 while True:
                     try:
-                        lu.write_log('Executing mosaic for link #'+str(linkId))
                         exec statement
-                        lu.write_log('Done with mosaic.')
                     except Exception:
                         count,tryAgain = lu.retry_arc_error(count,statement)
-                        lu.delete_data(mosaicRaster)
-                        lu.delete_dir(mosaicDir)
-                        # Try a new directory
-                        mosaicDir = path.join(cfg.LCCBASEDIR,'mos'+str(x+1)+ '_' + str(count))
-                        lu.create_dir(mosaicDir)
-                        mosaicRaster = path.join(mosaicDir,mosFN)
                         if not tryAgain:
                             exec statement
                     else: break
+                arcpy.env.extent = cfg.RESRAST
+
+                lccExtent = arcpy.Describe(lccNormRaster).extent
+                lccWindow = grid.bounds_window(lccExtent.XMin, lccExtent.YMin,
+                                               lccExtent.XMax, lccExtent.YMax)
+                lccArray = lu.raster_to_array(lccNormRaster, grid, lccWindow)
+                if not SAVENORMLCCS:
+                    lu.delete_data(lccNormRaster)
+
+            rasterMin = lm_mosaic.nan_min(lccArray)
+            tolerance = grid.cell_size * -10
+            if rasterMin is not None and rasterMin < tolerance:
+                lu.dashline(1)
+                msg = ('WARNING: Minimum value of a corridor #' + str(x+1)
+                       + ' is much less than zero ('+str(rasterMin)+').'
+                       '\nThis could mean that BOUNDING CIRCLE BUFFER DISTANCES '
+                       'were too small and a corridor passed outside of a '
+                       'bounding circle, or that a corridor passed outside of the '
+                       'resistance map. \n')
+                lu.warn(msg)
+
+            lu.write_log('Adding corridor for link #' + str(linkId) +
+                         ' to mosaic')
+            mosaic.add(lccArray, lccWindow)
+            if nonNormMosaic is not None:
+                # NON-normalized corridor is the sum of the cwds
+                lccArray += lcDist
+                nonNormMosaic.add(lccArray, lccWindow)
+            del lccArray
             endTime = time.clock()
             processTime = round((endTime - start_time), 2)
 
-            if normalize == True:
-                printText = "Normalized and mosaicked "
-            else:
-                printText = "Mosaicked NON-normalized "
-            gprint(printText + "corridor for link ID #" + str(linkId) +
+            gprint("Normalized and mosaicked corridor for link ID #" +
+                    str(linkId) +
                     " connecting core areas " + str(corex) +
                     " and " + str(corey)+ " in " +
                     str(processTime) + " seconds. " + str(int(linkCount)) +
-                    " out of " + str(int(numCorridorLinks)) + " links have been "
+                    " out of " + str(int(numMosaicLinks)) + " links have been "
                     "processed.")
 
-            # temporarily disable links in linktable - don't want to mosaic
-            # them twice
-            for y in range (x+1,numLinks):
-                corex1 = int(coreList[y,0])
-                corey1 = int(coreList[y,1])
-                if corex1 == corex and corey1 == corey:
-                    linkTable[y,cfg.LTB_LINKTYPE] = (
-                        linkTable[y,cfg.LTB_LINKTYPE] + 1000)
-                elif corex1==corey and corey1==corex:
-                    linkTable[y,cfg.LTB_LINKTYPE] = (
-                            linkTable[y,cfg.LTB_LINKTYPE] + 1000)
-
-            numGridsWritten = numGridsWritten + 1
-            if not SAVENORMLCCS:
-                lu.delete_data(lccNormRaster)
-                lu.delete_dir(clccdir)
-                lu.create_dir(clccdir)
-            else:
+            if SAVENORMLCCS:
+                numGridsWritten = numGridsWritten + 1
                 if numGridsWritten == 100:
                     # We only write up to 100 grids to any one folder
                     # because otherwise Arc slows to a crawl
@@ -282,81 +399,29 @@ def calc_lccs(normalize):
                     gprint("Creating output folder: " + clccdir)
                     arcpy.CreateFolder_management(cfg.LCCBASEDIR,
                                                path.basename(clccdir))
-
-            if numGridsWritten > 1 or dirCount > 0:
-                lu.delete_data(lastMosaicRaster)
-                lu.delete_dir(path.dirname(lastMosaicRaster))
-
-            lastMosaicRaster = mosaicRaster
-            x = x + 1
-
-        #rows that were temporarily disabled
-        rows = npy.where(linkTable[:,cfg.LTB_LINKTYPE]>1000)
-        linkTable[rows,cfg.LTB_LINKTYPE] = (
-            linkTable[rows,cfg.LTB_LINKTYPE] - 1000)
+        if cwdCache.misses > 0:
+            gprint(cwdCache.report())
         # ---------------------------------------------------------------------
 
-        # Create output geodatabase
-        if not arcpy.Exists(outputGDB):
-            arcpy.CreateFileGDB_management(cfg.OUTPUTDIR, path.basename(outputGDB))
-
-        arcpy.env.workspace = outputGDB
+        # Write corridor rasters from mosaics
+        lu.write_log('Writing corridor mosaics.')
+        intRaster, truncRaster = write_corridor_rasters(
+            mosaic, grid, cfg.OUTPUTGDB, "_corridors", cfg.WRITETRUNCRASTER)
+        rasterMin = mosaic.minimum()
+        mosaic.delete()
+        nonNormRaster = None
+        if nonNormMosaic is not None:
+            nonNormRaster = write_corridor_rasters(
+                nonNormMosaic, grid, cfg.EXTRAGDB,
+                "_NON_NORMALIZED_corridors", False)[0]
+            nonNormMosaic.delete()
+
+        arcpy.env.workspace = cfg.OUTPUTGDB
 
-        arcpy.env.pyramid = "NONE"
-        arcpy.env.rasterStatistics = "NONE"
-
-        # ---------------------------------------------------------------------
-        # convert mosaic raster to integer
-        intRaster = path.join(outputGDB,PREFIX + mosaicBaseName)
-        statement = ('outras = arcpy.sa.Int(arcpy.sa.Raster(mosaicRaster) '
-                     '- offset + 0.5); '
-                     'outras.save(intRaster)')
-        count = 0
-        while True:
-            try:
-                exec statement
-            except Exception:
-                count,tryAgain = lu.retry_arc_error(count,statement)
-                if not tryAgain: exec statement
-            else: break
-        # ---------------------------------------------------------------------
-
-
-        if writeTruncRaster:
-            # -----------------------------------------------------------------
-            # Set anything beyond cfg.CWDTHRESH to NODATA.
-            truncRaster = (outputGDB + '\\' + PREFIX + mosaicBaseName +
-                           '_truncated_at_' + lu.cwd_cutoff_str(cfg.CWDTHRESH))
-
-            statement = ('outRas = arcpy.sa.Raster(intRaster)'
-                         '* (arcpy.sa.Con(arcpy.sa.Raster(intRaster) '
-                         '<= cfg.CWDTHRESH, 1)); '
-                         'outRas.save(truncRaster)')
-
-            count = 0
-            while True:
-                try:
-                    exec statement
-                except Exception:
-                    count,tryAgain = lu.retry_arc_error(count,statement)
-                    if not tryAgain: exec statement
-                else: break
         # ---------------------------------------------------------------------
         # Check for unreasonably low minimum NLCC values
-        try:
-            mosaicGrid = path.join(cfg.LCCBASEDIR,'mos')
-            # Copy to grid to test
-            arcpy.CopyRaster_management(mosaicRaster, mosaicGrid)
-            minObject = arcpy.GetRasterProperties_management(mosaicGrid, "MINIMUM")
-            rasterMin = float(str(minObject.getOutput(0)))
-        except Exception:
-            lu.warn('\n------------------------------------------------')
-            lu.warn('WARNING: Raster minimum check failed in step 5. \n'
-                'This may mean the output rasters are corrupted. Please \n'
-                'be sure to check for valid rasters in '+ outputGDB)
-            rasterMin = 0
-        tolerance = (float(arcpy.env.cellSize) * -10)
-        if rasterMin < tolerance:
+        tolerance = grid.cell_size * -10
+        if rasterMin is not None and rasterMin < tolerance:
             lu.dashline(1)
             msg = ('WARNING: Minimum value of mosaicked corridor map is '
                    'much less than zero ('+str(rasterMin)+').'
@@ -416,11 +481,16 @@ def calc_lccs(normalize):
                           'for corridor raster')
         lu.build_stats(intRaster)
 
-        if writeTruncRaster:
+        if truncRaster is not None:
             arcpy.AddMessage('Building output statistics '
                               'for truncated corridor raster')
             lu.build_stats(truncRaster)
 
+        if nonNormRaster is not None:
+            arcpy.AddMessage('Building output statistics '
+                              'for NON-normalized corridor raster')
+            lu.build_stats(nonNormRaster)
+
         if cfg.OUTPUTFORMODELBUILDER:
             arcpy.CopyFeatures_management(cfg.COREFC, cfg.OUTPUTFORMODELBUILDER)
 
@@ -149,6 +149,10 @@ def step6_calc_barriers():
         core_list = link_table[:, cfg.LTB_CORE1:cfg.LTB_CORE2 + 1]
         core_list = npy.sort(core_list)
 
+        # Cwd rasters written from the cwd store cover the cells within the
+        # largest search radius of a cwd value
+        focal_cells = int(end_radius / float(arcpy.env.cellSize)) + 1
+
         # Loop through each search radius to calculate barriers in each link
         rad_id = 0  # Keep track of no of radii processed - used for temp dir
         for radius in range(start_radius, end_radius + 1, radius_step):
@@ -183,9 +187,19 @@ def step6_calc_barriers():
                         corex = int(core_list[x, 0])
                         corey = int(core_list[x, 1])
 
-                        # Get cwd rasters for source and target cores
-                        cwd_ras1 = lu.get_cwd_path(corex)
-                        cwd_ras2 = lu.get_cwd_path(corey)
+                        # Focal rasters are made once for each core and
+                        # radius, and reused by the other links of the core
+                        focal_ras1 = lu.get_focal_path(corex, radius)
+                        focal_ras2 = lu.get_focal_path(corey, radius)
+
+                        # Get cwd rasters for source and target cores.
+                        # They are only needed to make focal rasters.
+                        cwd_ras1 = None
+                        cwd_ras2 = None
+                        if not path.exists(focal_ras1):
+                            cwd_ras1 = lu.get_cwd_raster(corex, focal_cells)
+                        if not path.exists(focal_ras2):
+                            cwd_ras2 = lu.get_cwd_raster(corey, focal_cells)
 
                         # Mask out areas above CWD threshold
                         cwd_tmp1 = None
@@ -199,23 +213,22 @@ def step6_calc_barriers():
                             arcpy.env.extent = cfg.RESRAST
                             arcpy.env.cellSize = cfg.RESRAST
                             arcpy.env.snapRaster = cfg.RESRAST
-                            cwd_tmp1 = path.join(cfg.SCRATCHDIR,
-                                                 "tmp" + str(corex))
-                            out_con = arcpy.sa.Con(
-                                cwd_ras1 < float(cfg.BARRIER_CWD_THRESH),
-                                cwd_ras1)
-                            out_con.save(cwd_tmp1)
-                            cwd_ras1 = cwd_tmp1
-                            cwd_tmp2 = path.join(cfg.SCRATCHDIR,
-                                                 "tmp" + str(corey))
-                            out_con = arcpy.sa.Con(
-                                cwd_ras2 < float(cfg.BARRIER_CWD_THRESH),
-                                cwd_ras2)
-                            out_con.save(cwd_tmp2)
-                            cwd_ras2 = cwd_tmp2
-
-                        focal_ras1 = lu.get_focal_path(corex, radius)
-                        focal_ras2 = lu.get_focal_path(corey, radius)
+                            if not path.exists(focal_ras1):
+                                cwd_tmp1 = path.join(cfg.SCRATCHDIR,
+                                                     "tmp" + str(corex))
+                                out_con = arcpy.sa.Con(
+                                    cwd_ras1 < float(cfg.BARRIER_CWD_THRESH),
+                                    cwd_ras1)
+                                out_con.save(cwd_tmp1)
+                                cwd_ras1 = cwd_tmp1
+                            if not path.exists(focal_ras2):
+                                cwd_tmp2 = path.join(cfg.SCRATCHDIR,
+                                                     "tmp" + str(corey))
+                                out_con = arcpy.sa.Con(
+                                    cwd_ras2 < float(cfg.BARRIER_CWD_THRESH),
+                                    cwd_ras2)
+                                out_con.save(cwd_tmp2)
+                                cwd_ras2 = cwd_tmp2
 
                         link = lu.get_links_from_core_pairs(link_table,
                                                             corex, corey)
@@ -16,6 +16,7 @@ import arcpy
 
 from lm_retry_decorator import Retry
 from lm_config import tool_env as cfg
+import lm_cwd_store
 import lm_util as lu
 
 _SCRIPT_NAME = "s8_pinchpoints.py"
@@ -132,6 +133,11 @@ def STEP8_calc_pinchpoints():
             resRaster = squaredRaster
 
         if cfg.DO_ADJACENTPAIRS:
+            # Core area cell index from step 3, used to map core pairs,
+            # and cwd arrays stored in step 3
+            coreIndex = lu.get_core_index(resRaster)
+            cwdStore = lu.get_cwd_store()
+            cwdCache = lm_cwd_store.CwdCache(cwdStore, cfg.CWDCACHEMB)
             linkLoop = 0
             lu.dashline(1)
             gprint('Mapping pinch points in individual corridors \n'
@@ -142,7 +148,14 @@ def STEP8_calc_pinchpoints():
             gprint('and ending the cs_run.exe process.')
             lu.dashline(2)
 
-            for x in range(0,numLinks):
+            # Links sharing a core area are done together, so its cwd array
+            # is decoded once and read from the cache after that.  Order is
+            # the same on restart.
+            linkRows = npy.where(linkTable[:, cfg.LTB_LINKTYPE] > 0)[0]
+            linkOrder = linkRows[lm_cwd_store.link_order(
+                coreList[linkRows, 0], coreList[linkRows, 1])].tolist()
+
+            for x in linkOrder:
                 linkId = str(int(linkTable[x,cfg.LTB_LINKID]))
                 if not (linkTable[x,cfg.LTB_LINKTYPE] > 0):
                     continue
@@ -159,10 +172,6 @@ def STEP8_calc_pinchpoints():
                 corex=int(coreList[x,0])
                 corey=int(coreList[x,1])
 
-                # Get cwd rasters for source and target cores
-                cwdRaster1 = lu.get_cwd_path(corex)
-                cwdRaster2 = lu.get_cwd_path(corey)
-
                 lccNormRaster = path.join(linkDir, 'lcc_norm')
                 arcpy.env.extent = "MINOF"
 
@@ -172,9 +181,17 @@ def STEP8_calc_pinchpoints():
 
                 # Normalized lcc rasters are created by adding cwd rasters
                 # and subtracting the least cost distance between them.
-                outRas = (arcpy.sa.Raster(cwdRaster1)
-                          + arcpy.sa.Raster(cwdRaster2) - lcDist)
-                outRas.save(lccNormRaster)
+                # Cwd arrays stored in step 3 are used where available.
+                if (coreIndex is not None and cwdStore.exists(corex) and
+                        cwdStore.exists(corey)):
+                    lu.write_store_lcc(cwdCache, corex, corey, lcDist,
+                                       lccNormRaster, coreIndex.grid)
+                else:
+                    cwdRaster1 = lu.get_cwd_raster(corex)
+                    cwdRaster2 = lu.get_cwd_raster(corey)
+                    outRas = (arcpy.sa.Raster(cwdRaster1)
+                              + arcpy.sa.Raster(cwdRaster2) - lcDist)
+                    outRas.save(lccNormRaster)
 
                 #create raster mask
                 resMaskRaster = path.join(linkDir, 'res_mask'+tif)
@@ -219,11 +236,16 @@ def STEP8_calc_pinchpoints():
                 corePairRaster = path.join(linkDir, 'core_pairs'+tif)
                 arcpy.env.extent = resClipRasterMasked
 
-                # Next result needs to be floating pt for numpy export
-                outCon = (arcpy.sa.Con(arcpy.sa.Raster(cwdRaster1) == 0, corex,
-                          arcpy.sa.Con(arcpy.sa.Raster(cwdRaster2) == 0, corey
-                          + 0.0)))
-                outCon.save(corePairRaster)
+                if coreIndex is not None:
+                    write_core_pair_raster(coreIndex, corex, corey,
+                                           resClipRasterMasked,
+                                           corePairRaster)
+                else:
+                    # Next result needs to be floating pt for numpy export
+                    outCon = (arcpy.sa.Con(arcpy.sa.Raster(cwdRaster1) == 0,
+                              corex, arcpy.sa.Con(arcpy.sa.Raster(cwdRaster2)
+                              == 0, corey + 0.0)))
+                    outCon.save(corePairRaster)
 
                 coreNpyFN = 'cores_link_' + linkId + '.npy'
                 coreNpyFile = path.join(INCIRCUITDIR, coreNpyFN)
@@ -347,6 +369,8 @@ def STEP8_calc_pinchpoints():
                         ' links have been processed.')
                 start_time1 = lu.elapsed_time(start_time1)
 
+            if cwdCache.misses > 0:
+                gprint(cwdCache.report())
             outputRaster = path.join(outputGDB, cfg.PREFIX +
                                      "_current_adjacentPairs_" + cutoffText)
             lu.delete_data(outputRaster)
@@ -554,6 +578,22 @@ def export_ras_to_npy(raster,npyFile):
 
     return numElements, numNodes
 
+def write_core_pair_raster(coreIndex, corex, corey, baseRaster,
+                           outRasterPath):
+    """Write raster of a pair of core areas with extent of base raster.
+
+    Uses core area cell index instead of finding zero cwd cells.  Output
+    is floating point for numpy export.
+
+    """
+    grid = lu.get_raster_grid(baseRaster)
+    window = coreIndex.grid.subgrid_window(grid)
+    pairArray = npy.zeros((grid.nrows, grid.ncols)) + npy.nan
+    pairArray[coreIndex.mask(corey, window)] = corey
+    pairArray[coreIndex.mask(corex, window)] = corex
+    lu.array_to_raster(pairArray, outRasterPath, grid)
+
+
 @Retry(10)
 def import_npy_to_ras(npyFile,baseRaster,outRasterPath):
     npyArray = npy.load(npyFile, mmap_mode=None)
@@ -0,0 +1,145 @@
+"""Tests of the NumPy cost distance engine against a brute-force reference.
+
+The reference relaxes every move between 8-neighbours until no cwd drops
+(Bellman-Ford), which is slow but gives exact least-cost distances to check
+cost_distance against on small synthetic grids.
+
+"""
+
+import math
+
+import numpy as npy
+
+import lm_cwd
+
+
+def move_cost(resistance, cell, nbr, cell_size):
+    """Return cost of moving between two neighbouring cells."""
+    diagonal = cell[0] != nbr[0] and cell[1] != nbr[1]
+    length = cell_size * (math.sqrt(2) if diagonal else 1.0)
+    return 0.5 * (resistance[cell] + resistance[nbr]) * length
+
+
+def bellman_ford(source, resistance, cell_size=1.0):
+    """Return exact cwds, inf for cells that can't be reached."""
+    nrows, ncols = resistance.shape
+    valid = ~npy.isnan(resistance)
+    dist = npy.where(source & valid, 0.0, npy.inf)
+    changed = True
+    while changed:
+        changed = False
+        for row in range(nrows):
+            for col in range(ncols):
+                if not valid[row, col]:
+                    continue
+                for drow, dcol in lm_cwd.BACK_DIRECTIONS.values():
+                    nrow = row + drow
+                    ncol = col + dcol
+                    if not (0 <= nrow < nrows and 0 <= ncol < ncols and
+                            valid[nrow, ncol]):
+                        continue
+                    ndist = dist[nrow, ncol] + move_cost(
+                        resistance, (row, col), (nrow, ncol), cell_size)
+                    if ndist < dist[row, col] - 1e-12:
+                        dist[row, col] = ndist
+                        changed = True
+    return dist
+
+
+def random_grid(seed, shape=(14, 17), nodata_frac=0.0, integer=False):
+    """Return random source and resistance arrays."""
+    rng = npy.random.RandomState(seed)
+    if integer:
+        resistance = rng.randint(1, 20, shape).astype('float64')
+    else:
+        resistance = rng.uniform(0.5, 10.0, shape)
+    resistance[rng.rand(*shape) < nodata_frac] = npy.nan
+    source = npy.zeros(shape, dtype=bool)
+    source[rng.randint(0, shape[0], 3), rng.randint(0, shape[1], 3)] = True
+    return source, resistance
+
+
+def check_back_dirs(cwd, back_dir, source, resistance, cell_size):
+    """Check back directions lead along least-cost moves to sources."""
+    nrows, ncols = cwd.shape
+    reached = ~npy.isnan(cwd)
+    assert (back_dir[~reached] == lm_cwd.BACK_NODATA).all()
+    assert (back_dir[reached & source] == lm_cwd.BACK_SOURCE).all()
+    rows, cols = npy.where(reached & ~source)
+    for row, col in zip(rows.tolist(), cols.tolist()):
+        code = int(back_dir[row, col])
+        assert code in lm_cwd.BACK_DIRECTIONS
+        drow, dcol = lm_cwd.BACK_DIRECTIONS[code]
+        nbr = (row + drow, col + dcol)
+        assert 0 <= nbr[0] < nrows and 0 <= nbr[1] < ncols
+        assert reached[nbr]
+        expected = cwd[nbr] + move_cost(resistance, (row, col), nbr,
+                                        cell_size)
+        assert abs(cwd[row, col] - expected) <= 1e-4 * max(expected, 1.0)
+
+
+def check_cwds(cwd, expected):
+    """Check cwds match reference cwds where both have values."""
+    reached = ~npy.isnan(cwd)
+    assert npy.allclose(cwd[reached], expected[reached], rtol=1e-6)
+
+
+def test_matches_bellman_ford():
+    for seed in range(3):
+        source, resistance = random_grid(seed)
+        cwd, back_dir = lm_cwd.cost_distance(source, resistance, 2.0)
+        expected = bellman_ford(source, resistance, 2.0)
+        assert npy.array_equal(npy.isnan(cwd), npy.isinf(expected))
+        check_cwds(cwd, expected)
+        check_back_dirs(cwd, back_dir, source, resistance, 2.0)
+
+
+def test_nodata_cells_are_barriers():
+    source, resistance = random_grid(4, nodata_frac=0.2)
+    # Wall of NoData with one gap, and a cell walled in on all sides
+    resistance[:, 8] = npy.nan
+    resistance[6, 8] = 3.0
+    resistance[0:3, 12:15] = npy.nan
+    resistance[1, 13] = 1.0
+    source[:] = False
+    source[5, 2] = True
+    source[2, 8] = True  # Source on NoData is ignored
+    cwd, back_dir = lm_cwd.cost_distance(source, resistance)
+    expected = bellman_ford(source, resistance)
+    assert npy.isnan(cwd[npy.isnan(resistance)]).all()
+    assert npy.isnan(cwd[1, 13])
+    assert back_dir[1, 13] == lm_cwd.BACK_NODATA
+    assert npy.array_equal(npy.isnan(cwd), npy.isinf(expected))
+    check_cwds(cwd, expected)
+    check_back_dirs(cwd, back_dir, source, resistance, 1.0)
+
+
+def test_max_dist_cut_off():
+    source, resistance = random_grid(5, nodata_frac=0.1)
+    expected = bellman_ford(source, resistance)
+    max_dist = float(npy.median(expected[npy.isfinite(expected)]))
+    cwd, back_dir = lm_cwd.cost_distance(source, resistance, max_dist=max_dist)
+    assert npy.array_equal(~npy.isnan(cwd), expected <= max_dist)
+    check_cwds(cwd, expected)
+    check_back_dirs(cwd, back_dir, source, resistance, 1.0)
+
+
+def test_target_margin_early_stop():
+    source, resistance = random_grid(6, shape=(20, 24))
+    source[:] = False
+    source[2, 2] = True
+    targets = npy.zeros(source.shape, dtype=bool)
+    targets[6:8, 7:9] = True
+    expected = bellman_ford(source, resistance)
+    margin = 5.0
+    stop_dist = expected[targets].max() + margin
+    cwd, back_dir = lm_cwd.cost_distance(source, resistance, targets=targets,
+                                         margin=margin)
+    assert not npy.isnan(cwd[targets]).any()
+    check_cwds(cwd, expected)
+    check_back_dirs(cwd, back_dir, source, resistance, 1.0)
+    # Stops once the frontier passes the farthest target plus margin
+    assert not npy.isnan(cwd[expected < stop_dist - 1e-6]).any()
+    assert npy.isnan(cwd[expected > stop_dist + 1e-6]).all()
+    assert npy.isnan(cwd).any()
+
@@ -0,0 +1,32 @@
+"""Tests of tiled cost allocation against a single allocation."""
+
+import numpy as npy
+
+import lm_cwd
+import lm_cwd_tiles
+
+
+def test_tiles_match_single_allocation(tmp_path):
+    rng = npy.random.RandomState(11)
+    shape = (37, 41)
+    resistance = rng.uniform(0.5, 10.0, shape)
+    resistance[rng.rand(*shape) < 0.1] = npy.nan
+    zones = -npy.ones(shape, dtype='int32')
+    zones[3, 4] = 1
+    zones[30:32, 35:37] = 2
+    zones[20, 10] = 3
+    cwd, alloc = lm_cwd.cost_allocation(zones, resistance, 2.0)
+
+    tiles = lm_cwd_tiles.TiledAllocation(str(tmp_path / 'tiles'), shape[0],
+                                         shape[1], 8, 2.0)
+    tiles.set_rows(0, resistance[:20], zones[:20])
+    tiles.set_rows(20, resistance[20:], zones[20:])
+    assert tiles.run() > tiles.tile_count[0] * tiles.tile_count[1]
+    tile_alloc, tile_cwd, tile_res = tiles.read((0, shape[0], 0, shape[1]))
+    tiles.delete()
+
+    assert npy.array_equal(npy.isnan(tile_cwd), npy.isnan(cwd))
+    reached = ~npy.isnan(cwd)
+    assert npy.allclose(tile_cwd[reached], cwd[reached], rtol=1e-12)
+    assert npy.array_equal(tile_alloc, alloc)
+    assert npy.array_equal(npy.isnan(tile_res), npy.isnan(resistance))
@@ -0,0 +1,89 @@
+"""Tests of the Euclidean allocation engine against a brute-force reference."""
+
+import numpy as npy
+
+import lm_euc
+
+
+def brute_force(zones):
+    """Return squared distance of each cell to the nearest zone cell."""
+    rows, cols = npy.indices(zones.shape)
+    zone_rows, zone_cols = npy.where(zones >= 0)
+    dist_sq = ((rows[..., npy.newaxis] - zone_rows) ** 2 +
+               (cols[..., npy.newaxis] - zone_cols) ** 2)
+    return dist_sq.min(axis=-1).astype('float64')
+
+
+def random_zones(seed, shape=(23, 19)):
+    """Return random zone array with a few small zones."""
+    rng = npy.random.RandomState(seed)
+    zones = npy.empty(shape, dtype='int32')
+    zones.fill(-1)
+    for zone in range(1, 6):
+        row = rng.randint(0, shape[0] - 2)
+        col = rng.randint(0, shape[1] - 2)
+        zones[row:row + rng.randint(1, 3), col:col + rng.randint(1, 3)] = zone
+    return zones
+
+
+def allocate_in_blocks(zones, block_rows):
+    """Allocate zones a block of rows at a time, as in euadjacency.
+
+    Blocks overlap by a row, as from lm_util.get_row_blocks.
+
+    """
+    nrows, ncols = zones.shape
+    blocks = []
+    r0 = 0
+    while True:
+        r1 = min(r0 + block_rows, nrows)
+        blocks.append((r0, r1))
+        if r1 >= nrows:
+            break
+        r0 = r1 - 1
+    above_states = []
+    state = lm_euc.column_state(ncols, zones.dtype)
+    for r0, r1 in blocks:
+        above_states.append((state[0].copy(), state[1].copy()))
+        lm_euc.scan_down(zones[r0:r1], r0, state)
+    alloc = npy.empty(zones.shape, dtype=zones.dtype)
+    dist_sq = npy.empty(zones.shape, dtype='float64')
+    below = lm_euc.column_state(ncols, zones.dtype)
+    for (r0, r1), above in reversed(list(zip(blocks, above_states))):
+        near_rows, near_zones = lm_euc.nearest_rows(zones[r0:r1], r0, above,
+                                                    below)
+        alloc[r0:r1], dist_sq[r0:r1] = lm_euc.euc_allocation(
+            near_rows, near_zones, r0)
+    return alloc, dist_sq
+
+
+def test_matches_brute_force():
+    for seed in range(4):
+        zones = random_zones(seed)
+        alloc, dist_sq = lm_euc.euc_allocation(*lm_euc.nearest_rows(zones))
+        assert npy.array_equal(dist_sq, brute_force(zones))
+        # Each cell is allocated to a zone at the nearest distance
+        rows, cols = npy.indices(zones.shape)
+        for zone in npy.unique(alloc):
+            in_zone = npy.where(zones == zone)
+            cells = alloc == zone
+            zone_dist = ((rows[cells][:, npy.newaxis] - in_zone[0]) ** 2 +
+                         (cols[cells][:, npy.newaxis] - in_zone[1]) ** 2)
+            assert npy.array_equal(zone_dist.min(axis=1), dist_sq[cells])
+
+
+def test_blocks_match_whole_grid():
+    for seed in range(4, 8):
+        zones = random_zones(seed)
+        whole = lm_euc.euc_allocation(*lm_euc.nearest_rows(zones))
+        for block_rows in (2, 5, 8):
+            alloc, dist_sq = allocate_in_blocks(zones, block_rows)
+            assert npy.array_equal(alloc, whole[0])
+            assert npy.array_equal(dist_sq, whole[1])
+
+
+def test_no_zones():
+    zones = -npy.ones((5, 6), dtype='int32')
+    alloc, dist_sq = lm_euc.euc_allocation(*lm_euc.nearest_rows(zones))
+    assert (alloc < 0).all()
+    assert npy.isinf(dist_sq).all()
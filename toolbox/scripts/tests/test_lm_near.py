@@ -0,0 +1,42 @@
+"""Tests of exact distances between core area polygons."""
+
+import lm_near
+
+
+def square(x, y, size):
+    """Return closed ring of a square with lower left corner at x, y."""
+    return [(x, y), (x, y + size), (x + size, y + size), (x + size, y),
+            (x, y)]
+
+
+def distances(rings1, rings2, spacing=1.0):
+    """Return distances between two core areas, both ways round."""
+    boundary1 = lm_near.CoreBoundary(rings1, spacing)
+    boundary2 = lm_near.CoreBoundary(rings2, spacing)
+    return (lm_near.boundary_distance(boundary1, boundary2),
+            lm_near.boundary_distance(boundary2, boundary1))
+
+
+def test_separate_squares():
+    assert distances([square(0, 0, 10)], [square(13, 14, 5)]) == (5.0, 5.0)
+
+
+def test_touching_squares():
+    assert distances([square(0, 0, 10)], [square(10, 3, 5)]) == (0.0, 0.0)
+
+
+def test_square_inside_square():
+    assert distances([square(0, 0, 10)], [square(4, 4, 2)]) == (0.0, 0.0)
+
+
+def test_multipart_core_with_part_inside():
+    # The first part is far away, so the closest boundaries are those of
+    # the second part, 4 units inside the square
+    multipart = [square(100, 100, 5), square(4, 4, 2)]
+    assert distances(multipart, [square(0, 0, 10)]) == (0.0, 0.0)
+
+
+def test_square_in_hole():
+    # A square inside the hole of a ring-shaped core area is outside it
+    ring_core = [square(0, 0, 20), square(5, 5, 10)]
+    assert distances(ring_core, [square(8, 8, 2)]) == (3.0, 3.0)